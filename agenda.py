@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+agenda.py -- materialized per-conference agenda
+
+Every session of a conference is kept in one Agenda entity (and in
+memcache) as a list of plain dicts sorted by (date, startTime, name),
+with the speaker name already resolved. Session listings are answered
+from it by binary search & filtering instead of ancestor queries.
+
+"""
+
+from bisect import bisect_left
+from bisect import bisect_right
+from bisect import insort
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Agenda
+from models import Session
+
+MEMCACHE_AGENDA_PREFIX = "AGENDA:"
+AGENDA_CACHE_TTL = 600
+# seconds a writer's delete keeps readers from re-adding the agenda they
+# read before the write
+AGENDA_CACHE_LOCK = 5
+AGENDA_ID = 'agenda'
+ENTRY_FIELDS = ('name', 'highlights', 'location', 'duration',
+                'durationMinutes', 'typeOfSession', 'organizerUserId')
+
+
+def agendaKey(c_key):
+    return ndb.Key(Agenda, AGENDA_ID, parent=c_key)
+
+
+def sessionEntry(session, speakerName):
+    """Return the agenda entry for a Session."""
+    entry = dict((field, getattr(session, field, None))
+                 for field in ENTRY_FIELDS)
+    entry['websafeKey'] = session.key.urlsafe()
+    entry['speaker'] = speakerName
+    entry['date'] = session.date.isoformat() if session.date else None
+    entry['startTime'] = (session.startTime.strftime('%H:%M:%S')
+                          if session.startTime else None)
+    return entry
+
+
+def _sortKey(entry):
+    return (entry['date'] or '', entry['startTime'] or '', entry['name'])
+
+
+class _Sorted(object):
+    """Entry list wrapper so bisect compares entries by sort key."""
+    def __init__(self, entry):
+        self.entry = entry
+        self.key = _sortKey(entry)
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+def _cache(c_key, entries):
+    # add, not set: never replace what a writer or newer reader left
+    memcache.add(MEMCACHE_AGENDA_PREFIX + c_key.urlsafe(), entries,
+                 time=AGENDA_CACHE_TTL)
+
+
+def _uncache(c_key):
+    memcache.delete(MEMCACHE_AGENDA_PREFIX + c_key.urlsafe(),
+                    seconds=AGENDA_CACHE_LOCK)
+
+
+@ndb.non_transactional
+def _speakerNames(s_keys):
+    """Return {speaker key: name}; read outside any transaction, as each
+    Speaker is an entity group of its own.
+    """
+    return dict((sp.key, sp.name) for sp in ndb.get_multi(s_keys) if sp)
+
+
+def buildAgenda(c_key):
+    """Return the agenda entries of a conference built from its
+    sessions (unsaved).
+    """
+    sessions = Session.query(ancestor=c_key).fetch()
+    names = _speakerNames(list(set(
+        ses.speaker for ses in sessions if ses.speaker)))
+    return sorted((sessionEntry(ses, names.get(ses.speaker))
+                   for ses in sessions), key=_sortKey)
+
+
+@ndb.transactional()
+def _createAgenda(c_key, entries):
+    """Store a built agenda unless one exists by now; returns the
+    stored Agenda and whether it is the one just built.
+    """
+    agenda = agendaKey(c_key).get()
+    if agenda is not None:
+        return agenda, False
+    agenda = Agenda(key=agendaKey(c_key), entries=entries)
+    agenda.put()
+    return agenda, True
+
+
+def getAgenda(c_key):
+    """Return the sorted agenda entries of a conference."""
+    entries = memcache.get(MEMCACHE_AGENDA_PREFIX + c_key.urlsafe())
+    if entries is not None:
+        return entries
+    agenda = agendaKey(c_key).get()
+    if agenda is None:
+        # a concurrent first build may already have stored a newer one
+        agenda, _ = _createAgenda(c_key, buildAgenda(c_key))
+    _cache(c_key, agenda.entries)
+    return agenda.entries
+
+
+def putSessions(c_key, sessions):
+    """Put new (session, speakerName) pairs of a conference, keys already
+    allocated, and insert them into its agenda in the same transaction.
+    """
+    entries = _putSessions(c_key, sessions)
+    # drop rather than set, so a slower concurrent writer can't leave
+    # an older agenda in memcache
+    _uncache(c_key)
+    return entries
+
+
+@ndb.transactional()
+def _putSessions(c_key, sessions):
+    agenda = agendaKey(c_key).get()
+    if agenda is None:
+        # first use: the ancestor query sees the sessions stored before
+        # this transaction began
+        agenda = Agenda(key=agendaKey(c_key), entries=buildAgenda(c_key))
+    ndb.put_multi([session for session, _ in sessions])
+    known = set(entry['websafeKey'] for entry in agenda.entries)
+    wrapped = [_Sorted(entry) for entry in agenda.entries]
+    for session, speakerName in sessions:
+        if session.key.urlsafe() not in known:
+            insort(wrapped, _Sorted(sessionEntry(session, speakerName)))
+    agenda.entries = [w.entry for w in wrapped]
+    agenda.put()
+    return agenda.entries
+
+
+@ndb.transactional()
+def rebuildAgenda(c_key):
+    """Rebuild a conference agenda from its sessions; returns whether it
+    had drifted.
+    """
+    agenda = agendaKey(c_key).get()
+    if agenda is None:
+        # built on first read
+        return False
+    entries = buildAgenda(c_key)
+    if agenda.entries == entries:
+        return False
+    Agenda(key=agendaKey(c_key), entries=entries).put()
+    ndb.get_context().call_on_commit(lambda: _uncache(c_key))
+    return True
+
+
+def entriesBetween(entries, date, startTime, endTime):
+    """Return entries on date starting within [startTime, endTime],
+    found by binary search on the sorted agenda.
+    """
+    keys = [(entry['date'] or '', entry['startTime'] or '')
+            for entry in entries]
+    lo = bisect_left(keys, (date.isoformat(),
+                            startTime.strftime('%H:%M:%S')))
+    hi = bisect_right(keys, (date.isoformat(),
+                             endTime.strftime('%H:%M:%S')))
+    return entries[lo:hi]
+
+
+def entriesOfType(entries, typeOfSession):
+    """Return entries of the given session type, in agenda order."""
+    return [entry for entry in entries
+            if entry['typeOfSession'] == typeOfSession]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+cache.py -- memcache values recomputed without stampedes
+
+getCached() keeps a value in memcache with a soft expiry. Once the soft
+expiry passes (a little early, at random, so callers don't all notice
+at once), the value is missing, or it was invalidated, one caller wins a
+short lease and recomputes it while the others keep serving the stale
+value, or briefly wait for the winner when there is nothing to serve.
+The winner writes with compare-and-set, so a recompute overlapping an
+invalidation never overwrites the newer state. A value under the key
+that isn't such an entry (one cached before the key used getCached) is
+a miss, and is replaced.
+
+"""
+
+import logging
+import random
+import time
+
+from google.appengine.api import memcache
+
+LEASE_SUFFIX = ':lease'
+LEASE_SECONDS = 10
+EARLY_REFRESH = 0.1
+WAIT_INTERVAL = 0.05
+WAIT_ATTEMPTS = 20
+CAS_RETRIES = 3
+
+
+def _entry(value, soft_ttl, has_value=True):
+    return {'value': value, 'hasValue': has_value,
+            'softExpires': time.time() + soft_ttl if has_value else 0}
+
+
+def _hasValue(entry):
+    return (isinstance(entry, dict) and 'softExpires' in entry and
+            entry.get('hasValue', False))
+
+
+def _isStale(entry, soft_ttl):
+    margin = random.random() * EARLY_REFRESH * soft_ttl
+    return time.time() >= entry['softExpires'] - margin
+
+
+def getCached(key, compute, soft_ttl=60, ttl=0):
+    """Return the value cached under key, recomputing it with compute()
+    once it is stale; at most one caller recomputes at a time.
+    ttl is the memcache expiry (0: none).
+    """
+    client = memcache.Client()
+    entry = client.gets(key)
+    present = entry is not None
+    if not _hasValue(entry):
+        entry = None
+    elif not _isStale(entry, soft_ttl):
+        return entry['value']
+
+    if client.add(key + LEASE_SUFFIX, 1, time=LEASE_SECONDS):
+        try:
+            value = compute()
+            new = _entry(value, soft_ttl)
+            stored = (client.cas(key, new, time=ttl) if present
+                      else client.add(key, new, time=ttl))
+            if not stored:
+                logging.info('Not caching %s: changed while computing', key)
+            return value
+        finally:
+            client.delete(key + LEASE_SUFFIX)
+
+    # another caller is recomputing: serve the stale value meanwhile
+    if entry is not None:
+        return entry['value']
+    for _ in range(WAIT_ATTEMPTS):
+        time.sleep(WAIT_INTERVAL)
+        entry = client.get(key)
+        if _hasValue(entry):
+            return entry['value']
+    return compute()
+
+
+def invalidateCached(key):
+    """Mark key's value stale; readers keep getting the old value until
+    a single recompute replaces it.
+    """
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        entry = client.gets(key)
+        if entry is None:
+            if client.add(key, _entry(None, 0, has_value=False)):
+                return
+        elif not _hasValue(entry):
+            if client.cas(key, _entry(None, 0, has_value=False)):
+                return
+        else:
+            entry['softExpires'] = 0
+            if client.cas(key, entry):
+                return
+    client.set(key, _entry(None, 0, has_value=False))
+
+
+def refreshCached(key, compute, soft_ttl=60, ttl=0):
+    """Recompute key's value now (unless a recompute is under way)."""
+    invalidateCached(key)
+    return getCached(key, compute, soft_ttl, ttl)
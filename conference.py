@@ -12,6 +12,12 @@ created on 2014 apr 21
 
 
 from datetime import datetime, time as timed
+import hashlib
+import json
+import logging
+import time
+import uuid
+
 import endpoints
 from protorpc import messages
 from protorpc import message_types
@@ -19,6 +25,7 @@ from protorpc import remote
 
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 from models import ConflictException
@@ -27,11 +34,18 @@ from models import ProfileMiniForm
 from models import ProfileForm
 from models import StringMessage
 from models import BooleanMessage
+from models import IntegerMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
-from models import Speaker
+from models import ConferenceStatForm
+from models import ConferenceStatForms
+from models import DashboardForm
+from models import FacetForm
+from models import FeaturedSpeaker
 from models import SpeakerForm
+from models import SpeakerInfoForm
+from models import SpeakerInfoForms
 from models import Session
 from models import SessionForm
 from models import SessionForms
@@ -40,19 +54,90 @@ from models import ConferenceQueryForms
 from models import SessionQueryForm
 from models import SessionQueryForms
 from models import SessionGetRequest
+from models import Attendance
+from models import AttendeeForm
+from models import AttendeeForms
+from models import Registration
+from models import RegistrationStatus
+from models import RegistrationTicket
+from models import RegistrationTicketForm
+from models import ScheduleSlotForm
+from models import SeatsForm
 from models import TeeShirtSize
+from models import WaitlistEntry
+from models import WishlistAddForm
+from models import WishlistConflictForm
+from models import WishlistConflictForms
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
+from agenda import getAgenda
+from agenda import putSessions
+from cache import getCached
+from cache import refreshCached
+from facets import FACET_FIELDS
+from facets import GLOBAL_CONTEXT
+from facets import facetValues
+from facets import getFacets
+from facets import queryContext
+from geo import distanceKm
+from geo import locateConference
+from geo import searchCells
+from notifications import queueNotification
+from ratelimit import rateLimited
+from recommendations import TOP_K
+from recommendations import recommendSessions
+from recommendations import recommendationsKey
+from schedule import addToSchedule
+from schedule import allConflicts
+from schedule import buildSchedule
+from schedule import formatMinutes
+from schedule import parseDuration
+from schedule import scheduleKey
+from seats import seatsChanged
+from seats import watchSeats
+from speakers import addSpeakerSession
+from speakers import getSpeaker
+from speakers import normalizeSpeakerName
+from speakers import speakerKey
+from stats import COUNTERS
+from stats import DIMENSIONS
+from stats import conferenceDelta
+from stats import getStats
+from stats import queueDelta
+from stats import registrationDelta
+from storage_ndb import NdbRepository
+from storage_ndb import conferenceParentKey
 from utils import getUserId
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+ANNOUNCEMENT_SOFT_TTL = 3600
+FEATURED_SPEAKER_SOFT_TTL = 600
+FEATURED_SPEAKER_ID = 'featured'
+WARMUP_CONFERENCES = 20
+MEMCACHE_TICKET_PREFIX = "REGISTRATION_TICKET:"
+REGISTRATION_PULL_QUEUE = 'registration-pull'
+REGISTRATION_BATCH_SIZE = 100
+REGISTRATION_BATCH_INTERVAL = 2
+REGISTRATION_LEASE_SECONDS = 60
+TICKET_TTL = 3600
+ATTENDEE_PAGE_SIZE = 50
+ATTENDEE_MAX_PAGE_SIZE = 500
+NEARBY_RADIUS_KM = 50
+NEARBY_MAX_RADIUS_KM = 500
+NEARBY_SCAN_LIMIT = 500
+NEARBY_MAX_RESULTS = 100
+RECOMMENDATIONS_LIMIT = 5
+SEATS_WATCH_TIMEOUT = 25
+SEATS_WATCH_MAX_TIMEOUT = 50
+SPEAKER_PAGE_SIZE = 20
+SPEAKER_MAX_PAGE_SIZE = 100
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -133,6 +218,50 @@ SESSION_QUERY_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+TICKET_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ticket=messages.StringField(1),
+)
+
+ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+STATS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    dimension=messages.StringField(1),
+)
+
+NEARBY_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    latitude=messages.FloatField(1, required=True),
+    longitude=messages.FloatField(2, required=True),
+    radiusKm=messages.FloatField(3),
+    fromDate=messages.StringField(4),
+    toDate=messages.StringField(5),
+)
+
+RECOMMENDED_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    limit=messages.IntegerField(2),
+)
+
+SEATS_WATCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    version=messages.IntegerField(2),
+    timeout=messages.IntegerField(3),
+)
+
+SPEAKER_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+)
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -143,6 +272,10 @@ SESSION_QUERY_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+    # the read endpoints go through this storage.Repository; tools can
+    # swap in another engine
+    repository = NdbRepository()
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
     def _copyConferenceToForm(self, conf, displayName):
@@ -162,6 +295,25 @@ class ConferenceApi(remote.Service):
         cf.check_initialized()
         return cf
 
+    def _copyConferenceRecordToForm(self, conf, displayName):
+        """Copy relevant fields from a conference record to
+        ConferenceForm.
+        """
+        cf = ConferenceForm()
+        for field in cf.all_fields():
+            if field.name in conf:
+                # convert Date to date string; just copy others
+                if field.name.endswith('Date'):
+                    setattr(cf, field.name, str(conf[field.name]))
+                else:
+                    setattr(cf, field.name, conf[field.name])
+            elif field.name == "websafeKey":
+                setattr(cf, field.name, str(conf['id']))
+        if displayName:
+            setattr(cf, 'organizerDisplayName', displayName)
+        cf.check_initialized()
+        return cf
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm."""
         # preload necessary data items
@@ -179,6 +331,8 @@ class ConferenceApi(remote.Service):
                 for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['distanceKm']
+        self._checkCoordinates(data['latitude'], data['longitude'])
 
         # add default values for those missing
         # (both data model & outbound Message)
@@ -203,22 +357,66 @@ class ConferenceApi(remote.Service):
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
 
-        # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
-        p_key = ndb.Key(Profile, user_id)
+        # allocate the Conference key under the organizer's Profile key
+        # (or as a root key, depending on CONFERENCE_KEY_STRATEGY)
+        p_key = conferenceParentKey(user_id)
         c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
+        # locate it (from the city if no coordinates were given) for
+        # queryConferencesNearby
+        conf = Conference(statsCounted=True, **data)
+        locateConference(conf)
+        request.latitude, request.longitude = conf.latitude, conf.longitude
+
+        # create Conference, queue email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-                              'conferenceInfo': repr(request)},
-                      url='/tasks/send_confirmation_email')
+        self._putNewConference(conf, user.email())
         return request
 
+    def _checkCoordinates(self, latitude, longitude):
+        """Bail unless coordinates are both given & in range, or both
+        missing.
+        """
+        if latitude is None and longitude is None:
+            return
+        if latitude is None or longitude is None or \
+                not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise endpoints.BadRequestException(
+                "'latitude' and 'longitude' must be given together, "
+                "within [-90, 90] and [-180, 180].")
+
+    @staticmethod
+    @ndb.transactional()
+    def _putNewConference(conf, email=None):
+        """Store a new Conference and queue its statistics delta and the
+        organizer's confirmation email with it.
+        """
+        conf.put()
+        queueDelta(conferenceDelta(conf), 'conference-' + conf.key.urlsafe(),
+                   transactional=True, facets=[[1, facetValues(conf)]])
+        if email:
+            queueNotification(
+                email, 'You created a new Conference!',
+                'Hi, you have created the following conference:\r\n\r\n%s'
+                % ConferenceApi._conferenceSummary(conf), transactional=True)
+
+    @staticmethod
+    def _conferenceSummary(conf):
+        """Return a short plain text description of a Conference."""
+        lines = [conf.name]
+        if conf.city:
+            lines.append('City: %s' % conf.city)
+        if conf.startDate:
+            lines.append('Dates: %s - %s' % (conf.startDate,
+                                             conf.endDate or conf.startDate))
+        if conf.topics:
+            lines.append('Topics: %s' % ', '.join(conf.topics))
+        lines.append('Max attendees: %s' % (conf.maxAttendees or 0))
+        return '\r\n'.join(lines)
+
     @ndb.transactional()
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
@@ -243,6 +441,13 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        # move the conference's statistics from its old values to its new
+        registered = (conf.maxAttendees or 0) - (conf.seatsAvailable or 0)
+        delta = conferenceDelta(conf, -1, registered)
+        old_facets = facetValues(conf)
+        old_city = conf.city
+        self._checkCoordinates(request.latitude, request.longitude)
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
@@ -256,12 +461,23 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+        # a new city without new coordinates is located afresh
+        if conf.city != old_city and request.latitude is None:
+            conf.latitude = conf.longitude = None
+        locateConference(conf)
+        seatsChanged(conf)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        if conf.statsCounted:
+            new_facets = facetValues(conf)
+            queueDelta(delta + conferenceDelta(conf, 1, registered),
+                       transactional=True,
+                       facets=([[-1, old_facets], [1, new_facets]]
+                               if new_facets != old_facets else None))
+        return conf
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
+    @rateLimited()
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -271,23 +487,23 @@ class ConferenceApi(remote.Service):
                       http_method='PUT', name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        conf = self._updateConferenceObject(request)
+        # read outside the transaction: under the 'flat' key strategy the
+        # organizer's Profile is in another entity group
+        prof = ndb.Key(Profile, conf.organizerUserId).get()
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s'
-                % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        # get conference record from request; bail if not found
+        conf = self._getConferenceRecord(request.websafeConferenceKey)
+        prof = self.repository.getProfile(conf['organizerUserId'])
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferenceRecordToForm(
+            conf, prof and prof['displayName'])
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='getConferencesCreated',
@@ -301,34 +517,29 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs = self.repository.getConferencesCreated(user_id)
+        prof = self.repository.getProfile(user_id)
 
-        # return set of ConferenceForm objects per Conference
+        # return set of ConferenceForm objects per conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                    conf, getattr(prof, 'displayName')) for conf in confs])
+            items=[self._copyConferenceRecordToForm(
+                    conf, prof and prof['displayName']) for conf in confs])
 
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
+        """Return the repository's (field, operator, value) filters from
+        the submitted filters.
+        """
+        filters = []
+        for filtr in self._formatFilters(request.filters)[1]:
             if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(
-                filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on %s needs a number." % filtr["field"])
+            filters.append(
+                (filtr["field"], filtr["operator"], filtr["value"]))
+        return filters
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
@@ -364,28 +575,114 @@ class ConferenceApi(remote.Service):
                       path='queryConferences',
                       http_method='POST',
                       name='queryConferences')
+    @rateLimited()
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId))
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        """Query for conferences, optionally with facet counts for the
+        fields not filtered on.
+        """
+        try:
+            conferences = self.repository.queryConferences(
+                self._getQuery(request))
+        except ValueError as e:
+            # e.g. a session-only field such as typeOfSession
+            raise endpoints.BadRequestException(str(e))
+
+        # need to fetch organiser displayName from profiles, in one batch
+        organisers = list(set(conf['organizerUserId']
+                              for conf in conferences))
+        profiles = self.repository.getProfiles(organisers)
 
         # put display names in a dict for easier fetching
         names = {}
         for profile in profiles:
             if profile:
-                names[profile.key.id()] = profile.displayName
+                names[profile['userId']] = profile['displayName']
 
-        # return individual ConferenceForm object per Conference
+        # return individual ConferenceForm object per conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(
-                    conf, names[conf.organizerUserId]) for conf in conferences]
+                items=[self._copyConferenceRecordToForm(
+                    conf, names.get(conf['organizerUserId']))
+                    for conf in conferences],
+                facets=self._getFacetForms(request)
         )
 
+    def _getFacetForms(self, request):
+        """Return FacetForms for the query's filter context from the facet
+        index; none if not requested or the filters aren't indexed.
+        """
+        if not request.includeFacets:
+            return []
+        context = queryContext(self._formatFilters(request.filters)[1])
+        if context is None:
+            return []
+        facets = getFacets(context)
+        return [FacetForm(field=FACET_FIELDS[field], value=value,
+                          count=count)
+                for field in sorted(facets)
+                for value, count in sorted(facets[field].iteritems())
+                if count > 0]
+
+    @endpoints.method(NEARBY_GET_REQUEST, ConferenceForms,
+                      path='conferences/nearby',
+                      http_method='GET', name='queryConferencesNearby')
+    @rateLimited()
+    def queryConferencesNearby(self, request):
+        """Return conferences within radiusKm of a point, nearest first,
+        optionally starting between fromDate and toDate.
+        """
+        return self._queryConferencesNearbyAsync(request).get_result()
+
+    @ndb.tasklet
+    def _queryConferencesNearbyAsync(self, request):
+        """Tasklet behind queryConferencesNearby()."""
+        self._checkCoordinates(request.latitude, request.longitude)
+        radius = request.radiusKm or NEARBY_RADIUS_KM
+        if not 0 < radius <= NEARBY_MAX_RADIUS_KM:
+            raise endpoints.BadRequestException(
+                "'radiusKm' must be within (0, %d]." % NEARBY_MAX_RADIUS_KM)
+        date_filters = []
+        try:
+            if request.fromDate:
+                date_filters.append(Conference.startDate >= datetime.strptime(
+                    request.fromDate, "%Y-%m-%d").date())
+            if request.toDate:
+                date_filters.append(Conference.startDate <= datetime.strptime(
+                    request.toDate, "%Y-%m-%d").date())
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'fromDate' and 'toDate' must be YYYY-MM-DD.")
+
+        # one equality scan per covering geohash cell, all in flight
+        # together
+        cells = searchCells(request.latitude, request.longitude, radius)
+        results = yield [Conference.query(Conference.geoCells == cell,
+                                          *date_filters).fetch_async(
+                                              NEARBY_SCAN_LIMIT)
+                         for cell in cells]
+
+        # exact distances drop the parts of the cells outside the radius
+        nearby = []
+        for conf in (conf for confs in results for conf in confs):
+            distance = distanceKm(request.latitude, request.longitude,
+                                  conf.latitude, conf.longitude)
+            if distance <= radius:
+                nearby.append((distance, conf))
+        nearby.sort(key=lambda item: item[0])
+        nearby = nearby[:NEARBY_MAX_RESULTS]
+
+        profiles = yield ndb.get_multi_async(
+            list(set(ndb.Key(Profile, conf.organizerUserId)
+                     for _, conf in nearby)))
+        names = dict((prof.key.id(), prof.displayName)
+                     for prof in profiles if prof)
+        forms = []
+        for distance, conf in nearby:
+            form = self._copyConferenceToForm(
+                conf, names.get(conf.organizerUserId))
+            form.distanceKm = round(distance, 2)
+            forms.append(form)
+        raise ndb.Return(ConferenceForms(items=forms))
+
 # - - - Session objects - - - - - - - - - - - - - - - - - -
 
     def _copySessionToForm(self, session, conferenceName):
@@ -410,6 +707,56 @@ class ConferenceApi(remote.Service):
         sf.check_initialized()
         return sf
 
+    def _copyAgendaEntryToForm(self, entry, conferenceName):
+        """Copy relevant fields from an agenda entry to SessionForm."""
+        sf = SessionForm()
+        for field in sf.all_fields():
+            if field.name in entry:
+                # keep the str() form _copySessionToForm gives dates
+                if field.name.endswith(('date', 'Time')):
+                    setattr(sf, field.name, str(entry[field.name]))
+                else:
+                    setattr(sf, field.name, entry[field.name])
+        if conferenceName:
+            setattr(sf, 'conferenceName', conferenceName)
+        sf.check_initialized()
+        return sf
+
+    def _copySessionRecordToForm(self, session, conferenceName):
+        """Copy relevant fields from a session record to SessionForm."""
+        sf = SessionForm()
+        for field in sf.all_fields():
+            if field.name in session:
+                # keep the str() form _copySessionToForm gives dates
+                if field.name.endswith(('date', 'Time')):
+                    setattr(sf, field.name, str(session[field.name]))
+                else:
+                    setattr(sf, field.name, session[field.name])
+            elif field.name == "websafeKey":
+                setattr(sf, field.name, str(session['id']))
+        if conferenceName:
+            setattr(sf, 'conferenceName', conferenceName)
+        sf.check_initialized()
+        return sf
+
+    def _getConference(self, websafeConferenceKey):
+        """Return Conference for a websafe key; bail if not found."""
+        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafeConferenceKey)
+        return conf
+
+    def _getConferenceRecord(self, websafeConferenceKey):
+        """Return the repository's conference record for a websafe key;
+        bail if not found.
+        """
+        conf = self.repository.getConference(websafeConferenceKey)
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafeConferenceKey)
+        return conf
+
     def _createSessionObject(self, request):
         """Create or update Session object, returning SessionForm/request."""
         # preload necessary data items
@@ -443,6 +790,10 @@ class ConferenceApi(remote.Service):
                 data[df] = DEFAULTS_SESSION[df]
                 setattr(request, df, DEFAULTS_SESSION[df])
 
+        # keep the free-text duration in minutes for schedule checks
+        if not data['durationMinutes']:
+            data['durationMinutes'] = parseDuration(data['duration'])
+
         # convert dates from strings to Date objects;
         if data['date']:
             data['date'] = datetime.strptime(
@@ -451,14 +802,12 @@ class ConferenceApi(remote.Service):
             data['startTime'] = datetime.strptime(
                 data['startTime'][:10], "%H:%M").time()
 
-        # generate speaker key based on the speaker name
-        speaker_key = ndb.Key(Speaker, data['speaker'])
-        speaker = speaker_key.get()
-        # create new Speaker if not there
-        if not speaker:
-            speaker = Speaker(name=data['speaker'], key=speaker_key)
-            speaker.put()
-        data['speaker'] = speaker_key
+        # speakers are keyed by their normalized name
+        speaker_name = data['speaker']
+        if not normalizeSpeakerName(speaker_name):
+            raise endpoints.BadRequestException(
+                "Session 'speaker' field required")
+        data['speaker'] = speakerKey(speaker_name)
 
         # generate Profile Key based on user ID and Session
         # ID based on Profile key get Session key from ID
@@ -468,24 +817,34 @@ class ConferenceApi(remote.Service):
 
         data['key'] = s_key
         data['organizerUserId'] = request.organizerUserId = user_id
-        Session(**data).put()
+        ses = Session(**data)
+
+        # store the session & its agenda entry together, under the name
+        # the directory already has for the speaker
+        speaker = getSpeaker(speaker_name)
+        putSessions(c_key, [(ses, speaker.name if speaker else
+                             ' '.join(speaker_name.split()))])
+
+        # record the session in the speaker directory (creating the
+        # Speaker if not there)
+        speaker = addSpeakerSession(speaker_name, s_key, conf.name)
 
         # check if speaker has other sessions; if so, add to memcache
-        speaker_sessions = Session.query(
-            Session.speaker == speaker_key, ancestor=c_key).fetch()
+        speaker_sessions = [ses for ses in ndb.get_multi(
+            [k for k in speaker.sessionKeys if k.parent() == c_key]) if ses]
         if len(speaker_sessions) > 1:
-            speakerName = speaker_key.get().name
+            speakerName = speaker.name
             sessionNames = [
                 str(session.name) for session in speaker_sessions]
             # add to taskqueue
             taskqueue.add(
                 params={'speakerName': speakerName,
-                        'sessionNames': [sessionNames]},
+                        'sessionNames': [sessionNames],
+                        'queuedAt': time.time()},
                 url='/tasks/update_featured_speaker'
             )
 
         # return request
-        ses = s_key.get()
         return self._copySessionToForm(ses, getattr(conf, 'name'))
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
@@ -500,35 +859,55 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
         """Return Sessions given by a speaker."""
-        speaker = Speaker.query(Speaker.name == request.speaker).get()
-        if speaker is None:
+        sessions = self.repository.getSpeakerSessions(request.speaker)
+        if not sessions:
             raise endpoints.NotFoundException(
                 'No session found to be given by this speaker: %s'
                 % request.speaker)
 
-        sessions = Session.query(Session.speaker == speaker.key).fetch()
+        # fetch all parent conferences in one batch for their names
+        conf_ids = list(set(ses['conferenceId'] for ses in sessions))
+        names = dict((conf['id'], conf['name']) for conf in
+                     self.repository.getConferences(conf_ids) if conf)
 
-        # return set of ConferenceForm objects per Conference
+        # return set of SessionForm objects per session
         return SessionForms(
-            items=[self._copySessionToForm(
-                ses, getattr(ses.key.parent().get(), 'name'))
+            items=[self._copySessionRecordToForm(
+                ses, names.get(ses['conferenceId']))
                     for ses in sessions])
 
+    @endpoints.method(SPEAKER_LIST_REQUEST, SpeakerInfoForms,
+                      path='speakers',
+                      http_method='GET', name='listSpeakers')
+    def listSpeakers(self, request):
+        """Return a page of the speaker directory, ordered by name."""
+        page_size = min(request.pageSize or SPEAKER_PAGE_SIZE,
+                        SPEAKER_MAX_PAGE_SIZE)
+        try:
+            speakers, next_token = self.repository.listSpeakers(
+                page_size, request.pageToken)
+        except ValueError:
+            raise endpoints.BadRequestException('Invalid pageToken.')
+        return SpeakerInfoForms(
+            items=[SpeakerInfoForm(name=speaker['name'],
+                                   sessionCount=speaker['sessionCount'],
+                                   conferenceNames=speaker['conferenceNames'])
+                   for speaker in speakers],
+            nextPageToken=next_token)
+
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
                       path='querySession/{websafeConferenceKey}',
                       http_method='GET',
                       name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Query for conference sessions."""
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-
-        # need to fetch all session in the conference
-        sessions = Session.query(ancestor=conf.key)
+        conf = self._getConferenceRecord(request.websafeConferenceKey)
+        sessions = self.repository.getConferenceSessions(conf['id'])
 
-        # return individual SessionForm object per Session
+        # return individual SessionForm object per session
         return SessionForms(
-                items=[self._copySessionToForm(
-                    ses, getattr(conf, 'name')) for ses in sessions])
+                items=[self._copySessionRecordToForm(ses, conf['name'])
+                       for ses in sessions])
 
     @endpoints.method(SESSION_GET_TYPE_REQUEST, SessionForms,
                       path='querySession/{websafeConferenceKey}',
@@ -536,15 +915,14 @@ class ConferenceApi(remote.Service):
                       name='getConferenceSessionsByType')
     def getConferenceSessionsByType(self, request):
         """Query for sessions by type."""
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-
-        sessions = Session.query(
-            Session.typeOfSession == request.typeOfSession).fetch()
+        conf = self._getConferenceRecord(request.websafeConferenceKey)
+        sessions = self.repository.getConferenceSessions(
+            conf['id'], request.typeOfSession)
 
         # return individual SessionForm object per session
         return SessionForms(
-                items=[self._copySessionToForm(
-                    ses, getattr(conf, 'name')) for ses in sessions])
+                items=[self._copySessionRecordToForm(ses, conf['name'])
+                       for ses in sessions])
 
     @endpoints.method(SESSION_QUERY_REQUEST, SessionForms,
                       path='queryConfSessions/{websafeConferenceKey}',
@@ -581,17 +959,18 @@ class ConferenceApi(remote.Service):
 
 # - - User Wishlist - - - - - - - - - - - - - - - - - -
 
-    @endpoints.method(SESSION_GET_REQUEST, BooleanMessage,
+    @endpoints.method(SESSION_GET_REQUEST, WishlistAddForm,
                       path='sessionWishlist/{sessionKey}',
                       http_method='GET', name='addSessionToWishlist')
+    @rateLimited()
     def addSessionToWishlist(self, request):
-        """Add the selected session to the user's wishlist."""
-        retval = None
+        """Add the selected session to the user's wishlist; returns the
+        wishlisted sessions it overlaps.
+        """
         # preload necessary data items
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-        # user_id = getUserId(user)
         prof = self._getProfileFromUser()  # get user Profile
 
         ses = ndb.Key(urlsafe=request.sessionKey).get()
@@ -600,50 +979,143 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % request.sessionKey)
 
-        conf = ses.key.parent().get()
-        if conf.key.urlsafe() not in prof.conferenceKeysToAttend:
+        if not self._isRegistered(prof, ses.key.parent()):
             raise endpoints.ForbiddenException(
-                "You have to register the conference before " /
+                "You have to register the conference before "
                 "you can add this session to your wishlist.")
 
+        # profile & schedule share the profile's entity group; building
+        # a missing schedule reads the conference's sessions too
+        conflicts = ndb.transaction(
+            lambda: ConferenceApi._addToWishlist(prof.key, ses), xg=True)
+        return WishlistAddForm(data=True, conflicts=[
+            self._copySlotToForm(entry) for entry in conflicts or []])
+
+    @staticmethod
+    def _addToWishlist(p_key, ses):
+        """Wishlist ses & index it in the user's conference schedule;
+        returns the entries it overlaps. Run in a transaction.
+        """
+        prof = p_key.get()
         # check if user already added this session to their wishlist.
-        sesKey = request.sessionKey
-        if sesKey in prof.sessionWishlist:
+        wssk = ses.key.urlsafe()
+        if wssk in prof.sessionWishlist:
             raise ConflictException(
                 "You have already add this session to your wishlist.")
 
-        prof.sessionWishlist.append(sesKey)
-        retval = True
+        c_key = ses.key.parent()
+        schedule = scheduleKey(p_key, c_key).get()
+        if schedule is None:
+            schedule = buildSchedule(p_key, c_key, prof.sessionWishlist)
+        prof.sessionWishlist.append(wssk)
+        conflicts = addToSchedule(schedule, ses)
 
         # write things back to the datastore & return
-        prof.put()
-        return BooleanMessage(data=retval)
+        ndb.put_multi([prof, schedule])
+        return conflicts
+
+    @staticmethod
+    def _buildWishlistSchedule(p_key, c_key):
+        """Return the user's conference schedule, building & storing it
+        from the current wishlist unless a concurrent _addToWishlist
+        stored one first. Run in a transaction.
+        """
+        schedule = scheduleKey(p_key, c_key).get()
+        if schedule is None:
+            schedule = buildSchedule(p_key, c_key, p_key.get().sessionWishlist)
+            schedule.put()
+        return schedule
+
+    def _copySlotToForm(self, entry):
+        """Copy a schedule entry to ScheduleSlotForm."""
+        start, end, websafeKey, name = entry
+        return ScheduleSlotForm(websafeKey=websafeKey, name=name,
+                                start=formatMinutes(start),
+                                end=formatMinutes(end))
+
+    @endpoints.method(CONF_GET_REQUEST, WishlistConflictForms,
+                      path='wishlistConflicts/{websafeConferenceKey}',
+                      http_method='GET', name='getWishlistConflicts')
+    def getWishlistConflicts(self, request):
+        """List the overlapping pairs of the user's wishlisted sessions
+        in a conference.
+        """
+        conf = self._getConference(request.websafeConferenceKey)
+        prof = self._getProfileFromUser()
+        schedule = scheduleKey(prof.key, conf.key).get()
+        if schedule is None:
+            # like _addToWishlist: profile & schedule in one group, plus
+            # the conference's sessions
+            schedule = ndb.transaction(
+                lambda: ConferenceApi._buildWishlistSchedule(prof.key,
+                                                             conf.key),
+                xg=True)
+        return WishlistConflictForms(items=[
+            WishlistConflictForm(first=self._copySlotToForm(first),
+                                 second=self._copySlotToForm(second))
+            for first, second in allConflicts(schedule)])
 
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
                       path='sessionsInWishlist/{websafeConferenceKey}',
                       http_method='GET', name='getConfSessionsInWishlist')
     def getConfSessionsInWishlist(self, request):
         """Get all the conference sessions in the user wishlist."""
+        return self._getConfSessionsInWishlistAsync(
+            request.websafeConferenceKey).get_result()
+
+    @ndb.tasklet
+    def _getConfSessionsInWishlistAsync(self, websafeConferenceKey):
+        """Tasklet behind getConfSessionsInWishlist()."""
+        # conference and user Profile are independent; fetch together
+        conf, prof = yield (ndb.Key(urlsafe=websafeConferenceKey).get_async(),
+                            self._getProfileFromUserAsync())
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafeConferenceKey)
 
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-
-        # need to fetch all session in the conference
-        conf_sessions = Session.query(ancestor=conf.key)
-        confSes_keys = [ses.key for ses in conf_sessions]
-        prof = self._getProfileFromUser()  # get user Profile
-
-        wishlist_keys = [ndb.Key(urlsafe=wsck)
-                         for wsck in prof.sessionWishlist]
+        # sessions are children of their conference, so the wishlist keys
+        # can be matched on parent without an ancestor query
+        session_keys = [s_key for s_key in
+                        (ndb.Key(urlsafe=wssk) for wssk in prof.sessionWishlist)
+                        if s_key.parent() == conf.key]
+        sessions = yield ndb.get_multi_async(session_keys)
 
-        session_keys = []
-        for s_key in wishlist_keys:
-            if s_key in confSes_keys:
-                session_keys.append(s_key)
-        sessions = ndb.get_multi(session_keys)
+        # warm the context cache with all speakers in one batch
+        yield ndb.get_multi_async(
+            list(set(ses.speaker for ses in sessions if ses and ses.speaker)))
 
         # return set of SessionForm objects per Session
-        return SessionForms(items=[self._copySessionToForm(
-                            ses, getattr(conf, 'name')) for ses in sessions])
+        raise ndb.Return(SessionForms(items=[self._copySessionToForm(
+            ses, getattr(conf, 'name')) for ses in sessions if ses]))
+
+    @endpoints.method(RECOMMENDED_GET_REQUEST, SessionForms,
+                      path='recommendedSessions/{websafeConferenceKey}',
+                      http_method='GET', name='getRecommendedSessions')
+    def getRecommendedSessions(self, request):
+        """Recommend conference sessions from the ones in the user's
+        wishlist; the most wishlisted ones if it has none yet.
+        """
+        limit = request.limit or RECOMMENDATIONS_LIMIT
+        if limit < 1:
+            raise endpoints.BadRequestException("'limit' must be positive.")
+        prof = self._getProfileFromUser()
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf, recs = ndb.get_multi([c_key, recommendationsKey(c_key)])
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s'
+                % request.websafeConferenceKey)
+        if not recs:
+            return SessionForms(items=[])
+
+        # render from the (memcached) agenda rather than the sessions
+        wssks = recommendSessions(recs, prof.sessionWishlist,
+                                  min(limit, TOP_K))
+        entries = dict((entry['websafeKey'], entry)
+                       for entry in getAgenda(c_key))
+        return SessionForms(items=[
+            self._copyAgendaEntryToForm(entries[wssk], conf.name)
+            for wssk in wssks if wssk in entries])
 
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='queryNonWorkshopSessions',
@@ -671,31 +1143,20 @@ class ConferenceApi(remote.Service):
         """Query for conference sessions between a specific date and time
         and then sort it based on the start time.
         """
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-
-        # raise exception if no conference found
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % wsck)
+        conf = self._getConferenceRecord(request.websafeConferenceKey)
         # convert dates from strings to Date objects;
         date = datetime.strptime(request.date, "%Y-%m-%d").date()
         start_time = datetime.strptime(request.startTime, "%H:%M").time()
         end_time = datetime.strptime(request.endTime, "%H:%M").time()
-        # query for all sessions in the requested date
-        sessions = Session.query(
-            ancestor=conf.key).filter(Session.date == date)
 
-        # query all sessions that are held between the requested time
-        # and sort it in order
-        query_sessions = sessions.filter(
-            ndb.AND(Session.startTime >= start_time,
-                    Session.startTime <= end_time)
-            ).order(Session.startTime)
+        # sessions held between the requested times, by start time
+        sessions = self.repository.getSessionsBetween(
+            conf['id'], date, start_time, end_time)
 
         # return individual SessionForm object per session
         return SessionForms(
-                items=[self._copySessionToForm(
-                    ses, getattr(conf, 'name'))for ses in query_sessions])
+                items=[self._copySessionRecordToForm(ses, conf['name'])
+                       for ses in sessions])
 
     @endpoints.method(SESSION_GET_CD_REQUEST, SessionForms,
                       path='getSessionsByCityAndDate',
@@ -735,8 +1196,10 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """Returns the sessions of the featured speaker"""
-        # attempt to get data from memcache
-        data = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY)
+        # get data from memcache, reloading it from the datastore if stale
+        data = getCached(MEMCACHE_FEATURED_SPEAKER_KEY,
+                         ConferenceApi._loadFeaturedSpeaker,
+                         FEATURED_SPEAKER_SOFT_TTL)
         # copy relevant fields to SpeakerForm
         sf = SpeakerForm()
         for field in sf.all_fields():
@@ -746,16 +1209,37 @@ class ConferenceApi(remote.Service):
         return sf
 
     @staticmethod
-    def _cacheFeaturedSpeaker(speakerName, sessionNames):
-        """Update new featured speaker to memcache; used by
-        memcache cron job.
+    def _cacheFeaturedSpeaker(speakerName, sessionNames, queuedAt=None):
+        """Store new featured speaker & refresh memcache; used by the
+        update featured speaker task. Tasks queued before the stored
+        speaker's are ignored, so out-of-order tasks can't roll it back.
         """
-        cache_data = {}
-        cache_data['speaker'] = speakerName
-        cache_data['sessionNames'] = sessionNames
-        if not memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, cache_data):
-            logging.error('Memcache set failed.')
-        return cache_data
+        if ConferenceApi._storeFeaturedSpeaker(
+                speakerName, sessionNames, queuedAt or time.time()):
+            refreshCached(MEMCACHE_FEATURED_SPEAKER_KEY,
+                          ConferenceApi._loadFeaturedSpeaker,
+                          FEATURED_SPEAKER_SOFT_TTL)
+
+    @staticmethod
+    @ndb.transactional()
+    def _storeFeaturedSpeaker(speakerName, sessionNames, queuedAt):
+        featured = FeaturedSpeaker.get_by_id(FEATURED_SPEAKER_ID)
+        if featured and featured.queuedAt > queuedAt:
+            logging.info('Ignoring featured speaker %s queued before %s',
+                         speakerName, featured.speaker)
+            return False
+        FeaturedSpeaker(id=FEATURED_SPEAKER_ID, speaker=speakerName,
+                        sessionNames=sessionNames, queuedAt=queuedAt).put()
+        return True
+
+    @staticmethod
+    def _loadFeaturedSpeaker():
+        """Return the stored featured speaker as a dict (or None)."""
+        featured = FeaturedSpeaker.get_by_id(FEATURED_SPEAKER_ID)
+        if not featured:
+            return None
+        return {'speaker': featured.speaker,
+                'sessionNames': featured.sessionNames}
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
@@ -779,6 +1263,13 @@ class ConferenceApi(remote.Service):
         """Return user Profile from datastore
         creating new one if non-existent.
         """
+        return self._getProfileFromUserAsync().get_result()
+
+    @ndb.tasklet
+    def _getProfileFromUserAsync(self):
+        """Tasklet behind _getProfileFromUser(); lets callers overlap the
+        Profile get with their own RPCs.
+        """
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -787,7 +1278,7 @@ class ConferenceApi(remote.Service):
         # get Profile from datastore
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = yield p_key.get_async()
         # create new Profile if not there
         if not profile:
             profile = Profile(
@@ -796,8 +1287,8 @@ class ConferenceApi(remote.Service):
                 mainEmail=user.email(),
                 teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
-        return profile
+            yield profile.put_async()
+        raise ndb.Return(profile)
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
@@ -812,8 +1303,12 @@ class ConferenceApi(remote.Service):
                     if val:
                         setattr(prof, field, str(val))
                         prof.put()
-        # return ProfileForm
-        return self._copyProfileToForm(prof)
+        # return ProfileForm, listing Registrations as conferences to attend
+        pf = self._copyProfileToForm(prof)
+        pf.conferenceKeysToAttend = [
+            c_key.urlsafe() for c_key in
+            self._registeredConferenceKeysAsync(prof).get_result()]
+        return pf
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
                       path='profile', http_method='GET', name='getProfile')
@@ -828,6 +1323,104 @@ class ConferenceApi(remote.Service):
         """Update & return user profile."""
         return self._doProfile(request)
 
+# - - - Dashboard - - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(message_types.VoidMessage, DashboardForm,
+                      path='dashboard', http_method='GET',
+                      name='getDashboard')
+    def getDashboard(self, request):
+        """Return user profile, created & attending conferences, wishlist
+        sessions and the announcement in one call.
+        """
+        return self._getDashboardAsync().get_result()
+
+    @ndb.tasklet
+    def _getDashboardAsync(self):
+        """Tasklet behind getDashboard(); the Profile is resolved once and
+        the rest is fetched in parallel.
+        """
+        prof = yield self._getProfileFromUserAsync()
+        conf_keys = yield self._registeredConferenceKeysAsync(prof)
+        created, attending, sessions = yield (
+            Conference.query(
+                Conference.organizerUserId == prof.key.id()).fetch_async(),
+            self._getConferencesToAttendAsync(prof, conf_keys),
+            self._getWishlistSessionsAsync(prof))
+        announcement = getCached(MEMCACHE_ANNOUNCEMENTS_KEY,
+                                 ConferenceApi._makeAnnouncement,
+                                 ANNOUNCEMENT_SOFT_TTL)
+
+        pf = self._copyProfileToForm(prof)
+        pf.conferenceKeysToAttend = [c_key.urlsafe() for c_key in conf_keys]
+        raise ndb.Return(DashboardForm(
+            profile=pf,
+            conferencesCreated=[
+                self._copyConferenceToForm(conf, prof.displayName)
+                for conf in created],
+            conferencesToAttend=attending.items,
+            wishlistSessions=sessions,
+            announcement=announcement or ""))
+
+    @ndb.tasklet
+    def _getWishlistSessionsAsync(self, prof):
+        """Tasklet returning SessionForms of every session in prof's
+        wishlist, across conferences.
+        """
+        session_keys = [ndb.Key(urlsafe=wssk) for wssk in prof.sessionWishlist]
+        sessions = yield ndb.get_multi_async(session_keys)
+        sessions = [ses for ses in sessions if ses]
+
+        # conferences and speakers in one batch
+        c_keys = list(set(ses.key.parent() for ses in sessions))
+        entities = yield ndb.get_multi_async(
+            c_keys + list(set(ses.speaker for ses in sessions if ses.speaker)))
+        names = dict((conf.key, conf.name)
+                     for conf in entities[:len(c_keys)] if conf)
+        raise ndb.Return([self._copySessionToForm(
+            ses, names.get(ses.key.parent())) for ses in sessions])
+
+# - - - Statistics - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(STATS_GET_REQUEST, ConferenceStatForms,
+                      path='conferences/stats',
+                      http_method='GET', name='getConferenceStats')
+    def getConferenceStats(self, request):
+        """Return conference counts, capacity & registrations by city,
+        month and topic (or only the requested dimension).
+        """
+        if request.dimension and request.dimension not in DIMENSIONS:
+            raise endpoints.BadRequestException(
+                'dimension must be one of: %s' % ', '.join(DIMENSIONS))
+        stats = getStats()
+        dims = [request.dimension] if request.dimension else DIMENSIONS
+        return ConferenceStatForms(items=[
+            ConferenceStatForm(dimension=dim, value=value,
+                               **dict(zip(COUNTERS, counts)))
+            for dim in dims for value, counts in sorted(
+                stats[dim].iteritems())])
+
+# - - - Warmup - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _warmCaches():
+        """Prime memcache & the instance's caches before it takes
+        traffic; used by the warmup request handler.
+        """
+        getCached(MEMCACHE_ANNOUNCEMENTS_KEY,
+                  ConferenceApi._makeAnnouncement, ANNOUNCEMENT_SOFT_TTL)
+        getCached(MEMCACHE_FEATURED_SPEAKER_KEY,
+                  ConferenceApi._loadFeaturedSpeaker,
+                  FEATURED_SPEAKER_SOFT_TTL)
+        getStats()
+        getFacets(GLOBAL_CONTEXT)
+        # agendas of the next conferences to start
+        c_keys = Conference.query(
+            Conference.startDate >= datetime.now().date()).order(
+            Conference.startDate).fetch(WARMUP_CONFERENCES, keys_only=True)
+        for c_key in c_keys:
+            getAgenda(c_key)
+        return len(c_keys)
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
@@ -835,22 +1428,24 @@ class ConferenceApi(remote.Service):
         """Create Announcement & assign to memcache; used by
         memcache cron job & putAnnouncement().
         """
+        return refreshCached(MEMCACHE_ANNOUNCEMENTS_KEY,
+                             ConferenceApi._makeAnnouncement,
+                             ANNOUNCEMENT_SOFT_TTL)
+
+    @staticmethod
+    def _makeAnnouncement():
+        """Return the announcement of nearly sold out conferences."""
         confs = Conference.query(ndb.AND(
             Conference.seatsAvailable <= 5,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
         if confs:
             # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
+            # format announcement
+            return ANNOUNCEMENT_TPL % (
                 ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-        return announcement
+        # If there are no sold out conferences, announce nothing
+        return ""
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
@@ -858,81 +1453,450 @@ class ConferenceApi(remote.Service):
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
         return StringMessage(
-            data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+            data=getCached(MEMCACHE_ANNOUNCEMENTS_KEY,
+                           ConferenceApi._makeAnnouncement,
+                           ANNOUNCEMENT_SOFT_TTL) or "")
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
         prof = self._getProfileFromUser()  # get user Profile
+        return ndb.transaction(
+            lambda: ConferenceApi._registerProfile(
+                prof.key, request.websafeConferenceKey, reg), xg=True)
+
+    @staticmethod
+    def _registerProfile(p_key, wsck, reg=True):
+        """Register or unregister a Profile for a conference; the body of
+        _conferenceRegistration's transaction, left undecorated so tools
+        can run it in transactions of their own.
+        """
+        retval = None
+        prof = p_key.get()
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
         conf = ndb.Key(urlsafe=wsck).get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        r_key = ndb.Key(Registration, prof.key.id(), parent=conf.key)
+        w_key = ndb.Key(WaitlistEntry, prof.key.id(), parent=conf.key)
+        a_key = ndb.Key(Attendance, conf.key.urlsafe(), parent=prof.key)
+        registration, waiting = ndb.get_multi([r_key, w_key])
+        # registrations not yet migrated off the Profile still count
+        legacy = wsck in prof.conferenceKeysToAttend
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if registration or legacy:
                 raise ConflictException(
                     "You have already registered for this conference")
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+            # no seats, or freed seats still owed to the waitlist:
+            # queue the user instead of failing
+            if conf.seatsAvailable <= 0 or conf.waitlistCount > 0:
+                if not waiting:
+                    conf.waitlistCount += 1
+                    seatsChanged(conf)
+                    ndb.put_multi([WaitlistEntry(key=w_key,
+                                                 userId=prof.key.id()),
+                                   conf])
+                    if conf.seatsAvailable > 0:
+                        taskqueue.add(params={'websafeConferenceKey': wsck},
+                                      url='/tasks/promote_waitlist',
+                                      transactional=True)
+                return BooleanMessage(data=False)
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
+            registration = Registration(key=r_key, userId=prof.key.id())
             conf.seatsAvailable -= 1
+            seatsChanged(conf)
+            ndb.put_multi([registration, Attendance(key=a_key), conf])
+            if conf.statsCounted:
+                queueDelta(registrationDelta(conf, 1), transactional=True)
             retval = True
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if registration or legacy:
 
                 # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
+                if registration:
+                    ndb.delete_multi([r_key, a_key])
+                if legacy:
+                    prof.conferenceKeysToAttend.remove(wsck)
+                    prof.put()
                 conf.seatsAvailable += 1
+                seatsChanged(conf)
+                conf.put()
+                if conf.statsCounted:
+                    queueDelta(registrationDelta(conf, -1),
+                               transactional=True)
+                retval = True
+                # hand the seat to the head of the waitlist
+                if conf.waitlistCount > 0:
+                    taskqueue.add(params={'websafeConferenceKey': wsck},
+                                  url='/tasks/promote_waitlist',
+                                  transactional=True)
+            # leaving the waitlist also counts as unregistering
+            elif waiting:
+                w_key.delete()
+                conf.waitlistCount -= 1
+                seatsChanged(conf)
+                conf.put()
                 retval = True
             else:
                 retval = False
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
         return BooleanMessage(data=retval)
 
+    @staticmethod
+    def _promoteWaitlist(websafeConferenceKey):
+        """Move users from the head of the conference waitlist into free
+        seats, oldest first; used by the promote waitlist task.
+        """
+        c_key = ndb.Key(urlsafe=websafeConferenceKey)
+        while ConferenceApi._promoteWaitlistHead(c_key):
+            pass
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _promoteWaitlistHead(c_key):
+        """Register the longest waiting user if a seat is free; return
+        False once there is nothing left to promote.
+        """
+        conf = c_key.get()
+        if not conf or conf.seatsAvailable <= 0 or conf.waitlistCount <= 0:
+            return False
+        entry = WaitlistEntry.query(ancestor=c_key).order(
+            WaitlistEntry.created).get()
+        if not entry:
+            conf.waitlistCount = 0
+            seatsChanged(conf)
+            conf.put()
+            return False
+
+        entry.key.delete()
+        conf.waitlistCount -= 1
+        r_key = ndb.Key(Registration, entry.userId, parent=c_key)
+        prof, registration = ndb.get_multi(
+            [ndb.Key(Profile, entry.userId), r_key])
+        if prof and not registration and \
+                c_key.urlsafe() not in prof.conferenceKeysToAttend:
+            ndb.put_multi([Registration(key=r_key, userId=entry.userId),
+                           Attendance(id=c_key.urlsafe(), parent=prof.key)])
+            conf.seatsAvailable -= 1
+            if conf.statsCounted:
+                queueDelta(registrationDelta(conf, 1), transactional=True)
+        seatsChanged(conf)
+        conf.put()
+        return True
+
+    @endpoints.method(SEATS_WATCH_REQUEST, SeatsForm,
+                      path='conference/{websafeConferenceKey}/seats',
+                      http_method='GET', name='watchConferenceSeats')
+    @rateLimited()
+    def watchConferenceSeats(self, request):
+        """Long poll: return the conference's seats as soon as their
+        version differs from the given one, or after the timeout.
+        """
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        timeout = min(request.timeout or SEATS_WATCH_TIMEOUT,
+                      SEATS_WATCH_MAX_TIMEOUT)
+        snapshot = watchSeats(c_key, request.version, timeout)
+        if snapshot is None:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s'
+                % request.websafeConferenceKey)
+        return SeatsForm(changed=snapshot['version'] != request.version,
+                         **snapshot)
+
+    @endpoints.method(CONF_GET_REQUEST, IntegerMessage,
+                      path='conference/{websafeConferenceKey}/waitlist',
+                      http_method='GET', name='getWaitlistPosition')
+    def getWaitlistPosition(self, request):
+        """Return user's place in the conference waitlist (0 if none)."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        entry = ndb.Key(WaitlistEntry, getUserId(user), parent=c_key).get()
+        if not entry:
+            return IntegerMessage(data=0)
+        return IntegerMessage(data=WaitlistEntry.query(
+            WaitlistEntry.created <= entry.created, ancestor=c_key).count())
+
+# - - - Queued registration - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationTicketForm,
+                      path='conference/{websafeConferenceKey}/queue',
+                      http_method='POST', name='queueRegistration')
+    @rateLimited()
+    def queueRegistration(self, request):
+        """Queue user registration for a high-demand conference; poll
+        getRegistrationStatus with the returned ticket for the outcome.
+        """
+        prof = self._getProfileFromUser()  # get user Profile
+        wsck = request.websafeConferenceKey
+        try:
+            c_key = ndb.Key(urlsafe=wsck)
+        except Exception:
+            c_key = None
+        if not c_key or c_key.kind() != 'Conference':
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+
+        # the ticket is the websafe key its outcome will be stored under
+        ticket = ndb.Key(RegistrationTicket, uuid.uuid4().hex,
+                         parent=c_key).urlsafe()
+        memcache.set(MEMCACHE_TICKET_PREFIX + ticket, 'PENDING',
+                     time=TICKET_TTL)
+        taskqueue.Queue(REGISTRATION_PULL_QUEUE).add(taskqueue.Task(
+            payload=json.dumps({'ticket': ticket, 'userId': prof.key.id()}),
+            method='PULL', tag=wsck))
+        self._scheduleRegistrationBatch(wsck)
+        return RegistrationTicketForm(ticket=ticket,
+                                      status=RegistrationStatus.PENDING)
+
+    @endpoints.method(TICKET_GET_REQUEST, RegistrationTicketForm,
+                      path='registration/{ticket}',
+                      http_method='GET', name='getRegistrationStatus')
+    def getRegistrationStatus(self, request):
+        """Return the outcome of a queued registration."""
+        status = memcache.get(MEMCACHE_TICKET_PREFIX + request.ticket)
+        if not status:
+            try:
+                t_key = ndb.Key(urlsafe=request.ticket)
+            except Exception:
+                t_key = None
+            if not t_key or t_key.kind() != 'RegistrationTicket':
+                raise endpoints.BadRequestException(
+                    'Invalid ticket: %s' % request.ticket)
+            ticket = t_key.get()
+            status = ticket.status if ticket else 'PENDING'
+        return RegistrationTicketForm(
+            ticket=request.ticket,
+            status=getattr(RegistrationStatus, status))
+
+    @staticmethod
+    def _scheduleRegistrationBatch(websafeConferenceKey):
+        """Make sure a batch worker runs for the conference within the
+        next batch interval; one named task per conference per interval.
+        """
+        name = 'registrations-%s-%d' % (
+            hashlib.md5(websafeConferenceKey).hexdigest(),
+            int(time.time() / REGISTRATION_BATCH_INTERVAL))
+        try:
+            taskqueue.add(name=name, url='/tasks/apply_registrations',
+                          params={'websafeConferenceKey':
+                                  websafeConferenceKey},
+                          countdown=REGISTRATION_BATCH_INTERVAL)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+    @staticmethod
+    def _applyQueuedRegistrations(websafeConferenceKey):
+        """Lease & apply queued registrations for a conference in batches;
+        used by the apply registrations task.
+        """
+        queue = taskqueue.Queue(REGISTRATION_PULL_QUEUE)
+        c_key = ndb.Key(urlsafe=websafeConferenceKey)
+        while True:
+            tasks = queue.lease_tasks_by_tag(
+                REGISTRATION_LEASE_SECONDS, REGISTRATION_BATCH_SIZE,
+                tag=websafeConferenceKey)
+            if not tasks:
+                break
+            ConferenceApi._applyRegistrationBatch(
+                c_key, [json.loads(task.payload) for task in tasks])
+            queue.delete_tasks(tasks)
+
+    @staticmethod
+    def _applyRegistrationBatch(c_key, requests):
+        """Apply one batch: a single conference transaction decides every
+        ticket and writes the Registrations, tickets & conference together.
+
+        Decided tickets are stored, so a batch re-leased after a failure
+        keeps its outcome.
+        """
+        profiles = ndb.get_multi([ndb.Key(Profile, r['userId'])
+                                  for r in requests])
+        statuses = ConferenceApi._commitRegistrationBatch(
+            c_key, requests, profiles)
+        # a batch spans too many Profiles to index them in its
+        # transaction; a failure here re-leases the batch, whose decided
+        # tickets then index again. One re-leased after the user left
+        # may index a dropped Registration, which readers skip
+        ndb.put_multi([Attendance(id=c_key.urlsafe(), parent=prof.key)
+                       for r, prof in zip(requests, profiles)
+                       if statuses[r['ticket']] == 'REGISTERED'])
+        memcache.set_multi(statuses, key_prefix=MEMCACHE_TICKET_PREFIX,
+                           time=TICKET_TTL)
+
+    @staticmethod
+    @ndb.transactional()
+    def _commitRegistrationBatch(c_key, requests, profiles):
+        """Decide the tickets of a batch with one conference write;
+        returns {ticket: status name}.
+        """
+        wsck = c_key.urlsafe()
+        conf = c_key.get()
+        t_keys = [ndb.Key(urlsafe=r['ticket']) for r in requests]
+        r_keys = [ndb.Key(Registration, r['userId'], parent=c_key)
+                  for r in requests]
+        w_keys = [ndb.Key(WaitlistEntry, r['userId'], parent=c_key)
+                  for r in requests]
+        n = len(requests)
+        entities = ndb.get_multi(t_keys + r_keys + w_keys)
+        decided = dict((t.key, t.status) for t in entities[:n] if t)
+        registered = set(reg.userId for reg in entities[n:2 * n] if reg)
+        waiting = set(w.userId for w in entities[2 * n:] if w)
+
+        statuses = {}
+        writes = []
+        added = 0
+        for r, t_key, prof in zip(requests, t_keys, profiles):
+            if t_key in decided:
+                statuses[r['ticket']] = decided[t_key]
+                continue
+            user_id = r['userId']
+            if not conf or not prof:
+                status = 'FAILED'
+            elif user_id in registered or \
+                    wsck in prof.conferenceKeysToAttend:
+                status = 'ALREADY_REGISTERED'
+            elif conf.seatsAvailable > 0 and conf.waitlistCount <= 0:
+                conf.seatsAvailable -= 1
+                added += 1
+                registered.add(user_id)
+                writes.append(Registration(parent=c_key, id=user_id,
+                                           userId=user_id))
+                status = 'REGISTERED'
+            else:
+                if user_id not in waiting:
+                    waiting.add(user_id)
+                    conf.waitlistCount += 1
+                    writes.append(WaitlistEntry(
+                        parent=c_key, id=user_id, userId=user_id))
+                status = 'WAITLISTED'
+            statuses[r['ticket']] = status
+            writes.append(RegistrationTicket(key=t_key, userId=user_id,
+                                             status=status))
+        if conf:
+            seatsChanged(conf)
+            writes.append(conf)
+            if conf.statsCounted:
+                queueDelta(registrationDelta(conf, added), transactional=True)
+        ndb.put_multi(writes)
+        return statuses
+
+    @ndb.tasklet
+    def _registeredConferenceKeysAsync(self, prof):
+        """Tasklet returning keys of the conferences prof registered for,
+        including registrations not yet migrated off the Profile.
+        """
+        # the Attendance index is an ancestor query, so strongly
+        # consistent; queued batches index outside their transaction, so
+        # each entry is checked against its Registration by key
+        a_keys = yield Attendance.query(ancestor=prof.key).fetch_async(
+            keys_only=True)
+        c_keys = [ndb.Key(urlsafe=a_key.id()) for a_key in a_keys]
+        registrations = yield ndb.get_multi_async(
+            [ndb.Key(Registration, prof.key.id(), parent=c_key)
+             for c_key in c_keys])
+        conf_keys = [c_key for c_key, reg in zip(c_keys, registrations)
+                     if reg]
+        for wsck in prof.conferenceKeysToAttend:
+            c_key = ndb.Key(urlsafe=wsck)
+            if c_key not in conf_keys:
+                conf_keys.append(c_key)
+        raise ndb.Return(conf_keys)
+
+    def _isRegistered(self, prof, c_key):
+        """Return True if prof is registered for the conference."""
+        return (c_key.urlsafe() in prof.conferenceKeysToAttend or
+                ndb.Key(Registration, prof.key.id(), parent=c_key).get()
+                is not None)
+
+    @endpoints.method(ATTENDEES_GET_REQUEST, AttendeeForms,
+                      path='conference/{websafeConferenceKey}/attendees',
+                      http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return a page of a conference's attendees (organizer only)."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        conf = self._getConference(request.websafeConferenceKey)
+        if getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the conference organizer can list attendees.')
+
+        page_size = min(request.pageSize or ATTENDEE_PAGE_SIZE,
+                        ATTENDEE_MAX_PAGE_SIZE)
+        try:
+            cursor = (Cursor(urlsafe=request.pageToken)
+                      if request.pageToken else None)
+        except Exception:
+            raise endpoints.BadRequestException('Invalid pageToken.')
+        r_keys, next_cursor, more = Registration.query(
+            ancestor=conf.key).fetch_page(page_size, start_cursor=cursor,
+                                          keys_only=True)
+        profiles = ndb.get_multi([ndb.Key(Profile, r_key.id())
+                                  for r_key in r_keys])
+        return AttendeeForms(
+            items=[AttendeeForm(userId=r_key.id(),
+                                displayName=getattr(prof, 'displayName',
+                                                    None))
+                   for r_key, prof in zip(r_keys, profiles)],
+            nextPageToken=next_cursor.urlsafe() if more else None)
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        prof = self._getProfileFromUser()  # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck)
-                     for wsck in prof.conferenceKeysToAttend]
-        confs = ndb.get_multi(conf_keys)
+        return self._getConferencesToAttendAsync().get_result()
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in confs]
-        profiles = ndb.get_multi(organisers)
+    @ndb.tasklet
+    def _getConferencesToAttendAsync(self, prof=None, conf_keys=None):
+        """Tasklet behind getConferencesToAttend(); callers that already
+        have the Profile or registered conference keys can pass them in.
+        """
+        if prof is None:
+            prof = yield self._getProfileFromUserAsync()  # get user Profile
+        if conf_keys is None:
+            conf_keys = yield self._registeredConferenceKeysAsync(prof)
+
+        # organizers' Profiles are the parents of ancestor-keyed
+        # conferences, so those are fetched in the same batch
+        organisers = list(set(c_key.parent() for c_key in conf_keys
+                              if c_key.parent()))
+        entities = yield ndb.get_multi_async(conf_keys + organisers)
+        confs = [conf for conf in entities[:len(conf_keys)] if conf]
+        profiles = [p for p in entities[len(conf_keys):] if p]
+
+        # root-keyed conferences need a second batch for their organizers
+        missing = set(ndb.Key(Profile, conf.organizerUserId)
+                      for conf in confs if conf.organizerUserId) - \
+            set(p.key for p in profiles)
+        if missing:
+            more = yield ndb.get_multi_async(list(missing))
+            profiles.extend(p for p in more if p)
 
         # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        names = dict((p.key.id(), p.displayName) for p in profiles)
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
+        raise ndb.Return(ConferenceForms(
             items=[self._copyConferenceToForm(
-                    conf, names[conf.organizerUserId]) for conf in confs])
+                    conf, names.get(conf.organizerUserId))
+                   for conf in confs]))
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
+    @rateLimited()
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -940,6 +1904,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
+    @rateLimited()
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+facets.py -- maintained facet counts for queryConferences
+
+A facet context is a set of at most two equality filters on city, topic
+or month ('*' when there are none). For every context a conference
+matches, the index counts the conference under each value of the fields
+the context doesn't filter on: city, topic, month and a maxAttendees
+bucket. Counts live in FacetShard entities keyed '<context>|<shard>' and
+are updated with the conference statistics deltas (see stats.py), so a
+query's facets cost FACET_SHARDS keyed reads.
+
+"""
+
+import random
+from itertools import combinations
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import FacetShard
+from models import StatDelta
+
+# query field (as in conference.FIELDS) -> facet name returned to clients
+FACET_FIELDS = {
+    'city': 'CITY',
+    'topics': 'TOPIC',
+    'month': 'MONTH',
+    'maxAttendees': 'MAX_ATTENDEES',
+}
+CONTEXT_FIELDS = ('city', 'topics', 'month')
+MAX_CONTEXT_FILTERS = 2
+MAX_ATTENDEES_BUCKETS = (0, 100, 500, 1000, 5000)
+FACET_SHARDS = 10
+MEMCACHE_FACETS_PREFIX = 'FACETS:'
+FACETS_CACHE_TTL = 60
+# cross-group transactions span at most 25 entity groups; one is the
+# StatDelta marker
+XG_MAX_SHARDS = 24
+GLOBAL_CONTEXT = '*'
+
+
+def shardKey(context, n):
+    return ndb.Key(FacetShard, '%s|%d' % (context, n))
+
+
+def _bucket(maxAttendees):
+    """Return the lower bound of maxAttendees' bucket, as a string."""
+    bucket = MAX_ATTENDEES_BUCKETS[0]
+    for bound in MAX_ATTENDEES_BUCKETS:
+        if (maxAttendees or 0) >= bound:
+            bucket = bound
+    return str(bucket)
+
+
+def facetValues(conf):
+    """Return {field: [values]} a conference is counted under."""
+    return {
+        'city': [conf.city or ''],
+        'topics': sorted(set(conf.topics)),
+        'month': [str(conf.month or 0)],
+        'maxAttendees': [_bucket(conf.maxAttendees)],
+    }
+
+
+def contextKey(filters):
+    """Return the context of [(field, value)] equality filters."""
+    if not filters:
+        return GLOBAL_CONTEXT
+    return '&'.join('%s=%s' % f for f in sorted(set(filters)))
+
+
+def queryContext(filters):
+    """Return the facet context of formatted query filters, or None if
+    the query isn't covered by the index (inequalities, other fields or
+    more than MAX_CONTEXT_FILTERS filters).
+    """
+    if len(filters) > MAX_CONTEXT_FILTERS:
+        return None
+    pairs = []
+    for filtr in filters:
+        if filtr['operator'] != '=' or filtr['field'] not in CONTEXT_FIELDS:
+            return None
+        value = filtr['value']
+        if filtr['field'] == 'month':
+            value = str(int(value))
+        pairs.append((filtr['field'], value))
+    return contextKey(pairs)
+
+
+def facetCounts(values, sign=1):
+    """Return {context: {field: {value: count}}} for a conference's
+    facet values, counting it sign times.
+    """
+    pairs = sorted(set((field, value) for field in CONTEXT_FIELDS
+                       for value in values[field]))
+    counts = {}
+    for size in range(MAX_CONTEXT_FILTERS + 1):
+        for filters in combinations(pairs, size):
+            applied = set(field for field, _ in filters)
+            context = counts.setdefault(contextKey(filters), {})
+            for field, field_values in values.iteritems():
+                if field in applied:
+                    continue
+                for value in field_values:
+                    context.setdefault(field, {})[value] = sign
+    return counts
+
+
+def mergeFacets(facets):
+    """Sum [sign, facet values] pairs into {context: {field: {value:
+    count}}}, dropping zero counts.
+    """
+    merged = {}
+    for sign, values in facets:
+        for context, fields in facetCounts(values, sign).iteritems():
+            target = merged.setdefault(context, {})
+            for field, counts in fields.iteritems():
+                for value, count in counts.iteritems():
+                    field_counts = target.setdefault(field, {})
+                    field_counts[value] = field_counts.get(value, 0) + count
+    for context in merged.keys():
+        for field in merged[context].keys():
+            counts = merged[context][field]
+            for value in [v for v, c in counts.iteritems() if not c]:
+                del counts[value]
+            if not counts:
+                del merged[context][field]
+        if not merged[context]:
+            del merged[context]
+    return merged
+
+
+def applyFacets(delta_id, facets):
+    """Add [sign, facet values] pairs to the index, once per delta_id;
+    contexts are written in cross-group batches with their own marker.
+    """
+    merged = mergeFacets(facets)
+    contexts = sorted(merged)
+    for i in range(0, len(contexts), XG_MAX_SHARDS):
+        batch = dict((c, merged[c]) for c in contexts[i:i + XG_MAX_SHARDS])
+        _applyFacets('%s-facets-%d' % (delta_id, i), batch,
+                     random.randrange(FACET_SHARDS))
+
+
+@ndb.transactional(xg=True)
+def _applyFacets(marker_id, batch, n):
+    marker_key = ndb.Key(StatDelta, marker_id)
+    contexts = sorted(batch)
+    entities = ndb.get_multi([marker_key] +
+                             [shardKey(c, n) for c in contexts])
+    if entities[0]:
+        return False
+    shards = []
+    for context, shard in zip(contexts, entities[1:]):
+        shard = shard or FacetShard(key=shardKey(context, n), counts={})
+        for field, counts in batch[context].iteritems():
+            field_counts = shard.counts.setdefault(field, {})
+            for value, count in counts.iteritems():
+                field_counts[value] = field_counts.get(value, 0) + count
+        shards.append(shard)
+    ndb.put_multi(shards + [StatDelta(key=marker_key)])
+    return True
+
+
+def getFacets(context):
+    """Return {field: {value: count}} of a context summed over its
+    shards (cached briefly in memcache).
+    """
+    cache_key = MEMCACHE_FACETS_PREFIX + context
+    facets = memcache.get(cache_key)
+    if facets is not None:
+        return facets
+    facets = {}
+    for shard in ndb.get_multi([shardKey(context, n)
+                                for n in range(FACET_SHARDS)]):
+        if not shard:
+            continue
+        for field, counts in shard.counts.iteritems():
+            totals = facets.setdefault(field, {})
+            for value, count in counts.iteritems():
+                totals[value] = totals.get(value, 0) + count
+    memcache.set(cache_key, facets, time=FACETS_CACHE_TTL)
+    return facets
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+geo.py -- geohash cells for "conferences near me" queries
+
+A located Conference lists the geohash of its coordinates at every
+precision from 1 to MAX_PRECISION in geoCells. A search picks the
+finest precision whose cells are at least as large as the radius, so
+the query point's cell & its 8 neighbours cover the search circle: at
+most 9 equality scans on geoCells (each also a startDate range), then
+exact great-circle distances filter out the corners.
+
+Conferences without coordinates are located by city name from the
+offline table in data/city_coordinates.csv.
+
+"""
+
+import csv
+import math
+import os
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_PRECISION = 6
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+CITY_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'data', 'city_coordinates.csv')
+
+_cities = None
+
+
+def encodeGeohash(latitude, longitude, precision=MAX_PRECISION):
+    """Return the geohash of a point."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lng_range, longitude) if even else (lat_range,
+                                                          latitude)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cellSize(precision):
+    """Return the (latitude, longitude) span in degrees of a cell."""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def geoCells(latitude, longitude):
+    """Return the point's geohash at every precision, coarsest first."""
+    geohash = encodeGeohash(latitude, longitude)
+    return [geohash[:n] for n in range(1, MAX_PRECISION + 1)]
+
+
+def distanceKm(lat1, lng1, lat2, lng2):
+    """Great-circle (haversine) distance between two points."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2)
+         * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def searchCells(latitude, longitude, radius_km):
+    """Return the cells covering a circle: the point's cell & its
+    neighbours at the finest precision with cells no smaller than
+    radius_km.
+    """
+    lng_scale = max(math.cos(math.radians(latitude)), 0.01)
+    precision = 1
+    for n in range(MAX_PRECISION, 0, -1):
+        lat_span, lng_span = cellSize(n)
+        if min(lat_span * KM_PER_DEGREE,
+               lng_span * KM_PER_DEGREE * lng_scale) >= radius_km:
+            precision = n
+            break
+    lat_span, lng_span = cellSize(precision)
+    # centre of the point's cell, stepped a whole cell in each direction
+    lat_c = (math.floor((latitude + 90) / lat_span) + 0.5) * lat_span - 90
+    lng_c = (math.floor((longitude + 180) / lng_span) + 0.5) * lng_span - 180
+    cells = set()
+    for dlat in (-1, 0, 1):
+        lat = lat_c + dlat * lat_span
+        if not -90 < lat < 90:
+            continue
+        for dlng in (-1, 0, 1):
+            lng = (lng_c + dlng * lng_span + 180) % 360 - 180
+            cells.add(encodeGeohash(lat, lng, precision))
+    return sorted(cells)
+
+
+def _normalizeCity(name):
+    return ' '.join((name or '').split()).lower()
+
+
+def cityCoordinates(city):
+    """Return (latitude, longitude) of a city name from the offline
+    table, or None; 'Paris, France' is looked up as 'Paris'.
+    """
+    global _cities
+    if _cities is None:
+        cities = {}
+        with open(CITY_TABLE) as f:
+            for row in csv.DictReader(f):
+                # the table lists the larger of same-named cities first
+                cities.setdefault(_normalizeCity(row['city']), (
+                    float(row['latitude']), float(row['longitude'])))
+        _cities = cities
+    name = _normalizeCity(city)
+    return _cities.get(name) or _cities.get(name.split(',')[0].strip())
+
+
+def locateConference(conf):
+    """Fill in a Conference's coordinates from its city if it has none,
+    & set its geoCells; returns whether it is located.
+    """
+    if conf.latitude is None or conf.longitude is None:
+        coordinates = cityCoordinates(conf.city)
+        if coordinates:
+            conf.latitude, conf.longitude = coordinates
+    if conf.latitude is None or conf.longitude is None:
+        conf.geoCells = []
+        return False
+    conf.geoCells = geoCells(conf.latitude, conf.longitude)
+    return True
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+"""
+importer.py -- bulk import of conferences & sessions from CSV/JSON
+    files exported by the legacy event system
+
+Rows are validated and stored as ImportChunk entities under an ImportJob.
+Each chunk allocates its keys in ranges, writes with put_multi and
+updates the speaker directory once per distinct speaker; large files
+fan out one task per chunk.
+No confirmation emails or featured speaker tasks are sent for imports.
+
+"""
+
+import csv
+import json
+import StringIO
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ImportChunk
+from models import ImportJob
+from models import Session
+
+from agenda import putSessions
+from conference import DEFAULTS
+from conference import DEFAULTS_SESSION
+from facets import facetValues
+from geo import locateConference
+from schedule import parseDuration
+from speakers import addSpeakerSessionsMulti
+from speakers import speakerKey
+from stats import conferenceDelta
+from stats import queueDelta
+from storage_ndb import conferenceParentKey
+
+IMPORT_QUEUE = 'import'
+IMPORT_CHUNK_SIZE = 250
+IMPORT_INLINE_MAX_ROWS = 500
+IMPORT_MAX_ERRORS = 200
+IMPORT_KINDS = ('conference', 'session')
+IMPORT_FORMATS = ('csv', 'json')
+
+
+class ImportRowError(ValueError):
+    """ImportRowError -- row failed validation"""
+
+
+# - - - Parsing & validation - - - - - - - - - - - - - - - - - -
+
+def parseRows(fileFormat, content):
+    """Parse an uploaded CSV or JSON file into a list of dicts."""
+    if fileFormat == 'csv':
+        reader = csv.DictReader(StringIO.StringIO(content))
+        try:
+            return [{k.strip(): (v or '').decode('utf-8').strip()
+                     for k, v in row.iteritems() if k}
+                    for row in reader]
+        except csv.Error as e:
+            raise ValueError('Malformed CSV: %s' % e)
+    if fileFormat == 'json':
+        data = json.loads(content)
+        if isinstance(data, dict):
+            data = data.get('rows', [])
+        if not isinstance(data, list):
+            raise ValueError('JSON import must be a list of objects.')
+        return data
+    raise ValueError('Unsupported import format: %s' % fileFormat)
+
+
+def _checkRow(row):
+    # JSON files may hold anything in place of a row object
+    if not isinstance(row, dict):
+        raise ImportRowError('row must be an object')
+
+
+def _text(row, field):
+    """Return a row's text field stripped, None if empty; JSON values
+    of other types are row errors.
+    """
+    value = row.get(field)
+    if value is None:
+        return None
+    if not isinstance(value, basestring):
+        raise ImportRowError("'%s' must be a string" % field)
+    return value.strip() or None
+
+
+def _parseList(row, field):
+    """Accept either a JSON list or a ';' separated CSV cell."""
+    value = row.get(field)
+    if isinstance(value, list):
+        if not all(isinstance(v, basestring) for v in value if v):
+            raise ImportRowError("'%s' must be a list of strings" % field)
+        return [v.strip() for v in value if v and v.strip()]
+    return [v.strip() for v in (_text(row, field) or '').split(';')
+            if v.strip()]
+
+
+def _parseDate(row, field):
+    value = _text(row, field)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    except ValueError:
+        raise ImportRowError("'%s' must be YYYY-MM-DD" % field)
+
+
+def _parseTime(row, field):
+    value = _text(row, field)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:5], "%H:%M").time()
+    except ValueError:
+        raise ImportRowError("'%s' must be HH:MM" % field)
+
+
+def conferenceData(row):
+    """Validate a conference row, returning Conference constructor args."""
+    _checkRow(row)
+    name = _text(row, 'name')
+    if not name:
+        raise ImportRowError("Conference 'name' field required")
+    data = {
+        'name': name,
+        'description': _text(row, 'description'),
+        'topics': _parseList(row, 'topics') or DEFAULTS['topics'],
+        'city': _text(row, 'city') or DEFAULTS['city'],
+        'startDate': _parseDate(row, 'startDate'),
+        'endDate': _parseDate(row, 'endDate'),
+    }
+    max_attendees = row.get('maxAttendees')
+    if isinstance(max_attendees, bool) or not isinstance(
+            max_attendees, (int, long, basestring, type(None))):
+        raise ImportRowError("'maxAttendees' must be an integer")
+    try:
+        data['maxAttendees'] = int(max_attendees or DEFAULTS['maxAttendees'])
+    except ValueError:
+        raise ImportRowError("'maxAttendees' must be an integer")
+    if data['maxAttendees'] < 0:
+        raise ImportRowError("'maxAttendees' must not be negative")
+    data['seatsAvailable'] = data['maxAttendees']
+    data['month'] = data['startDate'].month if data['startDate'] else 0
+    return data
+
+
+def sessionData(row):
+    """Validate a session row, returning Session constructor args."""
+    _checkRow(row)
+    for field in ('name', 'speaker', 'websafeConferenceKey'):
+        if not _text(row, field):
+            raise ImportRowError("Session '%s' field required" % field)
+    data = {'name': _text(row, 'name'),
+            'speaker': _text(row, 'speaker'),
+            'date': _parseDate(row, 'date'),
+            'startTime': _parseTime(row, 'startTime')}
+    for df in DEFAULTS_SESSION:
+        data[df] = _text(row, df) or DEFAULTS_SESSION[df]
+    return data
+
+
+# - - - Job control - - - - - - - - - - - - - - - - - - - - - -
+
+def startImport(kind, fileFormat, content, organizerUserId=None):
+    """Create an ImportJob for the file; small files run inline,
+    larger ones fan out one task per chunk.
+    """
+    if kind not in IMPORT_KINDS:
+        raise ValueError('Unsupported import kind: %s' % kind)
+    if not organizerUserId:
+        # owns imported conferences; imported sessions must be in
+        # conferences it organizes
+        raise ValueError('organizerUserId required for imports')
+    rows = parseRows(fileFormat, content)
+
+    job = ImportJob(kind=kind, fileFormat=fileFormat,
+                    organizerUserId=organizerUserId, totalRows=len(rows))
+    job_key = job.put()
+
+    chunks = [ImportChunk(parent=job_key, id=n + 1, offset=offset,
+                          rows=rows[offset:offset + IMPORT_CHUNK_SIZE])
+              for n, offset in enumerate(
+                  range(0, len(rows), IMPORT_CHUNK_SIZE))]
+    ndb.put_multi(chunks)
+    job.chunkCount = len(chunks)
+    if not chunks:
+        job.status = 'DONE'
+    job.put()
+
+    if len(rows) <= IMPORT_INLINE_MAX_ROWS:
+        for chunk in chunks:
+            processChunk(job_key, chunk.key.id())
+    else:
+        tasks = [taskqueue.Task(params={'job': job_key.urlsafe(),
+                                        'chunk': chunk.key.id()},
+                                url='/tasks/import_chunk')
+                 for chunk in chunks]
+        queue = taskqueue.Queue(IMPORT_QUEUE)
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+    return job_key
+
+
+def processChunk(job_key, chunk_id):
+    """Validate, allocate keys for and write one chunk of rows.
+
+    Allocated keys are stored on the chunk before any entity is written,
+    so a retried task overwrites the same entities instead of duplicating.
+    """
+    chunk = ndb.Key(ImportChunk, int(chunk_id), parent=job_key).get()
+    if not chunk or chunk.done:
+        return
+    job = job_key.get()
+
+    errors = []
+    valid = []
+    for n, row in enumerate(chunk.rows):
+        try:
+            if job.kind == 'conference':
+                valid.append((n, conferenceData(row)))
+            else:
+                valid.append((n, sessionData(row)))
+        except ImportRowError as e:
+            errors.append('row %d: %s' % (chunk.offset + n + 1, e))
+
+    if job.kind == 'conference':
+        entities = _conferenceEntities(job, chunk, valid)
+        ndb.put_multi(entities)
+        # the chunk's id keeps a retried chunk from counting twice
+        queueDelta(sum((conferenceDelta(conf) for conf in entities), []),
+                   'import-' + chunk.key.urlsafe(),
+                   facets=[[1, facetValues(conf)] for conf in entities])
+    else:
+        entities, speakers, agendas = _sessionEntities(
+            job, chunk, valid, errors)
+        # each conference's sessions & agenda are written together
+        for c_key, sessions in agendas.iteritems():
+            putSessions(c_key, sessions)
+        addSpeakerSessionsMulti(speakers)
+
+    _recordProgress(chunk.key, len(entities), errors)
+
+
+def _allocateKeys(chunk, model, parents):
+    """Return (and persist on the chunk) one key per (row, parent) pair,
+    allocating a single id range per distinct parent.
+    """
+    if chunk.allocatedKeys is None:
+        wanted = {}
+        for n, parent in parents:
+            wanted.setdefault(parent, []).append(n)
+        allocated = {}
+        for parent, rows in wanted.iteritems():
+            start, end = model.allocate_ids(size=len(rows), parent=parent)
+            for n, i in zip(rows, range(start, end + 1)):
+                allocated[str(n)] = ndb.Key(model, i, parent=parent).urlsafe()
+        chunk.allocatedKeys = allocated
+        chunk.put()
+    return dict((int(n), ndb.Key(urlsafe=k))
+                for n, k in chunk.allocatedKeys.iteritems())
+
+
+def _conferenceEntities(job, chunk, valid):
+    """Build Conference entities keyed by the configured key strategy."""
+    p_key = conferenceParentKey(job.organizerUserId)
+    keys = _allocateKeys(chunk, Conference, [(n, p_key) for n, _ in valid])
+    confs = [Conference(key=keys[n], organizerUserId=job.organizerUserId,
+                        statsCounted=True, **data)
+             for n, data in valid]
+    for conf in confs:
+        locateConference(conf)
+    return confs
+
+
+def _sessionEntities(job, chunk, valid, errors):
+    """Build Session entities, resolving conferences in one batch and
+    keeping only rows of conferences the job's organizer organizes; also
+    returns (name, session keys, conference names) per distinct speaker
+    and the (session, speaker name) pairs per conference agenda.
+    """
+    conf_keys = {}
+    for n, data in list(valid):
+        try:
+            conf_keys[n] = ndb.Key(urlsafe=chunk.rows[n]['websafeConferenceKey'])
+        except Exception:
+            errors.append('row %d: invalid websafeConferenceKey'
+                          % (chunk.offset + n + 1))
+            valid.remove((n, data))
+
+    distinct = list(set(conf_keys[n] for n, _ in valid))
+    confs = dict(zip(distinct, ndb.get_multi(distinct)))
+    for n, data in list(valid):
+        conf = confs[conf_keys[n]]
+        if not isinstance(conf, Conference):
+            errors.append('row %d: no conference found with key: %s'
+                          % (chunk.offset + n + 1,
+                             chunk.rows[n]['websafeConferenceKey']))
+            valid.remove((n, data))
+        elif conf.organizerUserId != job.organizerUserId:
+            errors.append('row %d: conference %s is not organized by %s'
+                          % (chunk.offset + n + 1,
+                             chunk.rows[n]['websafeConferenceKey'],
+                             job.organizerUserId))
+            valid.remove((n, data))
+
+    keys = _allocateKeys(chunk, Session,
+                         [(n, conf_keys[n]) for n, _ in valid])
+    entities = []
+    speakers = {}
+    agendas = {}
+    for n, data in valid:
+        conf = confs[conf_keys[n]]
+        name, sessions, conf_names = speakers.setdefault(
+            speakerKey(data['speaker']), (data['speaker'], [], set()))
+        sessions.append(keys[n])
+        conf_names.add(conf.name)
+        data['speaker'] = speakerKey(data['speaker'])
+        data['durationMinutes'] = parseDuration(data.get('duration'))
+        session = Session(key=keys[n], organizerUserId=conf.organizerUserId,
+                          **data)
+        entities.append(session)
+        agendas.setdefault(conf.key, []).append((session, name))
+    return entities, speakers.values(), agendas
+
+
+@ndb.transactional()
+def _recordProgress(chunk_key, imported, errors):
+    """Mark chunk done & fold its counters into the parent ImportJob."""
+    chunk, job = ndb.get_multi([chunk_key, chunk_key.parent()])
+    if chunk.done:
+        return
+    chunk.done = True
+    job.importedRows += imported
+    job.failedRows += len(errors)
+    job.chunksDone += 1
+    job.errors = (job.errors + errors)[:IMPORT_MAX_ERRORS]
+    if job.chunksDone >= job.chunkCount:
+        job.status = 'DONE'
+    ndb.put_multi([chunk, job])
+
+
+def jobStatus(job):
+    """Return a JSON-serializable progress report for an ImportJob."""
+    return {
+        'job': job.key.urlsafe(),
+        'kind': job.kind,
+        'status': job.status,
+        'totalRows': job.totalRows,
+        'importedRows': job.importedRows,
+        'failedRows': job.failedRows,
+        'chunks': '%d/%d' % (job.chunksDone, job.chunkCount),
+        'errors': job.errors,
+    }
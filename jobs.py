@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+"""
+jobs.py -- resumable background mappers for backfills & recomputation
+
+A Mapper names a kind and maps its entities (one at a time or a batch at
+a time), returning the entities to write. A job splits the kind into key
+ranges, one per shard, and each shard walks its range as a chain of
+tasks over query cursors, checkpointing the cursor & counters after every
+batch. Dry runs count what would change without writing anything.
+
+"""
+
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import MapperJob
+from models import MapperShard
+
+JOBS_QUEUE = 'jobs'
+DEFAULT_BATCH_SIZE = 100
+MAX_SHARDS = 32
+SCATTER_OVERSAMPLING = 32
+
+MAPPERS = {}
+
+
+def register(mapper_class):
+    """Class decorator making a Mapper startable by name."""
+    MAPPERS[mapper_class.__name__] = mapper_class
+    return mapper_class
+
+
+class Mapper(object):
+    """Base class of a mapper over every entity of KIND.
+
+    Override map() for per-entity work or mapBatch() for per-batch work;
+    both return the entities to put. Call count() for custom counters.
+    Mappers that write on their own (e.g. in transactions) must check
+    dryRun first.
+    """
+    KIND = None
+    BATCH_SIZE = DEFAULT_BATCH_SIZE
+
+    def __init__(self, dryRun=False):
+        self.dryRun = dryRun
+        self.counters = {}
+
+    def count(self, name, delta=1):
+        self.counters[name] = self.counters.get(name, 0) + delta
+
+    def map(self, entity):
+        """Return a list of entities to put for entity (or None)."""
+        raise NotImplementedError
+
+    def mapBatch(self, entities):
+        """Return a list of entities to put for a batch of entities."""
+        to_put = []
+        for entity in entities:
+            to_put.extend(self.map(entity) or [])
+        return to_put
+
+
+# - - - Job control - - - - - - - - - - - - - - - - - - - - - - -
+
+def startJob(mapper_name, shards=1, batch_size=None, dry_run=False):
+    """Split the mapper's kind into shards and start one task chain each."""
+    if mapper_name not in MAPPERS:
+        raise ValueError('Unknown mapper: %s' % mapper_name)
+    mapper_class = MAPPERS[mapper_name]
+    batch_size = batch_size or mapper_class.BATCH_SIZE
+    shards = max(1, min(shards, MAX_SHARDS))
+
+    bounds = [None] + _splitPoints(mapper_class.KIND, shards) + [None]
+    job = MapperJob(mapper=mapper_name, dryRun=dry_run,
+                    batchSize=batch_size, shardCount=len(bounds) - 1)
+    job.put()
+    shard_entities = [
+        MapperShard(id=_shardId(job.key.id(), n), jobId=job.key.id(),
+                    keyStart=bounds[n], keyEnd=bounds[n + 1])
+        for n in range(len(bounds) - 1)]
+    ndb.put_multi(shard_entities)
+    for shard in shard_entities:
+        _enqueueBatch(shard)
+    return job
+
+
+def resumeJob(job_id):
+    """Restart unfinished shards from their checkpointed cursors.
+
+    Safe while the job is still running: a shard only accepts the batch
+    matching its checkpoint, so duplicate chains die out after one task.
+    """
+    job = MapperJob.get_by_id(job_id)
+    if not job:
+        raise ValueError('No job found with id: %s' % job_id)
+    for shard in _shards(job):
+        if not shard.done:
+            _enqueueBatch(shard)
+    return job
+
+
+def _shardId(job_id, n):
+    return '%d-%d' % (job_id, n)
+
+
+def _shards(job):
+    return ndb.get_multi([ndb.Key(MapperShard, _shardId(job.key.id(), n))
+                          for n in range(job.shardCount)])
+
+
+def _splitPoints(model, shards):
+    """Return up to shards - 1 sorted keys splitting model's key space
+    roughly evenly, sampled through the __scatter__ property.
+    """
+    if shards <= 1:
+        return []
+    sample = model.query().order(ndb.GenericProperty('__scatter__')).fetch(
+        shards * SCATTER_OVERSAMPLING, keys_only=True)
+    sample.sort()
+    if len(sample) < shards:
+        return []
+    step = len(sample) / float(shards)
+    return [sample[int(step * n)] for n in range(1, shards)]
+
+
+def _enqueueBatch(shard, transactional=False):
+    """Queue the batch starting at the shard's checkpointed cursor."""
+    taskqueue.add(queue_name=JOBS_QUEUE, url='/tasks/jobs/run',
+                  params={'shard': shard.key.id(),
+                          'cursor': shard.cursor or ''},
+                  transactional=transactional)
+
+
+def runBatch(shard_id, cursor):
+    """Map one batch of a shard, checkpoint & chain the next batch.
+    Tasks whose cursor is no longer the checkpoint do nothing.
+    """
+    shard = MapperShard.get_by_id(shard_id)
+    if not shard or shard.done or (shard.cursor or '') != cursor:
+        return
+    job = MapperJob.get_by_id(shard.jobId)
+    mapper = MAPPERS[job.mapper](dryRun=job.dryRun)
+    model = mapper.KIND
+
+    query = model.query()
+    if shard.keyStart:
+        query = query.filter(model._key >= shard.keyStart)
+    if shard.keyEnd:
+        query = query.filter(model._key < shard.keyEnd)
+    entities, next_cursor, more = query.order(model._key).fetch_page(
+        job.batchSize,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+
+    to_put = mapper.mapBatch(entities)
+    mapper.count('processed', len(entities))
+    mapper.count('changed', len(to_put))
+    if not job.dryRun:
+        ndb.put_multi(to_put)
+    _checkpoint(shard.key, cursor, next_cursor, more, mapper.counters)
+
+
+@ndb.transactional()
+def _checkpoint(shard_key, cursor, next_cursor, more, counters):
+    """Record a finished batch & queue the next one atomically."""
+    shard = shard_key.get()
+    if (shard.cursor or '') != cursor:
+        logging.info('Skipping stale checkpoint of shard %s', shard_key.id())
+        return
+    totals = dict(shard.counters or {})
+    for name, delta in counters.iteritems():
+        totals[name] = totals.get(name, 0) + delta
+    shard.counters = totals
+    if next_cursor:
+        shard.cursor = next_cursor.urlsafe()
+    shard.done = not more
+    shard.put()
+    if more:
+        _enqueueBatch(shard, transactional=True)
+
+
+def jobStatus(job):
+    """Return a JSON-serializable progress report for a MapperJob."""
+    shards = [shard for shard in _shards(job) if shard]
+    counters = {}
+    for shard in shards:
+        for name, value in shard.counters.iteritems():
+            counters[name] = counters.get(name, 0) + value
+    done = sum(1 for shard in shards if shard.done)
+    return {
+        'job': job.key.id(),
+        'mapper': job.mapper,
+        'dryRun': job.dryRun,
+        'status': 'DONE' if done == job.shardCount else 'RUNNING',
+        'shards': '%d/%d' % (done, job.shardCount),
+        'counters': counters,
+        'started': str(job.started),
+    }
@@ -9,11 +9,23 @@ created on 2014 may 24
 """
 
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.ext import ndb
 from conference import ConferenceApi
 
+import facets
+import importer
+import jobs
+import migrations  # registers the mappers
+import notifications
+import recommendations  # registers ComputeRecommendations
+import stats
+from models import MapperJob
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -22,9 +34,25 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class ComputeRecommendationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start recomputing every conference's recommendations."""
+        jobs.startJob(recommendations.ComputeRecommendations.__name__)
+        self.response.set_status(204)
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Import the app & prime caches before the instance serves."""
+        ConferenceApi._warmCaches()
+        self.response.set_status(204)
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation; only serves tasks
+        queued before confirmations moved to the email outbox.
+        """
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -36,16 +64,141 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class SendNotificationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send the queued notifications, one email per recipient."""
+        notifications.sendQueuedNotifications()
+        self.response.set_status(204)
+
+
 class UpdateFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         """Set updated featured speaker in Memcache"""
         ConferenceApi._cacheFeaturedSpeaker(
-            self.request.get('speakerName'), self.request.get('sessionNames'))
+            self.request.get('speakerName'), self.request.get('sessionNames'),
+            float(self.request.get('queuedAt') or 0) or None)
+        self.response.set_status(204)
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Register waitlisted users for freed conference seats."""
+        ConferenceApi._promoteWaitlist(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class ApplyRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply queued registrations for a conference in batches."""
+        ConferenceApi._applyQueuedRegistrations(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class UpdateStatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply a conference statistics delta & facet index changes."""
+        delta_id = self.request.get('id')
+        delta = json.loads(self.request.get('delta'))
+        if delta:
+            stats.applyDelta(delta_id, delta)
+        facets.applyFacets(delta_id,
+                           json.loads(self.request.get('facets') or '[]'))
         self.response.set_status(204)
 
 
+class ImportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report progress & row errors of an import job."""
+        try:
+            job_key = ndb.Key(urlsafe=self.request.get('job'))
+        except Exception:
+            job_key = None
+        if not job_key or job_key.kind() != 'ImportJob':
+            self.abort(400, 'Invalid job: %s' % self.request.get('job'))
+        job = job_key.get()
+        if not job:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(importer.jobStatus(job)))
+
+    def post(self):
+        """Start importing an uploaded CSV/JSON file."""
+        upload = self.request.POST.get('file')
+        content = upload.file.read() if hasattr(upload, 'file') \
+            else self.request.body
+        try:
+            job_key = importer.startImport(
+                self.request.get('kind', 'conference'),
+                self.request.get('format', 'csv'),
+                content,
+                self.request.get('organizerUserId') or None)
+        except ValueError as e:
+            self.abort(400, str(e))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(importer.jobStatus(job_key.get())))
+
+
+class ImportChunkHandler(webapp2.RequestHandler):
+    def post(self):
+        """Import one chunk of rows of an import job."""
+        importer.processChunk(ndb.Key(urlsafe=self.request.get('job')),
+                              self.request.get('chunk'))
+
+
+class JobsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report progress counters of background mapper jobs."""
+        if self.request.get('job'):
+            job = MapperJob.get_by_id(int(self.request.get('job')))
+            if not job:
+                self.abort(404)
+            status = jobs.jobStatus(job)
+        else:
+            status = {
+                'mappers': sorted(jobs.MAPPERS),
+                'jobs': [jobs.jobStatus(job) for job in MapperJob.query(
+                    ).order(-MapperJob.started).fetch(20)],
+            }
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(status))
+
+    def post(self):
+        """Start a mapper job, or resume one from its checkpoints."""
+        try:
+            if self.request.get('resume'):
+                job = jobs.resumeJob(int(self.request.get('resume')))
+            else:
+                job = jobs.startJob(
+                    self.request.get('mapper'),
+                    shards=int(self.request.get('shards') or 1),
+                    batch_size=int(self.request.get('batchSize') or 0),
+                    dry_run=self.request.get('dryRun') in ('1', 'true'))
+        except ValueError as e:
+            self.abort(400, str(e))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(jobs.jobStatus(job)))
+
+
+class RunJobBatchHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one batch of a mapper job shard."""
+        jobs.runBatch(self.request.get('shard'), self.request.get('cursor'))
+
+
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/send_notifications', SendNotificationsHandler),
+    ('/crons/compute_recommendations', ComputeRecommendationsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/update_featured_speaker', UpdateFeaturedSpeakerHandler),
+    ('/tasks/import_chunk', ImportChunkHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    ('/tasks/apply_registrations', ApplyRegistrationsHandler),
+    ('/tasks/jobs/run', RunJobBatchHandler),
+    ('/tasks/update_stats', UpdateStatsHandler),
+    ('/admin/import', ImportHandler),
+    ('/admin/jobs', JobsHandler),
 ], debug=True)
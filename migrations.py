@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+"""
+migrations.py -- background mappers for schema migrations, backfills
+    & repairs; start them by class name from /admin/jobs
+
+"""
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from agenda import rebuildAgenda
+from geo import locateConference
+from jobs import Mapper
+from jobs import register
+from models import Attendance
+from models import Conference
+from models import Profile
+from models import Registration
+from models import Session
+from schedule import parseDuration
+from seats import seatsChanged
+from speakers import addSpeakerSessionsMulti
+from speakers import speakerKey
+from stats import countConference
+
+# cross-group transactions span at most 25 entity groups; one is the
+# Profile's own
+XG_MAX_CONFERENCES = 24
+
+
+@register
+class SlimSessionMigration(Mapper):
+    """Rewrite sessions stored while Session subclassed Conference,
+    dropping the inherited properties and their index rows.
+    """
+    KIND = Session
+    BATCH_SIZE = 200
+
+    def map(self, session):
+        legacy = [name for name in session._properties
+                  if name not in Session._properties]
+        for name in legacy:
+            del session._properties[name]
+            session._values.pop(name, None)
+        if legacy:
+            self.count('stripped')
+        # always rewritten so indexed=False drops the old index rows
+        return [session]
+
+
+@register
+class RecomputeConferenceMonth(Mapper):
+    """Recompute Conference.month from startDate."""
+    KIND = Conference
+
+    def map(self, conf):
+        month = conf.startDate.month if conf.startDate else 0
+        if conf.month != month:
+            conf.month = month
+            return [conf]
+
+
+@register
+class BackfillConferenceLocations(Mapper):
+    """Locate conferences without coordinates from their city using
+    the offline city table, setting their geoCells.
+    """
+    KIND = Conference
+
+    def map(self, conf):
+        cells = list(conf.geoCells)
+        if not locateConference(conf):
+            self.count('unlocated')
+        elif conf.geoCells != cells:
+            self.count('located')
+            return [conf]
+
+
+@register
+class RepairSeatsAvailable(Mapper):
+    """Recompute Conference.seatsAvailable from its Registrations and
+    the Profile lists not yet migrated.
+    """
+    KIND = Conference
+
+    def map(self, conf):
+        # list entries can't be queried in the transaction; they only
+        # change as MigrateRegistrations moves them into Registrations,
+        # so each user is counted once whichever side it is seen on
+        legacy = [p_key.id() for p_key in Profile.query(
+            Profile.conferenceKeysToAttend == conf.key.urlsafe()).fetch(
+            keys_only=True)]
+        repaired, overbooked = _repairSeatsAvailable(
+            conf.key, legacy, self.dryRun)
+        if repaired:
+            self.count('repaired')
+        if overbooked:
+            self.count('overbooked')
+
+
+@ndb.transactional()
+def _repairSeatsAvailable(c_key, legacy, dry_run):
+    """Count the conference's registered users & fix its seats, never
+    below zero; returns (repaired, overbooked). The ancestor query runs
+    in the transaction so concurrent registrations can't skew the count.
+    """
+    conf = c_key.get()
+    registered = set(legacy)
+    registered.update(r_key.id() for r_key in Registration.query(
+        ancestor=c_key).fetch(keys_only=True))
+    seats = (conf.maxAttendees or 0) - len(registered)
+    overbooked = seats < 0
+    seats = max(0, seats)
+    if conf.seatsAvailable == seats:
+        return False, overbooked
+    if not dry_run:
+        conf.seatsAvailable = seats
+        seatsChanged(conf)
+        conf.put()
+        # freed seats go to the waitlist first
+        if seats > 0 and conf.waitlistCount > 0:
+            taskqueue.add(params={'websafeConferenceKey': c_key.urlsafe()},
+                          url='/tasks/promote_waitlist', transactional=True)
+    return True, overbooked
+
+
+@register
+class MigrateRegistrations(Mapper):
+    """Move Profile.conferenceKeysToAttend entries into Registration
+    entities, then clear the list.
+    """
+    KIND = Profile
+
+    def map(self, prof):
+        if not prof.conferenceKeysToAttend:
+            return
+        self.count('registrations', len(prof.conferenceKeysToAttend))
+        if self.dryRun:
+            return
+        wscks = list(prof.conferenceKeysToAttend)
+        for i in range(0, len(wscks), XG_MAX_CONFERENCES):
+            _moveRegistrations(prof.key, wscks[i:i + XG_MAX_CONFERENCES])
+
+
+@ndb.transactional(xg=True)
+def _moveRegistrations(p_key, wscks):
+    """Create Registrations for some of a Profile's list entries and drop
+    those entries, in one cross-group transaction.
+    """
+    prof = p_key.get()
+    wscks = [wsck for wsck in wscks if wsck in prof.conferenceKeysToAttend]
+    r_keys = [ndb.Key(Registration, p_key.id(),
+                      parent=ndb.Key(urlsafe=wsck)) for wsck in wscks]
+    existing = ndb.get_multi(r_keys)
+    ndb.put_multi([Registration(key=r_key, userId=p_key.id())
+                   for r_key, reg in zip(r_keys, existing) if not reg] +
+                  [Attendance(id=r_key.parent().urlsafe(), parent=p_key)
+                   for r_key in r_keys])
+    for wsck in wscks:
+        prof.conferenceKeysToAttend.remove(wsck)
+    prof.put()
+
+
+@register
+class RebuildAgendas(Mapper):
+    """Rebuild conference agendas that drifted from their sessions."""
+    KIND = Conference
+
+    def map(self, conf):
+        if self.dryRun:
+            return
+        if rebuildAgenda(conf.key):
+            self.count('rebuilt')
+
+
+@register
+class IndexAttendance(Mapper):
+    """Add the Attendance index entry of Registrations made before the
+    index existed.
+    """
+    KIND = Registration
+    BATCH_SIZE = 200
+
+    def mapBatch(self, registrations):
+        a_keys = [ndb.Key(Attendance, reg.key.parent().urlsafe(),
+                          parent=ndb.Key(Profile, reg.userId))
+                  for reg in registrations]
+        return [Attendance(key=a_key) for a_key, attendance in
+                zip(a_keys, ndb.get_multi(a_keys)) if not attendance]
+
+
+@register
+class NormalizeSessionDurations(Mapper):
+    """Set Session.durationMinutes from the free-text duration."""
+    KIND = Session
+    BATCH_SIZE = 200
+
+    def map(self, session):
+        minutes = parseDuration(session.duration)
+        if minutes is None:
+            self.count('unparsed')
+        elif session.durationMinutes != minutes:
+            session.durationMinutes = minutes
+            return [session]
+
+
+@register
+class DenormalizeSpeakers(Mapper):
+    """Point sessions at normalized Speaker keys and rebuild each
+    speaker's session keys & conference names.
+    """
+    KIND = Session
+
+    def mapBatch(self, sessions):
+        c_keys = list(set(ses.key.parent() for ses in sessions))
+        s_keys = list(set(ses.speaker for ses in sessions))
+        entities = ndb.get_multi(c_keys + s_keys)
+        conf_names = dict((conf.key, conf.name)
+                          for conf in entities[:len(c_keys)] if conf)
+        speaker_names = dict((sp.key, sp.name)
+                             for sp in entities[len(c_keys):] if sp)
+
+        to_put = []
+        speakers = {}
+        for ses in sessions:
+            name = speaker_names.get(ses.speaker) or ses.speaker.id()
+            s_key = speakerKey(name)
+            if ses.speaker != s_key:
+                ses.speaker = s_key
+                to_put.append(ses)
+            entry = speakers.setdefault(s_key, (name, [], set()))
+            entry[1].append(ses.key)
+            if ses.key.parent() in conf_names:
+                entry[2].add(conf_names[ses.key.parent()])
+
+        self.count('speakers', len(speakers))
+        if not self.dryRun:
+            addSpeakerSessionsMulti(speakers.values())
+        return to_put
+
+
+@register
+class BackfillConferenceStats(Mapper):
+    """Count conferences created before the statistics existed."""
+    KIND = Conference
+
+    def map(self, conf):
+        if not conf.statsCounted:
+            self.count('counted')
+            if not self.dryRun:
+                countConference(conf.key)
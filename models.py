@@ -19,12 +19,17 @@ class ConflictException(endpoints.ServiceException):
     http_status = httplib.CONFLICT
 
 
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- exception mapped to HTTP 429 response"""
+    http_status = 429
+
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True)  # legacy
     sessionWishlist = ndb.StringProperty(repeated=True)
 
 
@@ -53,6 +58,11 @@ class BooleanMessage(messages.Message):
     data = messages.BooleanField(1)
 
 
+class IntegerMessage(messages.Message):
+    """IntegerMessage-- outbound integer value message"""
+    data = messages.IntegerField(1)
+
+
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name = ndb.StringProperty(required=True)
@@ -65,6 +75,12 @@ class Conference(ndb.Model):
     endDate = ndb.DateProperty()
     maxAttendees = ndb.IntegerProperty()
     seatsAvailable = ndb.IntegerProperty()
+    waitlistCount = ndb.IntegerProperty(default=0, indexed=False)
+    statsCounted = ndb.BooleanProperty(default=False, indexed=False)
+    latitude = ndb.FloatProperty(indexed=False)
+    longitude = ndb.FloatProperty(indexed=False)
+    geoCells = ndb.StringProperty(repeated=True)
+    seatVersion = ndb.IntegerProperty(default=0, indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -81,16 +97,106 @@ class ConferenceForm(messages.Message):
     endDate = messages.StringField(10)
     websafeKey = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    latitude = messages.FloatField(13)
+    longitude = messages.FloatField(14)
+    distanceKm = messages.FloatField(15)
+
+
+class SeatsForm(messages.Message):
+    """SeatsForm -- a conference's seat availability & its version"""
+    version = messages.IntegerField(1)
+    seatsAvailable = messages.IntegerField(2)
+    waitlistCount = messages.IntegerField(3)
+    changed = messages.BooleanField(4)
+
+
+class FacetForm(messages.Message):
+    """FacetForm -- number of conferences a filter value would yield"""
+    field = messages.StringField(1)
+    value = messages.StringField(2)
+    count = messages.IntegerField(3)
 
 
 class ConferenceForms(messages.Message):
     """ConferenceForms--multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    facets = messages.MessageField(FacetForm, 2, repeated=True)
+
+
+class DashboardForm(messages.Message):
+    """DashboardForm -- landing view outbound form message"""
+    profile = messages.MessageField(ProfileForm, 1)
+    conferencesCreated = messages.MessageField(ConferenceForm, 2,
+                                               repeated=True)
+    conferencesToAttend = messages.MessageField(ConferenceForm, 3,
+                                                repeated=True)
+    wishlistSessions = messages.MessageField('SessionForm', 4, repeated=True)
+    announcement = messages.StringField(5)
+
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- user waiting for a seat -- child of the Conference,
+    keyed by user ID
+    """
+    userId = ndb.StringProperty(required=True)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class Registration(ndb.Model):
+    """Registration -- user attending a conference -- child of the
+    Conference, keyed by user ID
+    """
+    userId = ndb.StringProperty(required=True)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class Attendance(ndb.Model):
+    """Attendance -- per-user index of Registrations -- child of the
+    Profile, keyed by websafe conference key
+    """
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- conference attendee outbound form message"""
+    userId = messages.StringField(1)
+    displayName = messages.StringField(2)
+
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- page of conference attendees outbound form message"""
+    items = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class RegistrationTicket(ndb.Model):
+    """RegistrationTicket -- outcome of a queued registration -- child of
+    the Conference
+    """
+    userId = ndb.StringProperty(required=True)
+    status = ndb.StringProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class RegistrationTicketForm(messages.Message):
+    """RegistrationTicketForm -- queued registration outbound form message"""
+    ticket = messages.StringField(1)
+    status = messages.EnumField('RegistrationStatus', 2)
 
 
 class Speaker(ndb.Model):
-    """Speaker -- Speaker object"""
+    """Speaker -- Speaker object -- keyed by normalized name"""
     name = ndb.StringProperty(required=True)
+    sessionKeys = ndb.KeyProperty(kind='Session', repeated=True,
+                                  indexed=False)
+    conferenceNames = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class FeaturedSpeaker(ndb.Model):
+    """FeaturedSpeaker -- the current featured speaker (singleton)"""
+    speaker = ndb.StringProperty(indexed=False)
+    sessionNames = ndb.TextProperty()
+    queuedAt = ndb.FloatProperty(indexed=False)
 
 
 class SpeakerForm(messages.Message):
@@ -99,19 +205,42 @@ class SpeakerForm(messages.Message):
     sessionNames = messages.StringField(2)
 
 
-class Session(Conference):
-    """Session -- Session object -- child of the Conference"""
+class SpeakerInfoForm(messages.Message):
+    """SpeakerInfoForm -- Speaker directory entry outbound form message"""
+    name = messages.StringField(1)
+    sessionCount = messages.IntegerField(2)
+    conferenceNames = messages.StringField(3, repeated=True)
+
+
+class SpeakerInfoForms(messages.Message):
+    """SpeakerInfoForms -- page of Speaker directory outbound form message"""
+    items = messages.MessageField(SpeakerInfoForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class Session(ndb.Model):
+    """Session -- Session object -- child of the Conference;
+    only properties used in queries are indexed
+    """
     name = ndb.StringProperty(required=True)
-    organizerUserId = ndb.StringProperty()
-    highlights = ndb.StringProperty()
+    organizerUserId = ndb.StringProperty(indexed=False)
+    highlights = ndb.StringProperty(indexed=False)
     speaker = ndb.KeyProperty(kind='Speaker', required=True)
     location = ndb.StringProperty()
-    duration = ndb.StringProperty()
+    duration = ndb.StringProperty(indexed=False)
+    durationMinutes = ndb.IntegerProperty(indexed=False)
     typeOfSession = ndb.StringProperty()
     date = ndb.DateProperty()
     startTime = ndb.TimeProperty()
 
 
+class Agenda(ndb.Model):
+    """Agenda -- a conference's sessions pre-sorted by date & startTime,
+    speaker names resolved -- child of the Conference
+    """
+    entries = ndb.JsonProperty(compressed=True)
+
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound from message"""
     name = messages.StringField(1)
@@ -125,6 +254,7 @@ class SessionForm(messages.Message):
     websafeKey = messages.StringField(9)
     conferenceName = messages.StringField(10)
     organizerUserId = messages.StringField(12)
+    durationMinutes = messages.IntegerField(13)
 
 
 class SessionForms(messages.Message):
@@ -132,6 +262,53 @@ class SessionForms(messages.Message):
     items = messages.MessageField(SessionForm, 1, repeated=True)
 
 
+class SessionRecommendations(ndb.Model):
+    """SessionRecommendations -- per session of the conference (by index
+    into sessionKeys) its top [index, score] neighbours by wishlist
+    co-occurrence -- child of the Conference
+    """
+    sessionKeys = ndb.StringProperty(repeated=True, indexed=False)
+    neighbours = ndb.JsonProperty(compressed=True)
+    popular = ndb.JsonProperty()
+    computed = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class WishlistSchedule(ndb.Model):
+    """WishlistSchedule -- a user's wishlisted sessions of one conference
+    as [start, end, websafeKey, name] sorted by start -- child of the
+    Profile, id is the websafe conference key
+    """
+    entries = ndb.JsonProperty(compressed=True)
+    maxLength = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class ScheduleSlotForm(messages.Message):
+    """ScheduleSlotForm -- a wishlisted session's time slot"""
+    websafeKey = messages.StringField(1)
+    name = messages.StringField(2)
+    start = messages.StringField(3)
+    end = messages.StringField(4)
+
+
+class WishlistAddForm(messages.Message):
+    """WishlistAddForm -- addSessionToWishlist outcome & the wishlisted
+    sessions the new one overlaps
+    """
+    data = messages.BooleanField(1)
+    conflicts = messages.MessageField(ScheduleSlotForm, 2, repeated=True)
+
+
+class WishlistConflictForm(messages.Message):
+    """WishlistConflictForm -- two overlapping wishlisted sessions"""
+    first = messages.MessageField(ScheduleSlotForm, 1)
+    second = messages.MessageField(ScheduleSlotForm, 2)
+
+
+class WishlistConflictForms(messages.Message):
+    """WishlistConflictForms -- multiple WishlistConflictForm"""
+    items = messages.MessageField(WishlistConflictForm, 1, repeated=True)
+
+
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
     NOT_SPECIFIED = 1
@@ -151,6 +328,15 @@ class TeeShirtSize(messages.Enum):
     XXXL_W = 15
 
 
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- queued registration state enumeration value"""
+    PENDING = 1
+    REGISTERED = 2
+    WAITLISTED = 3
+    ALREADY_REGISTERED = 4
+    FAILED = 5
+
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
@@ -163,6 +349,7 @@ class ConferenceQueryForms(messages.Message):
     multiple ConferenceQueryForm inbound form message
     """
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    includeFacets = messages.BooleanField(2)
 
 
 class SessionQueryForm(messages.Message):
@@ -179,3 +366,84 @@ class SessionQueryForms(messages.Message):
 
 class SessionGetRequest(messages.Message):
     speaker = messages.StringField(1)
+
+
+class MapperJob(ndb.Model):
+    """MapperJob -- run of a background mapper over one kind"""
+    mapper = ndb.StringProperty(required=True)
+    dryRun = ndb.BooleanProperty(default=False, indexed=False)
+    batchSize = ndb.IntegerProperty(indexed=False)
+    shardCount = ndb.IntegerProperty(indexed=False)
+    started = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class MapperShard(ndb.Model):
+    """MapperShard -- key range, checkpoint & counters of one shard of a
+    MapperJob; keyed '<job id>-<shard>' so shards never share a group
+    """
+    jobId = ndb.IntegerProperty(required=True)
+    keyStart = ndb.KeyProperty(indexed=False)
+    keyEnd = ndb.KeyProperty(indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    done = ndb.BooleanProperty(default=False, indexed=False)
+    counters = ndb.JsonProperty(default={})
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class ImportJob(ndb.Model):
+    """ImportJob -- progress of a bulk CSV/JSON import"""
+    kind = ndb.StringProperty(required=True)
+    fileFormat = ndb.StringProperty(indexed=False)
+    organizerUserId = ndb.StringProperty()
+    status = ndb.StringProperty(default='RUNNING')
+    totalRows = ndb.IntegerProperty(default=0, indexed=False)
+    importedRows = ndb.IntegerProperty(default=0, indexed=False)
+    failedRows = ndb.IntegerProperty(default=0, indexed=False)
+    chunkCount = ndb.IntegerProperty(default=0, indexed=False)
+    chunksDone = ndb.IntegerProperty(default=0, indexed=False)
+    errors = ndb.StringProperty(repeated=True, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class ImportChunk(ndb.Model):
+    """ImportChunk -- slice of import rows -- child of the ImportJob"""
+    offset = ndb.IntegerProperty(indexed=False)
+    rows = ndb.JsonProperty(compressed=True)
+    allocatedKeys = ndb.JsonProperty()
+    done = ndb.BooleanProperty(default=False, indexed=False)
+
+
+class StatShard(ndb.Model):
+    """StatShard -- one shard of the conference statistics of a dimension
+    (city, month or topic); keyed '<dimension>-<shard>', counts maps each
+    value to [conferences, capacity, registrations]
+    """
+    counts = ndb.JsonProperty(compressed=True)
+
+
+class StatDelta(ndb.Model):
+    """StatDelta -- marker of a statistics or facet delta already applied"""
+    applied = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class FacetShard(ndb.Model):
+    """FacetShard -- one shard of the facet counts of a filter context;
+    keyed '<context>|<shard>', counts maps field -> value -> count
+    """
+    counts = ndb.JsonProperty(compressed=True)
+
+
+class ConferenceStatForm(messages.Message):
+    """ConferenceStatForm -- conference statistics of one dimension value"""
+    dimension = messages.StringField(1)
+    value = messages.StringField(2)
+    conferences = messages.IntegerField(3)
+    capacity = messages.IntegerField(4)
+    registrations = messages.IntegerField(5)
+
+
+class ConferenceStatForms(messages.Message):
+    """ConferenceStatForms -- multiple ConferenceStatForm outbound form
+    message
+    """
+    items = messages.MessageField(ConferenceStatForm, 1, repeated=True)
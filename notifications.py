@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+notifications.py -- batched email delivery through a pull queue outbox
+
+Notifications are pull queue tasks tagged with their recipient. The
+send_notifications cron leases them one recipient at a time (by tag),
+sends each recipient a single email covering all of their pending
+notifications and deletes the tasks; tasks whose email failed are left
+to be leased again once their lease expires.
+
+"""
+
+import json
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+
+OUTBOX_QUEUE = 'email-outbox'
+MAX_NOTIFICATION_CHARS = 1000
+MAX_EMAIL_CHARS = 20000
+LEASE_SECONDS = 120
+BATCH_SIZE = 100
+WORKER_DEADLINE = 50
+SUBJECT = 'Conference Central: %s'
+
+
+def _cap(text, limit):
+    if len(text) <= limit:
+        return text
+    return text[:limit - 3] + '...'
+
+
+def queueNotification(to, subject, body, transactional=False):
+    """Put a notification for to in the outbox; the body is capped at
+    MAX_NOTIFICATION_CHARS.
+    """
+    payload = json.dumps({'subject': subject,
+                          'body': _cap(body, MAX_NOTIFICATION_CHARS)})
+    taskqueue.Queue(OUTBOX_QUEUE).add(
+        taskqueue.Task(payload=payload, method='PULL', tag=to),
+        transactional=transactional)
+
+
+def composeEmail(notifications):
+    """Return (subject, body) of one email covering notifications,
+    listing as many as fit in MAX_EMAIL_CHARS.
+    """
+    if len(notifications) == 1:
+        subject = notifications[0]['subject']
+    else:
+        subject = SUBJECT % ('%d updates' % len(notifications))
+    parts = []
+    size = 0
+    for n, notification in enumerate(notifications):
+        part = '%s\r\n\r\n%s' % (notification['subject'],
+                                  notification['body'])
+        if size + len(part) > MAX_EMAIL_CHARS:
+            parts.append('... and %d more.' % (len(notifications) - n))
+            break
+        parts.append(part)
+        size += len(part)
+    return subject, '\r\n\r\n'.join(parts)
+
+
+def sendQueuedNotifications(deadline=WORKER_DEADLINE):
+    """Drain the outbox, one email per recipient; returns the number of
+    emails sent.
+    """
+    queue = taskqueue.Queue(OUTBOX_QUEUE)
+    sender = 'noreply@%s.appspotmail.com' % (
+        app_identity.get_application_id())
+    stop = time.time() + deadline
+    sent = 0
+    while time.time() < stop:
+        # leases only tasks sharing the first available task's tag
+        tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, BATCH_SIZE)
+        if not tasks:
+            break
+        to = tasks[0].tag
+        notifications = [json.loads(task.payload) for task in tasks]
+        subject, body = composeEmail(notifications)
+        try:
+            mail.send_mail(sender, to, subject, body)
+        except Exception:
+            logging.exception('Sending %d notifications to %s failed',
+                              len(tasks), to)
+            continue
+        queue.delete_tasks(tasks)
+        sent += 1
+    return sent
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+ratelimit.py -- per user & per endpoint request limits
+
+@rateLimited() under @endpoints.method limits calls of a ConferenceApi
+method per user (getUserId; the client address the Endpoints proxy
+reports when signed out) to RATE_LIMITS[method name] = (requests,
+seconds) from settings.py.
+
+Each (method, user) pair has a token bucket holding up to `requests`
+tokens, refilled continuously at `requests` per `seconds`, so no burst
+can exceed the limit however calls fall. The bucket lives in memcache
+as (tokens, updated at) and is taken from with compare-and-set; a
+missing bucket is a full one. Once a bucket is empty the instance
+remembers when its next token is due, so a client looping on a method
+is turned away without a memcache call. Rejected calls raise
+TooManyRequestsException saying how many seconds to wait. When
+memcache is unavailable, or a bucket stays contended, calls are let
+through.
+
+"""
+
+import functools
+import os
+import threading
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from models import TooManyRequestsException
+from settings import RATE_LIMITS
+from utils import getUserId
+
+MEMCACHE_RATE_PREFIX = 'RATE:'
+MAX_LOCAL_BUCKETS = 10000
+CAS_RETRIES = 3
+
+# (method, user) -> when its empty bucket has a token again
+_empty_until = {}
+_lock = threading.Lock()
+
+
+def _caller(service):
+    user = endpoints.get_current_user()
+    if user:
+        return getUserId(user)
+    # the client address as the Endpoints proxy saw it; X-Forwarded-For
+    # is set by the client, so not to be trusted, and REMOTE_ADDR is the
+    # proxy's own, shared by every client
+    state = getattr(service, 'request_state', None)
+    return 'ip:%s' % (getattr(state, 'remote_address', None) or
+                      os.getenv('REMOTE_ADDR', ''))
+
+
+def _rejectUntil(refill_at):
+    raise TooManyRequestsException(
+        'Rate limit exceeded; retry after %d seconds.' %
+        max(1, int(refill_at - time.time() + 0.999)))
+
+
+def _rememberEmpty(bucket, refill_at, now):
+    with _lock:
+        if len(_empty_until) >= MAX_LOCAL_BUCKETS:
+            for stale, until in _empty_until.items():
+                if until <= now:
+                    del _empty_until[stale]
+            if len(_empty_until) >= MAX_LOCAL_BUCKETS:
+                _empty_until.clear()
+        _empty_until[bucket] = refill_at
+
+
+def takeToken(method, caller, requests, seconds):
+    """Take one token from the (method, caller) bucket or raise
+    TooManyRequestsException.
+    """
+    now = time.time()
+    bucket = (method, caller)
+    with _lock:
+        empty_until = _empty_until.get(bucket)
+        if empty_until is not None and empty_until <= now:
+            del _empty_until[bucket]
+            empty_until = None
+    if empty_until is not None:
+        _rejectUntil(empty_until)
+
+    rate = float(requests) / seconds
+    key = '%s%s:%s' % (MEMCACHE_RATE_PREFIX, method, caller)
+    # an untouched bucket is full again after `seconds`; let it expire
+    expiry = int(seconds) + 1
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        now = time.time()
+        state = client.gets(key)
+        if state is None:
+            if client.add(key, (requests - 1, now), time=expiry):
+                return
+            continue
+        tokens, updated = state
+        tokens = min(requests, tokens + (now - updated) * rate)
+        if tokens < 1:
+            refill_at = now + (1 - tokens) / rate
+            _rememberEmpty(bucket, refill_at, now)
+            _rejectUntil(refill_at)
+        if client.cas(key, (tokens - 1, now), time=expiry):
+            return
+
+
+def rateLimited(requests=None, seconds=None):
+    """Decorator limiting calls of an API method per user; the limit
+    comes from RATE_LIMITS unless given here, and none means unlimited.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, request):
+            limit = ((requests, seconds) if requests is not None
+                     else RATE_LIMITS.get(func.__name__))
+            if limit:
+                takeToken(func.__name__, _caller(self), *limit)
+            return func(self, request)
+        return wrapper
+    return decorator
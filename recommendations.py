@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+recommendations.py -- precomputed "people who wishlisted this also
+    wishlisted" session neighbours
+
+The ComputeRecommendations mapper (run by the compute_recommendations
+cron) scores the pairs of a conference's sessions by wishlist
+co-occurrence, cosine normalized so popular sessions don't pair with
+everything, plus a little for a shared speaker or session type so
+sessions nobody wishlisted yet still get neighbours. Only co-wishlisted
+pairs & pairs of a speaker's sessions are scored one by one; the other
+sessions of the same type all score alike, so just enough of them are
+taken to fill a list. Each session keeps its TOP_K best neighbours in
+the conference's one SessionRecommendations entity; a request reads
+that entity & sums the neighbour scores of the user's wishlisted
+sessions.
+
+"""
+
+import heapq
+import math
+
+from google.appengine.ext import ndb
+
+from jobs import Mapper
+from jobs import register
+from models import Conference
+from models import Profile
+from models import Session
+from models import SessionRecommendations
+
+RECOMMENDATIONS_ID = 'recommendations'
+TOP_K = 10
+SCORE_SCALE = 1000
+SPEAKER_WEIGHT = 0.2
+TYPE_WEIGHT = 0.05
+QUERY_BATCH_SIZE = 50
+
+
+def recommendationsKey(c_key):
+    return ndb.Key(SessionRecommendations, RECOMMENDATIONS_ID, parent=c_key)
+
+
+def wishlistUserIds(session_keys):
+    """Return, per session key, the ids of the users wishlisting it;
+    keys-only queries, QUERY_BATCH_SIZE in flight at a time.
+    """
+    users = []
+    for i in range(0, len(session_keys), QUERY_BATCH_SIZE):
+        futures = [Profile.query(
+            Profile.sessionWishlist == s_key.urlsafe()).fetch_async(
+                keys_only=True)
+            for s_key in session_keys[i:i + QUERY_BATCH_SIZE]]
+        users.extend([p_key.id() for p_key in future.get_result()]
+                     for future in futures)
+    return users
+
+
+def cooccurrence(users):
+    """Return {a: {b: number of users wishlisting both}} from the user
+    ids wishlisting each session; only co-wishlisted pairs are kept.
+    """
+    baskets = {}
+    for index, user_ids in enumerate(users):
+        for user_id in user_ids:
+            baskets.setdefault(user_id, []).append(index)
+    pairs = {}
+    for basket in baskets.itervalues():
+        for a in basket:
+            row = pairs.setdefault(a, {})
+            for b in basket:
+                if b != a:
+                    row[b] = row.get(b, 0) + 1
+    return pairs
+
+
+def _groups(values):
+    """Return value -> indexes of the sessions having it, None left out."""
+    groups = {}
+    for index, value in enumerate(values):
+        if value is not None:
+            groups.setdefault(value, []).append(index)
+    return groups
+
+
+def topNeighbours(sessions, users, k=TOP_K):
+    """Return per session the [column, scaled score] of its k best
+    neighbours, from the sessions and the user ids wishlisting each.
+    """
+    pairs = cooccurrence(users)
+    speakers = _groups(ses.speaker for ses in sessions)
+    types = _groups(ses.typeOfSession for ses in sessions)
+    neighbours = []
+    for a, ses in enumerate(sessions):
+        # cosine: c(a, b) / sqrt(n(a) n(b)), n being the wishlist counts
+        scores = dict((b, float(c) / math.sqrt(len(users[a]) *
+                                               len(users[b])))
+                      for b, c in pairs.get(a, {}).iteritems())
+        for b in speakers.get(ses.speaker, ()):
+            if b != a:
+                scores[b] = scores.get(b, 0) + SPEAKER_WEIGHT
+        same_type = types.get(ses.typeOfSession, ())
+        if same_type:
+            for b in scores.keys():
+                if sessions[b].typeOfSession == ses.typeOfSession:
+                    scores[b] += TYPE_WEIGHT
+        # the other sessions of the type score TYPE_WEIGHT alone, so k
+        # of them are enough to fill the list
+        filler = 0
+        for b in same_type:
+            if filler == k:
+                break
+            if b != a and b not in scores:
+                scores[b] = TYPE_WEIGHT
+                filler += 1
+        best = heapq.nlargest(k, scores.iteritems(),
+                              key=lambda item: (item[1], -item[0]))
+        neighbours.append([[b, int(round(score * SCORE_SCALE))]
+                           for b, score in best])
+    return neighbours
+
+
+def computeRecommendations(c_key):
+    """Recompute a conference's SessionRecommendations (unsaved);
+    None if it has no sessions.
+    """
+    sessions = Session.query(ancestor=c_key).fetch()
+    if not sessions:
+        return None
+    sessions.sort(key=lambda ses: ses.key)
+    users = wishlistUserIds([ses.key for ses in sessions])
+    popular = sorted(range(len(sessions)), key=lambda i: -len(users[i]))
+    return SessionRecommendations(
+        key=recommendationsKey(c_key),
+        sessionKeys=[ses.key.urlsafe() for ses in sessions],
+        neighbours=topNeighbours(sessions, users),
+        popular=[i for i in popular[:TOP_K] if users[i]])
+
+
+def recommendSessions(recs, wishlist, limit):
+    """Return up to limit websafe session keys for a user's wishlist,
+    best first, leaving out sessions already wishlisted; the most
+    wishlisted sessions when the wishlist has none of this conference.
+    """
+    wishlisted = set(wishlist)
+    index = dict((wssk, i) for i, wssk in enumerate(recs.sessionKeys))
+    scores = {}
+    for wssk in wishlisted:
+        if wssk in index:
+            for col, score in recs.neighbours[index[wssk]]:
+                scores[col] = scores.get(col, 0) + score
+    ranked = sorted(scores, key=lambda col: (-scores[col], col)) or \
+        recs.popular
+    return [wssk for wssk in (recs.sessionKeys[col] for col in ranked)
+            if wssk not in wishlisted][:limit]
+
+
+@register
+class ComputeRecommendations(Mapper):
+    """Recompute every conference's session recommendations."""
+    KIND = Conference
+    BATCH_SIZE = 5
+
+    def map(self, conf):
+        recs = computeRecommendations(conf.key)
+        if recs:
+            self.count('sessions', len(recs.sessionKeys))
+            return [recs]
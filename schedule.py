@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""
+schedule.py -- per user & conference interval index of wishlisted
+    sessions, for schedule conflict checks
+
+A WishlistSchedule holds [start, end, websafeKey, name] entries sorted
+by start, times in minutes since 0001-01-01. A new session [s, e) can
+only overlap entries starting in (s - maxLength, e), so its conflicts
+are found by binary search over that window. Sessions without a date
+or start time aren't scheduled; those without a readable duration take
+DEFAULT_DURATION_MINUTES.
+
+"""
+
+import re
+from bisect import bisect_left
+from bisect import insort
+from datetime import date
+
+from google.appengine.ext import ndb
+
+from models import WishlistSchedule
+
+DEFAULT_DURATION_MINUTES = 60
+_CLOCK = re.compile(r'^\s*(\d+):(\d{2})\s*$')
+_AMOUNT = re.compile(
+    r'(\d+(?:\.\d+)?)\s*(hours?|hrs?|h|minutes?|mins?|m)?(?![a-z])')
+
+
+def parseDuration(text):
+    """Return the minutes of a free-text duration such as '90',
+    '45 min', '1h30', '1:30' or '1.5 hours'; None if there are none.
+    """
+    if not text:
+        return None
+    text = text.strip().lower()
+    clock = _CLOCK.match(text)
+    if clock:
+        return int(clock.group(1)) * 60 + int(clock.group(2))
+    minutes = 0.0
+    amounts = _AMOUNT.findall(text)
+    for n, (amount, unit) in enumerate(amounts):
+        # a bare leading number before another amount is hours: '1 30'
+        if unit.startswith('h') or (not unit and n == 0 and
+                                    len(amounts) > 1):
+            minutes += float(amount) * 60
+        else:
+            minutes += float(amount)
+    return int(round(minutes)) or None
+
+
+def sessionInterval(session):
+    """Return (start, end) minutes of a Session, or None."""
+    if not session.date or not session.startTime:
+        return None
+    start = (session.date.toordinal() * 1440 +
+             session.startTime.hour * 60 + session.startTime.minute)
+    length = (session.durationMinutes or parseDuration(session.duration)
+              or DEFAULT_DURATION_MINUTES)
+    return start, start + length
+
+
+def scheduleKey(p_key, c_key):
+    return ndb.Key(WishlistSchedule, c_key.urlsafe(), parent=p_key)
+
+
+def buildSchedule(p_key, c_key, wishlist):
+    """Return a new WishlistSchedule of the sessions of c_key among the
+    wishlist's websafe session keys.
+    """
+    schedule = WishlistSchedule(key=scheduleKey(p_key, c_key), entries=[],
+                                maxLength=0)
+    s_keys = [s_key for s_key in (ndb.Key(urlsafe=wssk) for wssk in wishlist)
+              if s_key.parent() == c_key]
+    for session in ndb.get_multi(s_keys):
+        if session:
+            addToSchedule(schedule, session)
+    return schedule
+
+
+def findConflicts(schedule, start, end):
+    """Return the entries overlapping [start, end)."""
+    entries = schedule.entries
+    lo = bisect_left(entries, [start - schedule.maxLength + 1])
+    hi = bisect_left(entries, [end])
+    return [entry for entry in entries[lo:hi] if entry[1] > start]
+
+
+def addToSchedule(schedule, session):
+    """Insert a Session not yet in the schedule; returns the entries
+    it overlaps, or None if the session has no time.
+    """
+    interval = sessionInterval(session)
+    if interval is None:
+        return None
+    start, end = interval
+    wssk = session.key.urlsafe()
+    conflicts = [entry for entry in findConflicts(schedule, start, end)
+                 if entry[2] != wssk]
+    insort(schedule.entries, [start, end, wssk, session.name])
+    schedule.maxLength = max(schedule.maxLength, end - start)
+    return conflicts
+
+
+def allConflicts(schedule):
+    """Return every overlapping (earlier, later) pair of entries."""
+    entries = schedule.entries
+    pairs = []
+    for n, entry in enumerate(entries):
+        hi = bisect_left(entries, [entry[1]], n + 1)
+        pairs.extend((entry, other) for other in entries[n + 1:hi])
+    return pairs
+
+
+def formatMinutes(minutes):
+    """Return schedule minutes as 'YYYY-MM-DD HH:MM'."""
+    day, minute = divmod(minutes, 1440)
+    return '%s %02d:%02d' % (date.fromordinal(day).isoformat(),
+                             minute // 60, minute % 60)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+seats.py -- seat availability snapshots in memcache for long-polling
+    watchers
+
+Every transaction changing a conference's seats or waitlist bumps
+Conference.seatVersion and, once it commits, publishes {version,
+seatsAvailable, waitlistCount} to memcache. Commit callbacks can run
+out of order, so a snapshot only ever replaces an older version
+(compare-and-set). Watchers poll the snapshot until its version differs
+from the one they know; only a missing snapshot costs a datastore read.
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+MEMCACHE_SEATS_PREFIX = 'SEATS:'
+SEATS_TTL = 3600
+POLL_INTERVAL = 0.5
+CAS_RETRIES = 3
+
+
+def _snapshot(conf):
+    return {'version': conf.seatVersion,
+            'seatsAvailable': conf.seatsAvailable,
+            'waitlistCount': conf.waitlistCount}
+
+
+def publishSeats(c_key, snapshot):
+    """Store snapshot unless memcache already has a newer version."""
+    client = memcache.Client()
+    key = MEMCACHE_SEATS_PREFIX + c_key.urlsafe()
+    for _ in range(CAS_RETRIES):
+        current = client.gets(key)
+        if current is None:
+            if client.add(key, snapshot, time=SEATS_TTL):
+                return
+        elif current['version'] >= snapshot['version']:
+            return
+        elif client.cas(key, snapshot, time=SEATS_TTL):
+            return
+    # lost every race to newer writers: drop it so the next read reloads
+    client.delete(key)
+
+
+def seatsChanged(conf):
+    """Bump a conference's seat version before it is put; the snapshot
+    is published once the enclosing transaction commits.
+    """
+    conf.seatVersion = (conf.seatVersion or 0) + 1
+    snapshot = _snapshot(conf)
+    ndb.get_context().call_on_commit(
+        lambda: publishSeats(conf.key, snapshot))
+
+
+def getSeats(c_key):
+    """Return the conference's seat snapshot, or None if it doesn't
+    exist.
+    """
+    snapshot = memcache.get(MEMCACHE_SEATS_PREFIX + c_key.urlsafe())
+    if snapshot is None:
+        conf = c_key.get()
+        if not conf:
+            return None
+        snapshot = _snapshot(conf)
+        publishSeats(c_key, snapshot)
+    return snapshot
+
+
+def watchSeats(c_key, version, timeout):
+    """Return the seat snapshot as soon as its version differs from
+    version, or the unchanged one after timeout seconds.
+    """
+    deadline = time.time() + timeout
+    snapshot = getSeats(c_key)
+    while snapshot and snapshot['version'] == version and \
+            time.time() + POLL_INTERVAL < deadline:
+        time.sleep(POLL_INTERVAL)
+        snapshot = getSeats(c_key)
+    return snapshot
@@ -16,3 +16,25 @@ WEB_CLIENT_ID = '1055178843334-hrcj5ic5aa4bete2kd0dfo5eef0cmo16.apps.googleuserc
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# How new Conference keys are built: 'ancestor' parents each conference
+# under its organizer's Profile (one entity group per organizer); 'flat'
+# creates root Conference entities so high-volume organizers aren't
+# limited by a single entity group's write rate. Existing keys of either
+# shape keep working.
+CONFERENCE_KEY_STRATEGY = 'ancestor'
+
+# Per-user limits of ConferenceApi methods decorated with @rateLimited():
+# method name -> (requests, seconds). Methods not listed are unlimited.
+RATE_LIMITS = {
+    'queryConferences': (30, 60),
+    'queryConferencesNearby': (30, 60),
+    'registerForConference': (10, 60),
+    'unregisterFromConference': (10, 60),
+    'queueRegistration': (10, 60),
+    'createConference': (10, 60),
+    'addSessionToWishlist': (30, 60),
+    # a watcher re-polls after every change (at most once a second, see
+    # SEATS_MIN_INTERVAL_MS in controllers.js) & every timeout
+    'watchConferenceSeats': (90, 60),
+}
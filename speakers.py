@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+speakers.py -- speaker directory: Speaker entities keyed by normalized
+    name, each holding the keys of its sessions & its conference names
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Session
+from models import Speaker
+
+
+def normalizeSpeakerName(name):
+    """Collapse whitespace & case so 'Jane  DOE' and 'jane doe' match."""
+    return ' '.join((name or '').split()).lower()
+
+
+def speakerKey(name):
+    """Return the directory key for a speaker name."""
+    return ndb.Key(Speaker, normalizeSpeakerName(name))
+
+
+def getSpeaker(name):
+    """Return the Speaker for name, or None.
+
+    Speakers created before names were normalized are keyed by the name
+    exactly as entered; those are still found by a second key in the
+    same batch get. Until DenormalizeSpeakers merges them, a speaker
+    found under both keys is returned as one unsaved Speaker listing
+    the sessions & conferences of both.
+    """
+    keys = [speakerKey(name)]
+    if name != keys[0].id():
+        keys.append(ndb.Key(Speaker, name))
+    speakers = [speaker for speaker in ndb.get_multi(keys) if speaker]
+    if len(speakers) < 2:
+        return speakers[0] if speakers else None
+    current, legacy = speakers
+    merged = Speaker(key=current.key, name=current.name,
+                     sessionKeys=list(getSpeakerSessionKeys(current)),
+                     conferenceNames=list(current.conferenceNames))
+    for ses_key in getSpeakerSessionKeys(legacy):
+        if ses_key not in merged.sessionKeys:
+            merged.sessionKeys.append(ses_key)
+    for conf_name in legacy.conferenceNames:
+        if conf_name not in merged.conferenceNames:
+            merged.conferenceNames.append(conf_name)
+    return merged
+
+
+def getSpeakerSessionKeys(speaker):
+    """Return the session keys of a speaker; legacy speakers without a
+    maintained session list fall back to a query.
+    """
+    if speaker.sessionKeys:
+        return speaker.sessionKeys
+    return Session.query(Session.speaker == speaker.key).fetch(keys_only=True)
+
+
+@ndb.transactional_tasklet()
+def addSpeakerSessionsAsync(name, session_keys, conference_names):
+    """Get or create the Speaker for name & record sessions on it.
+
+    Session keys already listed are skipped, so retries are harmless.
+    """
+    s_key = speakerKey(name)
+    speaker = yield s_key.get_async()
+    if not speaker:
+        speaker = Speaker(key=s_key, name=' '.join(name.split()))
+    changed = False
+    for ses_key in session_keys:
+        if ses_key not in speaker.sessionKeys:
+            speaker.sessionKeys.append(ses_key)
+            changed = True
+    for conf_name in conference_names:
+        if conf_name not in speaker.conferenceNames:
+            speaker.conferenceNames.append(conf_name)
+            changed = True
+    if changed:
+        yield speaker.put_async()
+    raise ndb.Return(speaker)
+
+
+def addSpeakerSession(name, session_key, conference_name):
+    """Record one new session on the speaker directory."""
+    return addSpeakerSessionsAsync(
+        name, [session_key], [conference_name]).get_result()
+
+
+def addSpeakerSessionsMulti(speakers):
+    """Record sessions for many speakers, given (name, session keys,
+    conference names) triples; one transaction per speaker, all in
+    flight together.
+    """
+    futures = [addSpeakerSessionsAsync(name, session_keys,
+                                       sorted(conference_names))
+               for name, session_keys, conference_names in speakers]
+    ndb.Future.wait_all(futures)
+    for future in futures:
+        future.check_success()
@@ -72,7 +72,172 @@ app.filter('startFrom', function () {
  *
  */
 app.constant('HTTP_ERRORS', {
-    'UNAUTHORIZED': 401
+    'UNAUTHORIZED': 401,
+    'TOO_MANY_REQUESTS': 429
+});
+
+
+/**
+ * @ngdoc service
+ * @name apiCache
+ *
+ * @description
+ * Caches the responses of the read-only conference API methods in the browser, so that moving
+ * between the pages doesn't call the API again for data it has just loaded.
+ *
+ * Responses are keyed by method and params and kept for TTL_MS[method]. Concurrent calls for the
+ * same key share one request. A successful mutating call drops the cached responses of the
+ * methods listed in INVALIDATES for it. When a refreshed response has the same etag (or version) as
+ * the expired one, the cached result object is kept, so the views bound to it stay as they are.
+ *
+ */
+app.factory('apiCache', function () {
+    var apiCache = {
+        /**
+         * Milliseconds to keep the responses of each cached method.
+         */
+        TTL_MS: {
+            'getProfile': 5 * 60 * 1000,
+            'getConference': 60 * 1000,
+            'queryConferences': 60 * 1000,
+            'getConferencesCreated': 5 * 60 * 1000,
+            'getConferencesToAttend': 5 * 60 * 1000
+        },
+
+        /**
+         * The cached methods whose responses each mutating method makes stale.
+         */
+        INVALIDATES: {
+            'saveProfile': ['getProfile'],
+            'createConference': ['queryConferences', 'getConferencesCreated'],
+            'registerForConference': ['getProfile', 'getConference', 'queryConferences',
+                'getConferencesToAttend'],
+            'unregisterFromConference': ['getProfile', 'getConference', 'queryConferences',
+                'getConferencesToAttend']
+        }
+    };
+
+    // key -> {resp, etag, expires}
+    var entries = {};
+    // key -> callbacks waiting for the request in flight
+    var pending = {};
+    // method -> number of invalidations; a response is only stored if none happened while in flight
+    var generations = {};
+
+    var cacheKey = function (method, params) {
+        return method + ':' + angular.toJson(params || {});
+    };
+
+    var etagOf = function (resp) {
+        var result = resp.result || {};
+        return resp.etag || result.etag || result.version;
+    };
+
+    /**
+     * Calls gapi.client.conference[method](params) and hands the response to callback, as
+     * execute would. Cached responses are handed over asynchronously too, since the callbacks
+     * call $scope.$apply.
+     *
+     * @param {string} method
+     * @param {Object} params
+     * @param {Function} callback
+     */
+    apiCache.execute = function (method, params, callback) {
+        var ttl = apiCache.TTL_MS[method];
+        if (!ttl) {
+            gapi.client.conference[method](params).execute(function (resp) {
+                if (!resp.error) {
+                    angular.forEach(apiCache.INVALIDATES[method] || [], apiCache.invalidate);
+                }
+                callback(resp);
+            });
+            return;
+        }
+
+        var key = cacheKey(method, params);
+        var entry = entries[key];
+        if (entry && entry.expires > Date.now()) {
+            setTimeout(function () {
+                callback(entry.resp);
+            }, 0);
+            return;
+        }
+        if (pending[key]) {
+            pending[key].push(callback);
+            return;
+        }
+        pending[key] = [callback];
+        var generation = generations[method];
+        gapi.client.conference[method](params).execute(function (resp) {
+            var callbacks = pending[key];
+            delete pending[key];
+            if (!resp.error && generation === generations[method]) {
+                var etag = etagOf(resp);
+                if (entry && etag !== undefined && etag === entry.etag) {
+                    resp = entry.resp;
+                }
+                entries[key] = {resp: resp, etag: etag, expires: Date.now() + ttl};
+            }
+            angular.forEach(callbacks, function (waiting) {
+                waiting(resp);
+            });
+        });
+    };
+
+    /**
+     * Returns a token to pass to apiCache.put with a result requested after taking it.
+     *
+     * @returns {Object}
+     */
+    apiCache.token = function () {
+        return angular.copy(generations);
+    };
+
+    /**
+     * Caches a result of a method fetched some other way, such as part of the getDashboard
+     * response, as if apiCache.execute had received it. Nothing is stored if the method was
+     * invalidated since token was taken.
+     *
+     * @param {string} method
+     * @param {Object} params
+     * @param {Object} result
+     * @param {Object} token from apiCache.token
+     */
+    apiCache.put = function (method, params, result, token) {
+        var ttl = apiCache.TTL_MS[method];
+        if (!ttl || (token[method] || 0) !== (generations[method] || 0)) {
+            return;
+        }
+        // execute's responses carry the result both as is and as resp.result
+        var resp = angular.extend({result: result}, result);
+        entries[cacheKey(method, params)] = {resp: resp, etag: etagOf(resp),
+            expires: Date.now() + ttl};
+    };
+
+    /**
+     * Drops the cached responses of a method, for any params.
+     *
+     * @param {string} method
+     */
+    apiCache.invalidate = function (method) {
+        generations[method] = (generations[method] || 0) + 1;
+        angular.forEach(entries, function (entry, key) {
+            if (key.indexOf(method + ':') === 0) {
+                delete entries[key];
+            }
+        });
+    };
+
+    /**
+     * Drops every cached response, e.g. when the signed in user changes.
+     */
+    apiCache.clear = function () {
+        angular.forEach(apiCache.TTL_MS, function (ttl, method) {
+            apiCache.invalidate(method);
+        });
+    };
+
+    return apiCache;
 });
 
 
@@ -84,7 +249,7 @@ app.constant('HTTP_ERRORS', {
  * Service that holds the OAuth2 information shared across all the pages.
  *
  */
-app.factory('oauth2Provider', function ($modal) {
+app.factory('oauth2Provider', function ($modal, apiCache) {
     var oauth2Provider = {
         CLIENT_ID: '1055178843334-hrcj5ic5aa4bete2kd0dfo5eef0cmo16.apps.googleusercontent.com',
         SCOPES: 'email profile',
@@ -95,6 +260,7 @@ app.factory('oauth2Provider', function ($modal) {
      * Calls the OAuth2 authentication method.
      */
     oauth2Provider.signIn = function (callback) {
+        apiCache.clear();
         gapi.auth.signIn({
             'clientid': oauth2Provider.CLIENT_ID,
             'cookiepolicy': 'single_host_origin',
@@ -109,6 +275,7 @@ app.factory('oauth2Provider', function ($modal) {
      * Logs out the user.
      */
     oauth2Provider.signOut = function () {
+        apiCache.clear();
         gapi.auth.signOut();
         // Explicitly set the invalid access token in order to make the API calls fail.
         gapi.auth.setToken({access_token: ''})
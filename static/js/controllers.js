@@ -25,7 +25,7 @@ conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstr
  * A controller used for the My Profile page.
  */
 conferenceApp.controllers.controller('MyProfileCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, apiCache, HTTP_ERRORS) {
         $scope.submitted = false;
         $scope.loading = false;
 
@@ -63,8 +63,8 @@ conferenceApp.controllers.controller('MyProfileCtrl',
             var retrieveProfileCallback = function () {
                 $scope.profile = {};
                 $scope.loading = true;
-                gapi.client.conference.getProfile().
-                    execute(function (resp) {
+                apiCache.execute('getProfile', {},
+                    function (resp) {
                         $scope.$apply(function () {
                             $scope.loading = false;
                             if (resp.error) {
@@ -94,8 +94,8 @@ conferenceApp.controllers.controller('MyProfileCtrl',
         $scope.saveProfile = function () {
             $scope.submitted = true;
             $scope.loading = true;
-            gapi.client.conference.saveProfile($scope.profile).
-                execute(function (resp) {
+            apiCache.execute('saveProfile', $scope.profile,
+                function (resp) {
                     $scope.$apply(function () {
                         $scope.loading = false;
                         if (resp.error) {
@@ -135,7 +135,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
  * A controller used for the Create conferences page.
  */
 conferenceApp.controllers.controller('CreateConferenceCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, apiCache, HTTP_ERRORS) {
 
         /**
          * The conference object being edited in the page.
@@ -214,8 +214,8 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
             }
 
             $scope.loading = true;
-            gapi.client.conference.createConference($scope.conference).
-                execute(function (resp) {
+            apiCache.execute('createConference', $scope.conference,
+                function (resp) {
                     $scope.$apply(function () {
                         $scope.loading = false;
                         if (resp.error) {
@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, apiCache, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -390,6 +390,31 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         })
     };
 
+    /**
+     * Facet counts of the current query, by filterable field.
+     * @type {{}}
+     */
+    $scope.facets = {};
+
+    /**
+     * Adds a filter for a facet value and re-runs the query; max attendees
+     * facets are buckets, so they filter on the bucket's lower bound.
+     *
+     * @param facet
+     */
+    $scope.addFacetFilter = function (facet) {
+        for (var i = 0; i < $scope.filtereableFields.length; i++) {
+            if ($scope.filtereableFields[i].enumValue == facet.field) {
+                $scope.filters.push({
+                    field: $scope.filtereableFields[i],
+                    operator: $scope.operators[facet.field == 'MAX_ATTENDEES' ? 2 : 0],
+                    value: facet.value
+                });
+            }
+        }
+        $scope.queryConferences();
+    };
+
     /**
      * Clears all filters.
      */
@@ -428,7 +453,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferencesAll = function () {
         var sendFilters = {
-            filters: []
+            filters: [],
+            includeFacets: true
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -441,8 +467,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
-            execute(function (resp) {
+        apiCache.execute('queryConferences', sendFilters,
+            function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
                     if (resp.error) {
@@ -462,6 +488,11 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.facets = {};
+                        angular.forEach(resp.facets, function (facet) {
+                            $scope.facets[facet.field] = $scope.facets[facet.field] || [];
+                            $scope.facets[facet.field].push(facet);
+                        });
                     }
                     $scope.submitted = true;
                 });
@@ -473,8 +504,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
-            execute(function (resp) {
+        apiCache.execute('getConferencesCreated', {},
+            function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
                     if (resp.error) {
@@ -511,8 +542,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
-            execute(function (resp) {
+        apiCache.execute('getConferencesToAttend', {},
+            function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
                         // The request has failed.
@@ -547,11 +578,34 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, $timeout, apiCache, HTTP_ERRORS) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
 
+    /**
+     * Milliseconds to wait before watching the seats again after a failed long poll.
+     * @type {number}
+     */
+    var SEATS_RETRY_MS = 5000;
+
+    /**
+     * Milliseconds to wait before watching the seats again after a change, so that a burst of
+     * changes during a sale costs one poll a second (the server's rate limit allows for this).
+     * @type {number}
+     */
+    var SEATS_MIN_INTERVAL_MS = 1000;
+
+    /**
+     * Set once the user leaves the page, ending the seat long poll.
+     * @type {boolean}
+     */
+    var stopWatchingSeats = false;
+
+    $scope.$on('$destroy', function () {
+        stopWatchingSeats = true;
+    });
+
     /**
      * Initializes the conference detail page.
      * Invokes the conference.getConference method and sets the returned conference in the $scope.
@@ -559,9 +613,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        apiCache.execute('getConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -575,13 +629,14 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                     // The request has succeeded.
                     $scope.alertStatus = 'success';
                     $scope.conference = resp.result;
+                    $scope.watchSeats();
                 }
             });
         });
 
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
+        apiCache.execute('getProfile', {}, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -601,15 +656,55 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
         });
     };
 
+    /**
+     * Long-polls the conference.watchConferenceSeats method, which answers once the seats change
+     * from the given version (or times out), and keeps seatsAvailable up to date while the page is open.
+     *
+     * @param version the seat version last seen; undefined returns the current seats at once.
+     */
+    $scope.watchSeats = function (version) {
+        gapi.client.conference.watchConferenceSeats({
+            websafeConferenceKey: $routeParams.websafeConferenceKey,
+            version: version
+        }).execute(function (resp) {
+            if (stopWatchingSeats) {
+                return;
+            }
+            if (resp.error) {
+                var errorMessage = resp.error.message || '';
+                // A rate limited watch is told how many seconds to wait.
+                var retryAfter = errorMessage.match(/retry after (\d+) seconds/);
+                $log.error('Failed to watch the seats: ' + errorMessage);
+                $timeout(function () {
+                    $scope.watchSeats(version);
+                }, resp.code == HTTP_ERRORS.TOO_MANY_REQUESTS && retryAfter ?
+                    parseInt(retryAfter[1], 10) * 1000 : SEATS_RETRY_MS);
+                return;
+            }
+            if (resp.result.changed) {
+                // The cached conference has the old seats now.
+                apiCache.invalidate('getConference');
+                $scope.$apply(function () {
+                    $scope.conference.seatsAvailable = parseInt(resp.result.seatsAvailable, 10);
+                });
+                $timeout(function () {
+                    $scope.watchSeats(resp.result.version);
+                }, SEATS_MIN_INTERVAL_MS);
+                return;
+            }
+            $scope.watchSeats(resp.result.version);
+        });
+    };
+
 
     /**
      * Invokes the conference.registerForConference method.
      */
     $scope.registerForConference = function () {
         $scope.loading = true;
-        gapi.client.conference.registerForConference({
+        apiCache.execute('registerForConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -624,12 +719,17 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         return;
                     }
                 } else {
-                    if (resp.result) {
+                    if (resp.result && resp.result.data) {
                         // Register succeeded.
                         $scope.messages = 'Registered for the conference';
                         $scope.alertStatus = 'success';
                         $scope.isUserAttending = true;
                         $scope.conference.seatsAvailable = $scope.conference.seatsAvailable - 1;
+                    } else if (resp.result) {
+                        // Sold out; the server put the user on the waitlist.
+                        $scope.messages = 'The conference is full. You are on the waitlist and ' +
+                            'will be registered automatically when a seat frees up';
+                        $scope.alertStatus = 'info';
                     } else {
                         $scope.messages = 'Failed to register for the conference';
                         $scope.alertStatus = 'warning';
@@ -644,9 +744,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.unregisterFromConference = function () {
         $scope.loading = true;
-        gapi.client.conference.unregisterFromConference({
+        apiCache.execute('unregisterFromConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -691,7 +791,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
  * such as user authentications.
  *
  */
-conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider) {
+conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider, apiCache) {
 
     /**
      * Returns if the viewLocation is the currently viewed page.
@@ -723,6 +823,7 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
                         oauth2Provider.signedIn = true;
                         $scope.alertStatus = 'success';
                         $scope.rootMessages = 'Logged in with ' + resp.email;
+                        $scope.loadDashboard();
                     }
                 });
             });
@@ -742,6 +843,7 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
                     $scope.$apply(function () {
                         oauth2Provider.signedIn = true;
                     });
+                    $scope.loadDashboard();
                 }
             },
             'clientid': oauth2Provider.CLIENT_ID,
@@ -750,11 +852,43 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
         });
     };
 
+    /**
+     * The landing view data of the signed in user: profile, conferences created and to attend,
+     * wishlist sessions and the announcement.
+     * @type {{}}
+     */
+    $scope.dashboard = {};
+
+    /**
+     * Invokes the conference.getDashboard method, fetching the landing view in one round trip, and
+     * caches its parts as the responses of getProfile, getConferencesCreated and
+     * getConferencesToAttend, so that the pages showing them don't call the API again.
+     */
+    $scope.loadDashboard = function () {
+        var token = apiCache.token();
+        gapi.client.conference.getDashboard().execute(function (resp) {
+            $scope.$apply(function () {
+                if (!resp.error) {
+                    $scope.dashboard = resp.result;
+                    apiCache.put('getProfile', {}, resp.result.profile, token);
+                    apiCache.put('getConferencesCreated', {},
+                        {items: resp.result.conferencesCreated || []}, token);
+                    apiCache.put('getConferencesToAttend', {},
+                        {items: resp.result.conferencesToAttend || []}, token);
+                    if (resp.result.announcement) {
+                        $scope.rootMessages += ' - ' + resp.result.announcement;
+                    }
+                }
+            });
+        });
+    };
+
     /**
      * Logs out the user.
      */
     $scope.signOut = function () {
         oauth2Provider.signOut();
+        $scope.dashboard = {};
         $scope.alertStatus = 'success';
         $scope.rootMessages = 'Logged out';
     };
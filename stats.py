@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""
+stats.py -- sharded conference statistics by city, month & topic
+
+Each StatShard holds, for one dimension, the counters of every value of
+that dimension: conferences, capacity (maxAttendees) and registrations.
+A change is described as a delta (rows of [dimension, value, conferences,
+capacity, registrations]) queued with the change, transactionally where
+the change is transactional; the task adds it to one random shard per
+dimension. Reads sum a fixed set of shards, so they cost the same number
+of keyed gets however many conferences there are.
+
+The same task keeps the queryConferences facet index (facets.py) up to
+date. Only conferences flagged statsCounted contribute deltas; new
+conferences are flagged on creation and older ones by the
+BackfillConferenceStats mapper, so nothing is counted twice.
+
+"""
+
+import json
+import random
+import uuid
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from facets import facetValues
+from models import StatDelta
+from models import StatShard
+
+DIMENSIONS = ('city', 'month', 'topic')
+COUNTERS = ('conferences', 'capacity', 'registrations')
+STATS_SHARDS = 20
+STATS_QUEUE = 'stats'
+MEMCACHE_STATS_KEY = 'CONFERENCE_STATS'
+STATS_CACHE_TTL = 60
+
+
+def shardKey(dimension, n):
+    return ndb.Key(StatShard, '%s-%d' % (dimension, n))
+
+
+# - - - Deltas - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def statValues(conf):
+    """Return [(dimension, value)] a conference is counted under."""
+    values = [('city', conf.city or ''), ('month', str(conf.month or 0))]
+    values.extend(('topic', topic) for topic in sorted(set(conf.topics)))
+    return values
+
+
+def conferenceDelta(conf, sign=1, registered=None):
+    """Return the delta adding (sign=1) or removing (sign=-1) conf;
+    registered defaults to the seats taken.
+    """
+    if registered is None:
+        registered = (conf.maxAttendees or 0) - (conf.seatsAvailable or 0)
+    counts = [sign, sign * (conf.maxAttendees or 0), sign * registered]
+    return [[dim, value] + counts for dim, value in statValues(conf)]
+
+
+def registrationDelta(conf, registered):
+    """Return the delta of registered (+/-) registrations for conf."""
+    return [[dim, value, 0, 0, registered]
+            for dim, value in statValues(conf)]
+
+
+def mergeDelta(delta):
+    """Sum the rows of a delta per (dimension, value), dropping zeros."""
+    merged = {}
+    for row in delta:
+        counts = merged.setdefault((row[0], row[1]), [0] * len(COUNTERS))
+        for i, count in enumerate(row[2:]):
+            counts[i] += count
+    return [[dim, value] + counts
+            for (dim, value), counts in sorted(merged.iteritems())
+            if any(counts)]
+
+
+def queueDelta(delta, delta_id=None, transactional=False, facets=None):
+    """Queue a delta to be applied to the statistics, along with the
+    [sign, facet values] pairs of conferences added to or removed from
+    the facet index. A delta_id is applied at most once; it defaults to
+    a random id.
+    """
+    delta = mergeDelta(delta)
+    if not delta and not facets:
+        return
+    taskqueue.add(queue_name=STATS_QUEUE, url='/tasks/update_stats',
+                  params={'id': delta_id or uuid.uuid4().hex,
+                          'delta': json.dumps(delta),
+                          'facets': json.dumps(facets or [])},
+                  transactional=transactional)
+
+
+@ndb.transactional()
+def countConference(c_key):
+    """Start counting an existing conference; returns False if it was
+    already counted.
+    """
+    conf = c_key.get()
+    if not conf or conf.statsCounted:
+        return False
+    conf.statsCounted = True
+    conf.put()
+    queueDelta(conferenceDelta(conf), 'conference-' + c_key.urlsafe(),
+               transactional=True, facets=[[1, facetValues(conf)]])
+    return True
+
+
+# - - - Shards - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def applyDelta(delta_id, delta):
+    """Add a delta to one shard per dimension, once per delta_id."""
+    return _applyDelta(delta_id, delta, random.randrange(STATS_SHARDS))
+
+
+@ndb.transactional(xg=True)
+def _applyDelta(delta_id, delta, n):
+    marker_key = ndb.Key(StatDelta, delta_id)
+    dims = sorted(set(row[0] for row in delta))
+    entities = ndb.get_multi([marker_key] +
+                             [shardKey(dim, n) for dim in dims])
+    if entities[0]:
+        return False
+    shards = dict(zip(dims, entities[1:]))
+    for dim in dims:
+        if not shards[dim]:
+            shards[dim] = StatShard(key=shardKey(dim, n), counts={})
+    for row in delta:
+        counts = shards[row[0]].counts
+        current = counts.get(row[1], [0] * len(COUNTERS))
+        counts[row[1]] = [a + b for a, b in zip(current, row[2:])]
+    ndb.put_multi(shards.values() + [StatDelta(key=marker_key)])
+    return True
+
+
+def getStats():
+    """Return {dimension: {value: [conferences, capacity, registrations]}}
+    summed over all shards (cached briefly in memcache).
+    """
+    stats = memcache.get(MEMCACHE_STATS_KEY)
+    if stats is not None:
+        return stats
+    stats = dict((dim, {}) for dim in DIMENSIONS)
+    shards = ndb.get_multi([shardKey(dim, n) for dim in DIMENSIONS
+                            for n in range(STATS_SHARDS)])
+    for shard in shards:
+        if not shard:
+            continue
+        totals = stats[shard.key.id().rsplit('-', 1)[0]]
+        for value, counts in shard.counts.iteritems():
+            current = totals.get(value, [0] * len(COUNTERS))
+            totals[value] = [a + b for a, b in zip(current, counts)]
+    memcache.set(MEMCACHE_STATS_KEY, stats, time=STATS_CACHE_TTL)
+    return stats
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+"""
+storage.py -- repository interface over Conference, Session, Speaker &
+    Profile data, and an embedded SQLite implementation of it
+
+Records are plain dicts carrying the model's field names plus an 'id';
+sessions refer to their conference by 'conferenceId' and to their
+speaker by name. The API reads through ConferenceApi.repository, the
+ndb engine in storage_ndb.py by default; the SQLite engine needs only
+the standard library, so query strategies can be timed without the App
+Engine SDK. Conference queries take (field, operator, value) filters
+like queryConferences and return results in the same order as the
+datastore would: by the inequality field if there is one, then by name.
+
+"""
+
+import datetime
+import sqlite3
+
+CONFERENCE_FIELDS = ('name', 'description', 'organizerUserId', 'topics',
+                     'city', 'startDate', 'month', 'endDate',
+                     'maxAttendees', 'seatsAvailable', 'latitude',
+                     'longitude')
+SESSION_FIELDS = ('name', 'organizerUserId', 'highlights', 'speaker',
+                  'location', 'duration', 'durationMinutes',
+                  'typeOfSession', 'date', 'startTime')
+PROFILE_FIELDS = ('displayName', 'mainEmail', 'teeShirtSize')
+QUERY_FIELDS = ('city', 'topics', 'month', 'maxAttendees')
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
+
+
+def speakerId(name):
+    """Directory id of a speaker name, as speakers.normalizeSpeakerName
+    computes it.
+    """
+    return ' '.join((name or '').split()).lower()
+
+
+class Repository(object):
+    """Storage engine interface; every method is implemented by each
+    engine.
+    """
+    def putProfile(self, profile):
+        """Store a profile record keyed by its 'userId'."""
+        raise NotImplementedError
+
+    def getProfiles(self, user_ids):
+        """Return profile records for user_ids (None where missing)."""
+        raise NotImplementedError
+
+    def putConferences(self, conferences):
+        """Store new conference records; returns their ids."""
+        raise NotImplementedError
+
+    def getConferences(self, conf_ids):
+        """Return conference records for conf_ids (None where missing)."""
+        raise NotImplementedError
+
+    def queryConferences(self, filters, limit=None):
+        """Return conference records matching (field, operator, value)
+        filters.
+        """
+        raise NotImplementedError
+
+    def getConferencesCreated(self, user_id):
+        """Return the conference records organized by user_id."""
+        raise NotImplementedError
+
+    def putSessions(self, sessions):
+        """Store new session records, adding their speakers to the
+        directory; returns their ids.
+        """
+        raise NotImplementedError
+
+    def getConferenceSessions(self, conf_id, typeOfSession=None):
+        """Return a conference's session records by date & start time."""
+        raise NotImplementedError
+
+    def getSessionsBetween(self, conf_id, date, start, end):
+        """Return a conference's session records on date starting in
+        [start, end].
+        """
+        raise NotImplementedError
+
+    def getSpeakerSessions(self, name):
+        """Return the session records of a speaker."""
+        raise NotImplementedError
+
+    def listSpeakers(self, limit, pageToken=None):
+        """Return a page of speaker records (name, sessionCount &
+        conferenceNames) ordered by name, and the token of the next page
+        (None after the last); raises ValueError for a bad token.
+        """
+        raise NotImplementedError
+
+    def getProfile(self, user_id):
+        """Return the profile record of user_id, or None."""
+        return self.getProfiles([user_id])[0]
+
+    def getConference(self, conf_id):
+        """Return one conference record, or None."""
+        return self.getConferences([conf_id])[0]
+
+
+def checkFilters(filters):
+    """Validate query filters; returns the inequality field, if any."""
+    inequality = None
+    for field, operator, value in filters:
+        if field not in QUERY_FIELDS:
+            raise ValueError('Cannot filter on %s' % field)
+        if operator not in OPERATORS:
+            raise ValueError('Unknown operator %s' % operator)
+        if operator != '=':
+            if inequality and inequality != field:
+                raise ValueError(
+                    'Inequality filter allowed on only one field.')
+            inequality = field
+    return inequality
+
+
+def _toText(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def dateFromText(text):
+    if text is None:
+        return None
+    return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def timeFromText(text):
+    if text is None:
+        return None
+    return datetime.datetime.strptime(text, '%H:%M:%S').time()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile (
+    userId TEXT PRIMARY KEY, displayName TEXT, mainEmail TEXT,
+    teeShirtSize TEXT);
+CREATE TABLE IF NOT EXISTS conference (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT,
+    organizerUserId TEXT, city TEXT, startDate TEXT, month INTEGER,
+    endDate TEXT, maxAttendees INTEGER, seatsAvailable INTEGER,
+    latitude REAL, longitude REAL);
+CREATE INDEX IF NOT EXISTS conference_organizer
+    ON conference (organizerUserId);
+CREATE INDEX IF NOT EXISTS conference_name ON conference (name);
+CREATE INDEX IF NOT EXISTS conference_city
+    ON conference (city, name);
+CREATE INDEX IF NOT EXISTS conference_city_month
+    ON conference (city, month, name);
+CREATE INDEX IF NOT EXISTS conference_month ON conference (month, name);
+CREATE INDEX IF NOT EXISTS conference_max
+    ON conference (maxAttendees, name);
+CREATE TABLE IF NOT EXISTS conference_topic (
+    topic TEXT NOT NULL, conferenceId INTEGER NOT NULL,
+    PRIMARY KEY (topic, conferenceId));
+CREATE INDEX IF NOT EXISTS conference_topic_conference
+    ON conference_topic (conferenceId);
+CREATE TABLE IF NOT EXISTS speaker (
+    id TEXT PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS session (
+    id INTEGER PRIMARY KEY, conferenceId INTEGER NOT NULL,
+    name TEXT NOT NULL, organizerUserId TEXT, highlights TEXT,
+    speakerId TEXT NOT NULL, location TEXT, duration TEXT,
+    durationMinutes INTEGER, typeOfSession TEXT, date TEXT,
+    startTime TEXT);
+CREATE INDEX IF NOT EXISTS session_agenda
+    ON session (conferenceId, date, startTime, name);
+CREATE INDEX IF NOT EXISTS session_type
+    ON session (conferenceId, typeOfSession, date, startTime, name);
+CREATE INDEX IF NOT EXISTS session_speaker ON session (speakerId);
+CREATE INDEX IF NOT EXISTS speaker_name ON speaker (name, id);
+"""
+
+
+class SqliteRepository(Repository):
+    """Repository in an SQLite database (in memory by default), with
+    indexes matching the datastore queries the API runs.
+    """
+    def __init__(self, path=':memory:'):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    # - - - Profiles - - - - - - - - - - - - - - - - - - - -
+
+    def putProfile(self, profile):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO profile VALUES (?, ?, ?, ?)',
+                [profile['userId']] +
+                [profile.get(field) for field in PROFILE_FIELDS])
+
+    def getProfiles(self, user_ids):
+        if not user_ids:
+            return []
+        by_id = dict((row['userId'], dict(row)) for row in self.db.execute(
+            'SELECT * FROM profile WHERE userId IN (%s)' %
+            ', '.join('?' * len(user_ids)), list(user_ids)))
+        return [by_id.get(user_id) for user_id in user_ids]
+
+    # - - - Conferences - - - - - - - - - - - - - - - - - - -
+
+    def putConferences(self, conferences):
+        columns = [f for f in CONFERENCE_FIELDS if f != 'topics']
+        sql = 'INSERT INTO conference (%s) VALUES (%s)' % (
+            ', '.join(columns), ', '.join('?' * len(columns)))
+        conf_ids = []
+        with self.db:
+            for conf in conferences:
+                cursor = self.db.execute(
+                    sql, [_toText(conf.get(field)) for field in columns])
+                conf_ids.append(cursor.lastrowid)
+                self.db.executemany(
+                    'INSERT OR IGNORE INTO conference_topic VALUES (?, ?)',
+                    [(topic, cursor.lastrowid)
+                     for topic in conf.get('topics') or ()])
+        return conf_ids
+
+    def _conferenceRecords(self, rows):
+        """Turn conference rows into records, topics in one query."""
+        records = [dict(row) for row in rows]
+        by_id = dict((record['id'], record) for record in records)
+        for record in records:
+            record['topics'] = []
+            record['startDate'] = dateFromText(record['startDate'])
+            record['endDate'] = dateFromText(record['endDate'])
+        if by_id:
+            for row in self.db.execute(
+                    'SELECT conferenceId, topic FROM conference_topic '
+                    'WHERE conferenceId IN (%s) ORDER BY topic' %
+                    ', '.join('?' * len(by_id)), by_id.keys()):
+                by_id[row[0]]['topics'].append(row[1])
+        return records
+
+    def getConferences(self, conf_ids):
+        if not conf_ids:
+            return []
+        rows = self.db.execute(
+            'SELECT * FROM conference WHERE id IN (%s)' %
+            ', '.join('?' * len(conf_ids)), list(conf_ids)).fetchall()
+        by_id = dict((r['id'], r) for r in self._conferenceRecords(rows))
+        return [by_id.get(conf_id) for conf_id in conf_ids]
+
+    def queryConferences(self, filters, limit=None):
+        inequality = checkFilters(filters)
+        where = []
+        params = []
+        for field, operator, value in filters:
+            if field == 'topics':
+                # like a repeated property: any topic satisfies it
+                where.append('EXISTS (SELECT 1 FROM conference_topic t '
+                             'WHERE t.conferenceId = c.id AND t.topic %s ?)'
+                             % operator)
+            else:
+                where.append('c.%s %s ?' % (field, operator))
+            params.append(value)
+        order = ['c.name', 'c.id']
+        if inequality and inequality != 'topics':
+            order.insert(0, 'c.%s' % inequality)
+        sql = 'SELECT c.* FROM conference c'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ' + ', '.join(order)
+        if limit:
+            sql += ' LIMIT %d' % limit
+        return self._conferenceRecords(self.db.execute(sql, params))
+
+    def getConferencesCreated(self, user_id):
+        return self._conferenceRecords(self.db.execute(
+            'SELECT * FROM conference WHERE organizerUserId = ? '
+            'ORDER BY name, id', (user_id,)))
+
+    # - - - Sessions & speakers - - - - - - - - - - - - - - -
+
+    def putSessions(self, sessions):
+        columns = ['conferenceId', 'speakerId'] + [
+            f for f in SESSION_FIELDS if f != 'speaker']
+        sql = 'INSERT INTO session (%s) VALUES (%s)' % (
+            ', '.join(columns), ', '.join('?' * len(columns)))
+        ses_ids = []
+        with self.db:
+            for session in sessions:
+                name = ' '.join(session['speaker'].split())
+                self.db.execute(
+                    'INSERT OR IGNORE INTO speaker VALUES (?, ?)',
+                    (speakerId(name), name))
+                cursor = self.db.execute(sql, [
+                    session['conferenceId'], speakerId(name)] + [
+                    _toText(session.get(field)) for field in columns[2:]])
+                ses_ids.append(cursor.lastrowid)
+        return ses_ids
+
+    def _sessionRecords(self, where, params):
+        records = []
+        for row in self.db.execute(
+                'SELECT s.*, p.name AS speaker FROM session s '
+                'JOIN speaker p ON p.id = s.speakerId WHERE ' + where +
+                ' ORDER BY s.date, s.startTime, s.name, s.id', params):
+            record = dict(row)
+            del record['speakerId']
+            record['date'] = dateFromText(record['date'])
+            record['startTime'] = timeFromText(record['startTime'])
+            records.append(record)
+        return records
+
+    def getConferenceSessions(self, conf_id, typeOfSession=None):
+        if typeOfSession is None:
+            return self._sessionRecords('s.conferenceId = ?', (conf_id,))
+        return self._sessionRecords(
+            's.conferenceId = ? AND s.typeOfSession = ?',
+            (conf_id, typeOfSession))
+
+    def getSessionsBetween(self, conf_id, date, start, end):
+        return self._sessionRecords(
+            's.conferenceId = ? AND s.date = ? AND s.startTime >= ? '
+            'AND s.startTime <= ?',
+            (conf_id, _toText(date), _toText(start), _toText(end)))
+
+    def getSpeakerSessions(self, name):
+        return self._sessionRecords('s.speakerId = ?', (speakerId(name),))
+
+    def listSpeakers(self, limit, pageToken=None):
+        # the token is the offset of the next page
+        try:
+            offset = int(pageToken or 0)
+        except ValueError:
+            raise ValueError('Invalid pageToken %r' % pageToken)
+        if offset < 0:
+            raise ValueError('Invalid pageToken %r' % pageToken)
+        rows = self.db.execute(
+            'SELECT p.id, p.name, COUNT(s.id) AS sessionCount '
+            'FROM speaker p LEFT JOIN session s ON s.speakerId = p.id '
+            'GROUP BY p.id ORDER BY p.name, p.id LIMIT ? OFFSET ?',
+            (limit + 1, offset)).fetchall()
+        records = [dict(row) for row in rows[:limit]]
+        by_id = dict((record.pop('id'), record) for record in records)
+        for record in records:
+            record['conferenceNames'] = []
+        if by_id:
+            for row in self.db.execute(
+                    'SELECT DISTINCT s.speakerId, c.name FROM session s '
+                    'JOIN conference c ON c.id = s.conferenceId '
+                    'WHERE s.speakerId IN (%s) ORDER BY c.name' %
+                    ', '.join('?' * len(by_id)), by_id.keys()):
+                by_id[row[0]]['conferenceNames'].append(row[1])
+        next_token = str(offset + limit) if len(rows) > limit else None
+        return records, next_token
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""
+storage_ndb.py -- the storage.Repository interface on the datastore
+
+Ids are websafe keys, as in the API; conferences are created under
+conferenceParentKey() and sessions under their conference, and the
+speaker directory & agenda are kept up to date the way createSession
+does. Session listings are answered from the agenda, as the API always
+has.
+
+"""
+
+from collections import defaultdict
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from agenda import entriesBetween
+from agenda import entriesOfType
+from agenda import getAgenda
+from agenda import putSessions
+from geo import locateConference
+from models import Conference
+from models import Profile
+from models import Session
+from models import Speaker
+from schedule import parseDuration
+from settings import CONFERENCE_KEY_STRATEGY
+from speakers import addSpeakerSessionsMulti
+from speakers import getSpeaker
+from speakers import getSpeakerSessionKeys
+from speakers import speakerKey
+from storage import CONFERENCE_FIELDS
+from storage import PROFILE_FIELDS
+from storage import Repository
+from storage import SESSION_FIELDS
+from storage import checkFilters
+from storage import dateFromText
+from storage import timeFromText
+
+PROPERTIES = {
+    'city': Conference.city,
+    'topics': Conference.topics,
+    'month': Conference.month,
+    'maxAttendees': Conference.maxAttendees,
+}
+
+
+def _record(entity, fields, **extra):
+    record = dict((field, getattr(entity, field)) for field in fields)
+    record['id'] = entity.key.urlsafe()
+    record.update(extra)
+    return record
+
+
+def _conferenceRecord(conf):
+    return _record(conf, CONFERENCE_FIELDS)
+
+
+def _entryRecord(entry, conf_id):
+    """Turn an agenda entry into a session record."""
+    record = dict((field, entry.get(field)) for field in SESSION_FIELDS)
+    record['id'] = entry['websafeKey']
+    record['conferenceId'] = conf_id
+    record['date'] = dateFromText(entry['date'])
+    record['startTime'] = timeFromText(entry['startTime'])
+    return record
+
+
+def conferenceParentKey(user_id):
+    """Return the parent key for a new Conference of user_id: the
+    organizer's Profile key, or None under the 'flat' key strategy.
+    """
+    if CONFERENCE_KEY_STRATEGY == 'flat':
+        return None
+    return ndb.Key(Profile, user_id)
+
+
+class NdbRepository(Repository):
+    """Repository in the datastore."""
+
+    # - - - Profiles - - - - - - - - - - - - - - - - - - - -
+
+    def putProfile(self, profile):
+        Profile(id=profile['userId'], **dict(
+            (field, profile[field]) for field in PROFILE_FIELDS
+            if profile.get(field) is not None)).put()
+
+    def getProfiles(self, user_ids):
+        return [_record(prof, PROFILE_FIELDS, userId=prof.key.id())
+                if prof else None
+                for prof in ndb.get_multi(
+                    [ndb.Key(Profile, user_id) for user_id in user_ids])]
+
+    # - - - Conferences - - - - - - - - - - - - - - - - - - -
+
+    def putConferences(self, conferences):
+        confs = [Conference(parent=conferenceParentKey(
+                     conf['organizerUserId']), **dict(
+                     (field, conf[field]) for field in CONFERENCE_FIELDS
+                     if conf.get(field) is not None))
+                 for conf in conferences]
+        for conf in confs:
+            locateConference(conf)
+        return [c_key.urlsafe() for c_key in ndb.put_multi(confs)]
+
+    def getConferences(self, conf_ids):
+        # the key of another kind (a session's, say) finds no conference
+        return [_conferenceRecord(conf)
+                if isinstance(conf, Conference) else None
+                for conf in ndb.get_multi(
+                    [ndb.Key(urlsafe=conf_id) for conf_id in conf_ids])]
+
+    def queryConferences(self, filters, limit=None):
+        inequality = checkFilters(filters)
+        q = Conference.query()
+        if inequality:
+            q = q.order(PROPERTIES[inequality])
+        q = q.order(Conference.name)
+        for field, operator, value in filters:
+            q = q.filter(ndb.query.FilterNode(
+                PROPERTIES[field]._name, operator, value))
+        return [_conferenceRecord(conf) for conf in q.fetch(limit)]
+
+    def getConferencesCreated(self, user_id):
+        # root-keyed conferences (from the 'flat' key strategy) are only
+        # found by the organizer property, which is eventually
+        # consistent; those under the Profile come from the strongly
+        # consistent ancestor query, so a new one is never missed
+        by_property = Conference.query(
+            Conference.organizerUserId == user_id).fetch_async()
+        p_key = conferenceParentKey(user_id)
+        confs = {}
+        if p_key is not None:
+            confs.update((conf.key, conf) for conf in Conference.query(
+                ancestor=p_key).fetch())
+        for conf in by_property.get_result():
+            # the ancestor query has the Profile's group right
+            if p_key is None or conf.key.parent() != p_key:
+                confs[conf.key] = conf
+        return [_conferenceRecord(conf) for conf in
+                sorted(confs.itervalues(), key=lambda c: (c.name, c.key))]
+
+    # - - - Sessions & speakers - - - - - - - - - - - - - - -
+
+    def putSessions(self, sessions):
+        confs = dict((conf_id, ndb.Key(urlsafe=conf_id)) for conf_id in
+                     set(session['conferenceId'] for session in sessions))
+        names = dict(zip(confs, [conf.name for conf in
+                                 ndb.get_multi(confs.values())]))
+        # agenda entries carry the name the directory already has
+        sp_keys = list(set(speakerKey(session['speaker'])
+                           for session in sessions))
+        speaker_names = dict((speaker.key, speaker.name) for speaker in
+                             ndb.get_multi(sp_keys) if speaker)
+
+        entities = []
+        for session in sessions:
+            fields = dict((field, session[field]) for field in
+                          SESSION_FIELDS if session.get(field) is not None)
+            fields['speaker'] = speakerKey(session['speaker'])
+            if 'durationMinutes' not in fields:
+                fields['durationMinutes'] = parseDuration(
+                    session.get('duration'))
+            entities.append(Session(**fields))
+
+        # one id range per conference; its sessions & agenda are then
+        # written together
+        agendas = defaultdict(list)
+        for session, entity in zip(sessions, entities):
+            agendas[confs[session['conferenceId']]].append(
+                (entity, speaker_names.get(
+                    entity.speaker, ' '.join(session['speaker'].split()))))
+        for c_key, entries in agendas.iteritems():
+            start, _ = Session.allocate_ids(size=len(entries), parent=c_key)
+            for i, (entity, _) in enumerate(entries):
+                entity.key = ndb.Key(Session, start + i, parent=c_key)
+            putSessions(c_key, entries)
+        ses_keys = [entity.key for entity in entities]
+
+        speakers = defaultdict(lambda: ([], set()))
+        for session, ses_key in zip(sessions, ses_keys):
+            s_keys, conf_names = speakers[session['speaker']]
+            s_keys.append(ses_key)
+            conf_names.add(names[session['conferenceId']])
+        addSpeakerSessionsMulti([(name, s_keys, conf_names) for
+                                 name, (s_keys, conf_names) in
+                                 speakers.iteritems()])
+        return [ses_key.urlsafe() for ses_key in ses_keys]
+
+    def _sessionRecords(self, sessions):
+        """Turn sessions into records, their speakers in one batch get."""
+        s_keys = list(set(session.speaker for session in sessions))
+        speakers = dict((s_key, speaker.name if speaker else s_key.id())
+                        for s_key, speaker in
+                        zip(s_keys, ndb.get_multi(s_keys)))
+        return [_record(session, SESSION_FIELDS,
+                        speaker=speakers[session.speaker],
+                        conferenceId=session.key.parent().urlsafe())
+                for session in sessions]
+
+    def getConferenceSessions(self, conf_id, typeOfSession=None):
+        entries = getAgenda(ndb.Key(urlsafe=conf_id))
+        if typeOfSession is not None:
+            entries = entriesOfType(entries, typeOfSession)
+        return [_entryRecord(entry, conf_id) for entry in entries]
+
+    def getSessionsBetween(self, conf_id, date, start, end):
+        return [_entryRecord(entry, conf_id) for entry in entriesBetween(
+            getAgenda(ndb.Key(urlsafe=conf_id)), date, start, end)]
+
+    def getSpeakerSessions(self, name):
+        speaker = getSpeaker(name)
+        if not speaker:
+            return []
+        sessions = [session for session in
+                    ndb.get_multi(getSpeakerSessionKeys(speaker))
+                    if session]
+        sessions.sort(key=lambda s: (s.date, s.startTime, s.name))
+        return self._sessionRecords(sessions)
+
+    def listSpeakers(self, limit, pageToken=None):
+        try:
+            cursor = Cursor(urlsafe=pageToken) if pageToken else None
+        except Exception:
+            raise ValueError('Invalid pageToken %r' % pageToken)
+        speakers, next_cursor, more = Speaker.query().order(
+            Speaker.name).fetch_page(limit, start_cursor=cursor)
+        return ([{'name': speaker.name,
+                  'sessionCount': len(speaker.sessionKeys),
+                  'conferenceNames': speaker.conferenceNames}
+                 for speaker in speakers],
+                next_cursor.urlsafe() if more else None)
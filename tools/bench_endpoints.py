@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""
+bench_endpoints.py -- latency of the multi-stage read endpoints under
+    the local testbed, the baseline (d7469d4) implementations vs. the
+    ndb tasklet versions
+
+    python tools/bench_endpoints.py --latency-ms 20 --repeat 50
+
+Stub RPCs complete instantly, so --latency-ms gives every datastore RPC
+a simulated round trip; overlapping RPCs then overlap their latency.
+The baselines are the endpoint bodies of d7469d4, verbatim but for
+self; that code kept registrations on Profile.conferenceKeysToAttend,
+which is seeded alongside Registrations (the current code reads both).
+The ndb context cache is on, and cleared before every call as a new
+request's would be.
+
+"""
+
+import argparse
+from datetime import date, time
+
+import harness
+from harness import ndb
+
+from protorpc import message_types
+
+from conference import CONF_GET_REQUEST
+from conference import ConferenceApi
+from models import Attendance
+from models import Conference
+from models import ConferenceForms
+from models import Profile
+from models import Registration
+from models import Session
+from models import SessionForms
+from models import Speaker
+from models import TeeShirtSize
+from utils import getUserId
+
+import endpoints
+
+USER = 'attendee@example.com'
+
+
+def seed(conferences, sessions):
+    """Create organizers, conferences and sessions; register USER for all
+    conferences and wishlist every session of the first one.
+    """
+    organizers = [Profile(id='organizer%d@example.com' % i,
+                          displayName='Organizer %d' % i)
+                  for i in range(conferences)]
+    ndb.put_multi(organizers)
+    confs = [Conference(parent=org.key, name='Conference %d' % i,
+                        organizerUserId=org.key.id(), city='London',
+                        maxAttendees=100, seatsAvailable=99)
+             for i, org in enumerate(organizers)]
+    ndb.put_multi(confs)
+    speakers = [Speaker(id='Speaker %d' % i, name='Speaker %d' % i)
+                for i in range(sessions)]
+    ndb.put_multi(speakers)
+    sess = [Session(parent=confs[0].key, name='Session %d' % i,
+                    speaker=speakers[i].key, date=date(2026, 11, 1),
+                    startTime=time(9 + i % 8), typeOfSession='talk')
+            for i in range(sessions)]
+    ndb.put_multi(sess)
+    Profile(id=USER, displayName='Attendee', mainEmail=USER,
+            sessionWishlist=[s.key.urlsafe() for s in sess],
+            conferenceKeysToAttend=[c.key.urlsafe() for c in confs]).put()
+    ndb.put_multi([Registration(parent=c.key, id=USER, userId=USER)
+                   for c in confs] +
+                  [Attendance(id=c.key.urlsafe(),
+                              parent=ndb.Key(Profile, USER))
+                   for c in confs])
+    return confs[0].key.urlsafe()
+
+
+# - - - baselines: d7469d4's endpoint bodies - - - - - - - - - - -
+
+def baselineProfile():
+    # make sure user is authed
+    user = endpoints.get_current_user()
+    if not user:
+        raise endpoints.UnauthorizedException('Authorization required')
+
+    # get Profile from datastore
+    user_id = getUserId(user)
+    p_key = ndb.Key(Profile, user_id)
+    profile = p_key.get()
+    # create new Profile if not there
+    if not profile:
+        profile = Profile(
+            key=p_key,
+            displayName=user.nickname(),
+            mainEmail=user.email(),
+            teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
+        )
+        profile.put()
+    return profile
+
+
+def baselineConferencesToAttend(api):
+    prof = baselineProfile()  # get user Profile
+    conf_keys = [ndb.Key(urlsafe=wsck)
+                 for wsck in prof.conferenceKeysToAttend]
+    confs = ndb.get_multi(conf_keys)
+
+    # get organizers
+    organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in confs]
+    profiles = ndb.get_multi(organisers)
+
+    # put display names in a dict for easier fetching
+    names = {}
+    for profile in profiles:
+        names[profile.key.id()] = profile.displayName
+
+    # return set of ConferenceForm objects per Conference
+    return ConferenceForms(
+        items=[api._copyConferenceToForm(
+                conf, names[conf.organizerUserId]) for conf in confs])
+
+
+def baselineConfSessionsInWishlist(api, wsck):
+    conf = ndb.Key(urlsafe=wsck).get()
+
+    # need to fetch all session in the conference
+    conf_sessions = Session.query(ancestor=conf.key)
+    confSes_keys = [ses.key for ses in conf_sessions]
+    prof = baselineProfile()  # get user Profile
+
+    wishlist_keys = [ndb.Key(urlsafe=wsck)
+                     for wsck in prof.sessionWishlist]
+
+    session_keys = []
+    for s_key in wishlist_keys:
+        if s_key in confSes_keys:
+            session_keys.append(s_key)
+    sessions = ndb.get_multi(session_keys)
+
+    # return set of SessionForm objects per Session
+    return SessionForms(items=[api._copySessionToForm(
+                        ses, getattr(conf, 'name')) for ses in sessions])
+
+
+def report(name, baseline, tasklet):
+    p50b = harness.percentile(baseline, 50)
+    p50t = harness.percentile(tasklet, 50)
+    print '%-28s baseline p50 %7.1f ms  tasklet p50 %7.1f ms  (-%.0f%%)' % (
+        name, p50b, p50t, 100.0 * (p50b - p50t) / p50b if p50b else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--conferences', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=20)
+    args = parser.parse_args()
+
+    tb = harness.activate()
+    # as in production; timeit clears it before each call
+    ndb.get_context().set_cache_policy(None)
+    harness.loginAs(USER)
+    wsck = seed(args.conferences, args.sessions)
+    harness.setRpcLatency(args.latency_ms / 1000.0)
+    api = ConferenceApi()
+    req = CONF_GET_REQUEST.combined_message_class(websafeConferenceKey=wsck)
+
+    report('getConferencesToAttend',
+           harness.timeit(lambda: baselineConferencesToAttend(api),
+                          args.repeat),
+           harness.timeit(lambda: api.getConferencesToAttend(
+               message_types.VoidMessage()), args.repeat))
+    report('getConfSessionsInWishlist',
+           harness.timeit(lambda: baselineConfSessionsInWishlist(api, wsck),
+                          args.repeat),
+           harness.timeit(lambda: api.getConfSessionsInWishlist(req),
+                          args.repeat))
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
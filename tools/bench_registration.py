@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+bench_registration.py -- registration throughput for one hot conference,
+    transactional registerForConference vs. queued group commit
+
+    python tools/bench_registration.py --users 2000 --latency-ms 10
+
+The direct path runs one cross-group transaction per user. The queued
+path enqueues a ticket per user, then drains the pull queue with the
+batch worker (one conference write per batch).
+
+"""
+
+import argparse
+import time
+
+import harness
+from harness import ndb
+
+from conference import CONF_GET_REQUEST
+from conference import ConferenceApi
+from models import Conference
+from models import Profile
+
+import endpoints
+
+
+def seed(users, seats):
+    """Create the hot conference and a Profile per simulated user."""
+    org = Profile(id='organizer@example.com', displayName='Organizer')
+    org.put()
+    conf = Conference(parent=org.key, name='Flash Sale Conf',
+                      organizerUserId=org.key.id(),
+                      maxAttendees=seats, seatsAvailable=seats)
+    conf.put()
+    ndb.put_multi([Profile(id=email(i), mainEmail=email(i),
+                           displayName='User %d' % i)
+                   for i in range(users)])
+    return conf.key
+
+
+def email(i):
+    return 'user%d@example.com' % i
+
+
+def runDirect(api, request, users):
+    for i in range(users):
+        harness.loginAs(email(i))
+        try:
+            api.registerForConference(request)
+        except endpoints.ServiceException:
+            pass
+
+
+def runQueued(api, request, users):
+    for i in range(users):
+        harness.loginAs(email(i))
+        api.queueRegistration(request)
+    ConferenceApi._applyQueuedRegistrations(request.websafeConferenceKey)
+
+
+def measure(name, func, api, c_key, users):
+    request = CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=c_key.urlsafe())
+    start = time.time()
+    func(api, request, users)
+    elapsed = time.time() - start
+    conf = c_key.get()
+    print '%-8s %6d users in %6.2fs  %8.1f registrations/s  seats left %d' % (
+        name, users, elapsed, users / elapsed, conf.seatsAvailable)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seats', type=int, default=800)
+    parser.add_argument('--latency-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    for name, func in (('direct', runDirect), ('queued', runQueued)):
+        tb = harness.activate()
+        c_key = seed(args.users, args.seats)
+        harness.setRpcLatency(args.latency_ms / 1000.0)
+        measure(name, func, ConferenceApi(), c_key, args.users)
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""
+bench_storage.py -- the same seed, read workload & result checks on
+    each storage engine (storage.py), ndb on the local testbed vs.
+    embedded SQLite
+
+    python tools/bench_storage.py --conferences 500 --sessions 20 \\
+        --repeat 100 --latency-ms 5 --sqlite-db /tmp/conference.db
+
+Both engines get identical generated data. Every query's results are
+compared across engines (ids differ, so by conference & session
+names); any mismatch is reported and fails the run.
+
+"""
+
+import argparse
+import random
+from datetime import date, time
+
+import harness
+
+from storage import SqliteRepository
+from storage_ndb import NdbRepository
+
+CITIES = ['London', 'Paris', 'Chicago', 'Tokyo', 'Berlin', 'Lagos']
+TOPICS = ['Web', 'Mobile', 'Cloud', 'Data', 'Security', 'Design', 'Games']
+TYPES = ['talk', 'workshop', 'keynote', 'lightning']
+
+
+def generate(conferences, sessions, speakers, seed=0):
+    """Return (profiles, conferences, sessions) records; sessions name
+    their conference by index.
+    """
+    rand = random.Random(seed)
+    organizers = ['organizer%d@example.com' % i
+                  for i in range(max(1, conferences // 10))]
+    profiles = [{'userId': user_id, 'displayName': user_id.split('@')[0],
+                 'mainEmail': user_id, 'teeShirtSize': 'M_M'}
+                for user_id in organizers]
+    confs = []
+    for n in range(conferences):
+        month = rand.randint(1, 12)
+        seats = rand.choice([50, 100, 200, 500, 1000])
+        confs.append({
+            'name': 'Conference %05d' % n,
+            'organizerUserId': rand.choice(organizers),
+            'city': rand.choice(CITIES),
+            'topics': rand.sample(TOPICS, rand.randint(1, 3)),
+            'startDate': date(2027, month, 1), 'month': month,
+            'endDate': date(2027, month, 3),
+            'maxAttendees': seats, 'seatsAvailable': seats})
+    sess = []
+    for n in range(conferences):
+        for i in range(sessions):
+            sess.append({
+                'conference': n, 'name': 'Session %05d-%03d' % (n, i),
+                'speaker': 'Speaker %d' % rand.randrange(speakers),
+                'typeOfSession': rand.choice(TYPES),
+                'date': date(2027, confs[n]['month'], rand.randint(1, 3)),
+                'startTime': time(rand.randint(8, 18), rand.choice([0, 30])),
+                'duration': '30', 'durationMinutes': 30,
+                'location': 'Room %d' % (i % 5)})
+    return profiles, confs, sess
+
+
+def seed(repo, data):
+    profiles, confs, sess = data
+    for profile in profiles:
+        repo.putProfile(profile)
+    conf_ids = repo.putConferences(confs)
+    for session in sess:
+        session['conferenceId'] = conf_ids[session['conference']]
+    repo.putSessions(sess)
+    return conf_ids
+
+
+def names(records):
+    return [record['name'] for record in records]
+
+
+def speakerPage(repo, page, size=20):
+    """Return the records of a page of the speaker directory, following
+    the engine's page tokens from the first.
+    """
+    speakers, token = repo.listSpeakers(size)
+    for _ in range(page):
+        speakers, token = repo.listSpeakers(size, token)
+    return speakers
+
+
+def workload(repo, conf_ids, profiles):
+    """Return (name, function(i)) pairs; each returns comparable
+    results.
+    """
+    def conf(i):
+        return conf_ids[i % len(conf_ids)]
+
+    return [
+        ('getConference', lambda i: repo.getConference(conf(i))['name']),
+        ('getProfile',
+         lambda i: repo.getProfile(
+             profiles[i % len(profiles)]['userId'])['displayName']),
+        ('query city', lambda i: names(repo.queryConferences(
+            [('city', '=', CITIES[i % len(CITIES)])], 20))),
+        ('query city+month', lambda i: names(repo.queryConferences(
+            [('city', '=', CITIES[i % len(CITIES)]),
+             ('month', '>=', i % 12 + 1)], 20))),
+        ('query topic', lambda i: names(repo.queryConferences(
+            [('topics', '=', TOPICS[i % len(TOPICS)])], 20))),
+        ('query seats', lambda i: names(repo.queryConferences(
+            [('maxAttendees', '>', 100)], 20))),
+        ('conferencesCreated', lambda i: names(repo.getConferencesCreated(
+            profiles[i % len(profiles)]['userId']))),
+        ('conferenceSessions',
+         lambda i: names(repo.getConferenceSessions(conf(i)))),
+        ('sessionsByType', lambda i: names(repo.getConferenceSessions(
+            conf(i), TYPES[i % len(TYPES)]))),
+        ('sessionsBetween', lambda i: names(repo.getSessionsBetween(
+            conf(i), repo.getConference(conf(i))['startDate'],
+            time(9), time(13)))),
+        ('speakerSessions', lambda i: names(repo.getSpeakerSessions(
+            'speaker  %d' % (i % 50)))),
+        ('listSpeakers', lambda i: speakerPage(repo, i % 5)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--conferences', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=10,
+                        help='sessions per conference')
+    parser.add_argument('--speakers', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='simulated datastore RPC latency')
+    parser.add_argument('--sqlite-db', default=':memory:')
+    args = parser.parse_args()
+
+    tb = harness.activate()
+    data = generate(args.conferences, args.sessions, args.speakers)
+    engines = [('ndb', NdbRepository()),
+               ('sqlite', SqliteRepository(args.sqlite_db))]
+    results = {}
+    latencies = {}
+    for engine, repo in engines:
+        conf_ids = []
+        seed_ms = harness.timeit(
+            lambda: conf_ids.extend(seed(repo, data)), 1)[0]
+        print '%-8s seeded in %.0f ms' % (engine, seed_ms)
+        if engine == 'ndb' and args.latency_ms:
+            harness.setRpcLatency(args.latency_ms / 1000.0)
+        for name, func in workload(repo, conf_ids, data[0]):
+            calls = iter(range(args.repeat))
+            found = []
+            latencies[engine, name] = harness.timeit(
+                lambda: found.append(func(next(calls))), args.repeat)
+            results[engine, name] = found
+
+    print '%-20s %12s %12s %12s %12s' % (
+        'operation', 'ndb p50', 'ndb p99', 'sqlite p50', 'sqlite p99')
+    mismatches = 0
+    for name, _ in workload(None, [], []):
+        print '%-20s %9.2f ms %9.2f ms %9.2f ms %9.2f ms' % ((name,) + tuple(
+            harness.percentile(latencies[engine, name], pct)
+            for engine, _ in engines for pct in (50, 99)))
+        if results['ndb', name] != results['sqlite', name]:
+            mismatches += 1
+            print '  RESULTS DIFFER for %s' % name
+    print 'results match' if not mismatches else \
+        '%d operations differ' % mismatches
+    tb.deactivate()
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
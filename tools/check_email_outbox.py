@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+check_email_outbox.py -- bulk conference creation against the local
+    taskqueue & mail stubs, checking the confirmation email outbox
+
+    python tools/check_email_outbox.py --organizers 5 --conferences 200
+
+Every conference queues one outbox notification; draining the outbox
+must send one email per organizer (per BATCH_SIZE notifications), each
+within the size cap.
+
+"""
+
+import argparse
+import time
+
+import harness
+from harness import testbed
+
+from conference import ConferenceApi
+from models import ConferenceForm
+from notifications import BATCH_SIZE
+from notifications import MAX_EMAIL_CHARS
+from notifications import OUTBOX_QUEUE
+from notifications import sendQueuedNotifications
+
+
+def email(i):
+    return 'organizer%d@example.com' % i
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--organizers', type=int, default=5)
+    parser.add_argument('--conferences', type=int, default=200)
+    args = parser.parse_args()
+
+    tb = harness.activate()
+    api = ConferenceApi()
+    for n in range(args.conferences):
+        harness.loginAs(email(n % args.organizers))
+        api.createConference(ConferenceForm(
+            name='Conference %d' % n, city='London',
+            topics=['Topic %d' % (n % 7)], maxAttendees=100))
+
+    taskqueue_stub = tb.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    queued = len(taskqueue_stub.get_filtered_tasks(
+        queue_names=[OUTBOX_QUEUE]))
+    start = time.time()
+    sent = sendQueuedNotifications()
+    elapsed = time.time() - start
+
+    messages = tb.get_stub(testbed.MAIL_SERVICE_NAME).get_sent_messages()
+    recipients = sorted(m.to for m in messages)
+    largest = max(len(m.body.decode()) for m in messages) if messages else 0
+    left = len(taskqueue_stub.get_filtered_tasks(queue_names=[OUTBOX_QUEUE]))
+    print '%d notifications queued, %d emails sent in %.2fs, %d left' % (
+        queued, sent, elapsed, left)
+    print 'largest body %d chars (cap %d)' % (largest, MAX_EMAIL_CHARS)
+
+    assert queued == args.conferences, 'one notification per conference'
+    assert set(recipients) == set(email(i) for i in range(args.organizers)), \
+        'every organizer notified'
+    assert len(recipients) == len(set(recipients)) or \
+        args.conferences > args.organizers * BATCH_SIZE, \
+        'one email per organizer'
+    assert largest <= MAX_EMAIL_CHARS + 100, 'email body over the cap'
+    assert left == 0, 'outbox not drained'
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+fake_tokeninfo.py -- local stand-in for the Google tokeninfo endpoint
+
+    python tools/fake_tokeninfo.py --port 8089 --fail-every 3
+    TOKENINFO_URL=http://localhost:8089/tokeninfo dev_appserver.py .
+
+Any token of the form "user-<id>" is valid for user_id <id>; everything
+else gets the 400 invalid_token response. Lookups are counted so cache
+hit rates can be checked at /stats.
+
+"""
+
+import argparse
+import json
+import threading
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+STATS = {'lookups': 0}
+_lock = threading.Lock()
+
+
+class TokenInfoHandler(BaseHTTPRequestHandler):
+    fail_every = 0
+    expires_in = 3600
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body))
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == '/stats':
+            return self._send(200, STATS)
+        with _lock:
+            STATS['lookups'] += 1
+            count = STATS['lookups']
+        if self.fail_every and count % self.fail_every == 0:
+            return self._send(503, {'error': 'backend_error'})
+
+        params = urlparse.parse_qs(url.query)
+        token = (params.get('access_token') or params.get('id_token') or
+                 [''])[0]
+        if not token.startswith('user-'):
+            return self._send(400, {'error': 'invalid_token'})
+        self._send(200, {'user_id': token[len('user-'):],
+                         'expires_in': self.expires_in})
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--fail-every', type=int, default=0,
+                        help='answer every Nth lookup with a 503')
+    parser.add_argument('--expires-in', type=int, default=3600)
+    args = parser.parse_args()
+    TokenInfoHandler.fail_every = args.fail_every
+    TokenInfoHandler.expires_in = args.expires_in
+    ThreadedHTTPServer(('', args.port), TokenInfoHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
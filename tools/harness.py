@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+harness.py -- local App Engine testbed shared by the benchmark and
+    load simulation scripts in this directory
+
+Point GAE_SDK at the Python App Engine SDK (defaults to
+/usr/local/google_appengine) before running any of the tools.
+
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SDK = os.environ.get('GAE_SDK', '/usr/local/google_appengine')
+
+
+def fixSysPath():
+    """Put the SDK and the app on sys.path."""
+    if SDK not in sys.path:
+        sys.path.insert(0, SDK)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+fixSysPath()
+
+from google.appengine.api import apiproxy_rpc
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import settings
+
+
+def activate(consistent=True):
+    """Activate a testbed with every stub the app touches."""
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.setup_env(app_id='conference-central-local', overwrite=True)
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1 if consistent else 0)
+    tb.init_datastore_v3_stub(consistency_policy=policy)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_urlfetch_stub()
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+    ndb.get_context().set_cache_policy(False)
+    # the tools call endpoints far faster than any client may
+    settings.RATE_LIMITS.clear()
+    return tb
+
+
+def loginAs(email):
+    """Make endpoints.get_current_user() return a user for email."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = ''
+    os.environ['USER_EMAIL'] = email
+
+
+class _LatentRPC(apiproxy_rpc.RPC):
+    """Stub RPC that completes no earlier than `latency` seconds after
+    it was issued, so RPCs in flight together overlap their latency as
+    they would against the production datastore.
+    """
+    latency = 0.0
+
+    def _MakeCallImpl(self):
+        self._issued = time.time()
+        apiproxy_rpc.RPC._MakeCallImpl(self)
+
+    def _WaitImpl(self):
+        remaining = self._issued + self.latency - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        return apiproxy_rpc.RPC._WaitImpl(self)
+
+
+def setRpcLatency(seconds, service='datastore_v3'):
+    """Give every RPC to service a fixed simulated round trip time."""
+    stub = apiproxy_stub_map.apiproxy.GetStub(service)
+    rpc_class = type('_LatentRPC', (_LatentRPC,), {'latency': seconds})
+    stub.CreateRPC = lambda: rpc_class(stub=stub)
+
+
+def percentile(samples, pct):
+    """Return the pct percentile of a list of numbers."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = int(round((len(ordered) - 1) * pct / 100.0))
+    return ordered[index]
+
+
+def timeit(func, repeat):
+    """Run func repeat times; return per-call latencies in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        ndb.get_context().clear_cache()
+        start = time.time()
+        func()
+        samples.append((time.time() - start) * 1000)
+    return samples
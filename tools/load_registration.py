@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+load_registration.py -- concurrent register/unregister load on a few hot
+    conferences, with an oversell check afterwards
+
+    python tools/load_registration.py --threads 16 --ops 4000 \\
+        --conferences 3 --seats 200 --users 1000 --unregister 0.2
+
+Worker threads run ConferenceApi._registerProfile (the body of the
+registerForConference / unregisterFromConference transaction) in their
+own cross-group transactions against the local datastore stub, so
+conflicting commits are retried as they would be in production. The
+in-memory stubs are per process, so the pool is a thread pool.
+
+Reports throughput, p50/p99 latency, transaction retries and failures,
+then checks per conference that seatsAvailable + registrations equals
+maxAttendees, that waitlistCount matches the waitlist, and that no user
+is both registered and waiting or registered twice.
+
+"""
+
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+
+import harness
+from harness import ndb
+
+from google.appengine.api import datastore_errors
+
+from conference import ConferenceApi
+from models import Conference
+from models import ConflictException
+from models import Profile
+from models import Registration
+from models import WaitlistEntry
+
+
+def email(i):
+    return 'user%d@example.com' % i
+
+
+def seed(conferences, seats, users):
+    org = Profile(id='organizer@example.com', displayName='Organizer')
+    org.put()
+    confs = [Conference(parent=org.key, name='Hot Conf %d' % n,
+                        organizerUserId=org.key.id(),
+                        maxAttendees=seats, seatsAvailable=seats)
+             for n in range(conferences)]
+    ndb.put_multi(confs)
+    ndb.put_multi([Profile(id=email(i), mainEmail=email(i),
+                           displayName='User %d' % i)
+                   for i in range(users)])
+    return [conf.key for conf in confs]
+
+
+class Worker(threading.Thread):
+    """Runs ops random register/unregister calls, recording latency &
+    outcome of each.
+    """
+    def __init__(self, c_keys, users, ops, unregister, retries):
+        threading.Thread.__init__(self)
+        self.c_keys = c_keys
+        self.users = users
+        self.ops = ops
+        self.unregister = unregister
+        self.retries = retries
+        self.latencies = []
+        self.outcomes = Counter()
+
+    def run(self):
+        for _ in range(self.ops):
+            p_key = ndb.Key(Profile, email(random.randrange(self.users)))
+            wsck = random.choice(self.c_keys).urlsafe()
+            reg = random.random() >= self.unregister
+            attempts = [0]
+
+            def txn():
+                attempts[0] += 1
+                return ConferenceApi._registerProfile(p_key, wsck, reg)
+
+            start = time.time()
+            try:
+                result = ndb.transaction(txn, xg=True, retries=self.retries)
+                self.outcomes['%s %s' % ('register' if reg else 'unregister',
+                                         'ok' if result.data else 'noop')] += 1
+            except ConflictException:
+                self.outcomes['register conflict'] += 1
+            except datastore_errors.TransactionFailedError:
+                self.outcomes['failed'] += 1
+            self.latencies.append((time.time() - start) * 1000)
+            self.outcomes['retries'] += attempts[0] - 1
+            ndb.get_context().clear_cache()
+
+
+def verify(c_keys):
+    """Return a list of invariant violations."""
+    errors = []
+    registered_anywhere = Counter()
+    for c_key in c_keys:
+        conf = c_key.get()
+        registered = [k.id() for k in Registration.query(
+            ancestor=c_key).fetch(keys_only=True)]
+        waiting = [k.id() for k in WaitlistEntry.query(
+            ancestor=c_key).fetch(keys_only=True)]
+        for user_id in registered:
+            registered_anywhere[(user_id, c_key)] += 1
+        if conf.seatsAvailable + len(registered) != conf.maxAttendees:
+            errors.append('%s: %d seats + %d registrations != %d' % (
+                conf.name, conf.seatsAvailable, len(registered),
+                conf.maxAttendees))
+        if conf.seatsAvailable < 0:
+            errors.append('%s: oversold by %d' % (
+                conf.name, -conf.seatsAvailable))
+        if conf.waitlistCount != len(waiting):
+            errors.append('%s: waitlistCount %d != %d waiting' % (
+                conf.name, conf.waitlistCount, len(waiting)))
+        both = set(registered) & set(waiting)
+        if both:
+            errors.append('%s: %d users registered and waiting' % (
+                conf.name, len(both)))
+    for prof in Profile.query():
+        for wsck in set(prof.conferenceKeysToAttend):
+            registered_anywhere[(prof.key.id(), ndb.Key(urlsafe=wsck))] += 1
+    doubles = [k for k, n in registered_anywhere.iteritems() if n > 1]
+    if doubles:
+        errors.append('%d double registrations' % len(doubles))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=2000,
+                        help='total register/unregister calls')
+    parser.add_argument('--conferences', type=int, default=3)
+    parser.add_argument('--seats', type=int, default=100)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--unregister', type=float, default=0.2,
+                        help='fraction of calls that unregister')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='transaction retries before failing')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    tb = harness.activate()
+    c_keys = seed(args.conferences, args.seats, args.users)
+    if args.latency_ms:
+        harness.setRpcLatency(args.latency_ms / 1000.0)
+
+    workers = [Worker(c_keys, args.users, args.ops // args.threads,
+                      args.unregister, args.retries)
+               for _ in range(args.threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    latencies = sum((w.latencies for w in workers), [])
+    outcomes = sum((w.outcomes for w in workers), Counter())
+    print '%d calls on %d threads in %.2fs: %.1f calls/s' % (
+        len(latencies), args.threads, elapsed, len(latencies) / elapsed)
+    print 'latency p50 %.1f ms  p99 %.1f ms' % (
+        harness.percentile(latencies, 50), harness.percentile(latencies, 99))
+    for name, count in sorted(outcomes.iteritems()):
+        print '  %-20s %6d' % (name, count)
+
+    # promote waitlisted users into seats freed during the run
+    for c_key in c_keys:
+        ConferenceApi._promoteWaitlist(c_key.urlsafe())
+    errors = verify(c_keys)
+    for error in errors:
+        print 'INVARIANT VIOLATED: %s' % error
+    print 'invariants hold' if not errors else '%d violations' % len(errors)
+    tb.deactivate()
+    raise SystemExit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
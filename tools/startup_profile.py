@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+startup_profile.py -- where a new instance's cold start goes: import &
+    initialization time per module, then the first requests with and
+    without the warmup handler
+
+    python tools/startup_profile.py --top 25 --latency-ms 10
+
+Run it in a fresh process; modules imported before the profiler starts
+(the standard library used by this script) aren't counted.
+
+"""
+
+import __builtin__
+import argparse
+import sys
+import time
+
+_real_import = __builtin__.__import__
+_stack = []
+TIMINGS = {}
+
+
+def _profiledImport(name, *args, **kwargs):
+    """__import__ recording inclusive & own time of first imports."""
+    before = set(sys.modules)
+    _stack.append(0.0)
+    start = time.time()
+    try:
+        return _real_import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        loaded = [m for m in set(sys.modules) - before if sys.modules[m]]
+        if loaded:
+            # attribute the time to the outermost new module
+            top = min(loaded, key=lambda m: m.count('.'))
+            total, own = TIMINGS.get(top, (0.0, 0.0))
+            TIMINGS[top] = (total + elapsed, own + elapsed - children)
+
+
+def profileImports():
+    __builtin__.__import__ = _profiledImport
+    start = time.time()
+    try:
+        import harness
+        import main  # imports conference.py & builds the API server
+    finally:
+        __builtin__.__import__ = _real_import
+    return harness, main, time.time() - start
+
+
+def report(top, total):
+    print 'imports & initialization: %.0f ms total' % (total * 1000)
+    print '%-40s %10s %10s' % ('module', 'total ms', 'own ms')
+    ranked = sorted(TIMINGS.iteritems(), key=lambda item: -item[1][1])
+    for name, (inclusive, own) in ranked[:top]:
+        print '%-40s %10.1f %10.1f' % (name, inclusive * 1000, own * 1000)
+
+
+def firstRequests(harness, latency):
+    """Time the first landing-page reads of a cold vs. a warmed instance."""
+    from protorpc import message_types
+    from conference import ConferenceApi
+    from models import Conference
+
+    for warm in (False, True):
+        tb = harness.activate()
+        Conference(name='Warm Conf', organizerUserId='org@example.com',
+                   maxAttendees=10, seatsAvailable=3).put()
+        harness.setRpcLatency(latency)
+        if warm:
+            start = time.time()
+            ConferenceApi._warmCaches()
+            print 'warmup handler            %8.1f ms' % (
+                (time.time() - start) * 1000)
+        api = ConferenceApi()
+        start = time.time()
+        api.getAnnouncement(message_types.VoidMessage())
+        api.getFeaturedSpeaker(message_types.VoidMessage())
+        print '%-25s %8.1f ms' % (
+            'first requests (%s)' % ('warm' if warm else 'cold'),
+            (time.time() - start) * 1000)
+        tb.deactivate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    harness, _, total = profileImports()
+    report(args.top, total)
+    print
+    firstRequests(harness, args.latency_ms / 1000.0)
+
+
+if __name__ == '__main__':
+    main()
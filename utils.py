@@ -1,11 +1,35 @@
+import hashlib
 import json
+import logging
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
 
+# override with a local fake of the tokeninfo service for testing
+TOKENINFO_URL = os.getenv('TOKENINFO_URL',
+                          'https://www.googleapis.com/oauth2/v1/tokeninfo')
+TOKENINFO_ATTEMPTS = 3
+TOKENINFO_DEADLINE = 5
+# all attempts of one lookup fit in this many seconds
+TOKENINFO_TIME_BUDGET = 6
+TOKENINFO_MIN_DEADLINE = 1
+TOKEN_CACHE_MAX_TTL = 3600
+TOKEN_CACHE_MAX_ENTRIES = 10000
+MEMCACHE_TOKEN_PREFIX = 'TOKEN_USER_ID:'
+
+# token hash -> (user_id, expires_at); shared by the instance's threads
+_token_cache = {}
+# token hash -> Event set when the tokeninfo lookup in flight ends, so
+# concurrent requests with one token hit tokeninfo once without
+# blocking requests with other tokens
+_token_lookups = {}
+_token_lookups_lock = threading.Lock()
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -15,25 +39,7 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return getUserIdFromToken(token)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
@@ -44,3 +50,100 @@ def getUserId(user, id_type="email"):
             return profile.id()
         else:
             return str(uuid.uuid1().get_hex())
+
+
+def getUserIdFromToken(token):
+    """Return the user_id tokeninfo reports for token, cached in-process
+    and in memcache until the token expires.
+    """
+    token_hash = hashlib.sha256(token).hexdigest()
+    user_id = _cachedUserId(token_hash)
+    if user_id:
+        return user_id
+
+    with _token_lookups_lock:
+        lookup = _token_lookups.get(token_hash)
+        owner = lookup is None
+        if owner:
+            lookup = _token_lookups[token_hash] = threading.Event()
+    if not owner:
+        # share the answer of the thread already asking
+        lookup.wait(TOKENINFO_TIME_BUDGET + 1)
+        return _cachedUserId(token_hash) or ''
+    try:
+        return _lookupUserId(token, token_hash)
+    finally:
+        with _token_lookups_lock:
+            del _token_lookups[token_hash]
+        lookup.set()
+
+
+def _lookupUserId(token, token_hash):
+    """Return the user_id of token from memcache or tokeninfo, caching
+    it in-process.
+    """
+    cached = memcache.get(MEMCACHE_TOKEN_PREFIX + token_hash)
+    if cached:
+        user_id, expires_at = cached
+    else:
+        user_id, expires_in = _fetchTokenInfo(token)
+        if not user_id:
+            return ''
+        ttl = min(expires_in, TOKEN_CACHE_MAX_TTL)
+        expires_at = time.time() + ttl
+        if ttl > 0:
+            memcache.set(MEMCACHE_TOKEN_PREFIX + token_hash,
+                         (user_id, expires_at), time=int(ttl))
+
+    if len(_token_cache) >= TOKEN_CACHE_MAX_ENTRIES:
+        now = time.time()
+        for key, (_, expiry) in _token_cache.items():
+            if expiry <= now:
+                _token_cache.pop(key, None)
+        if len(_token_cache) >= TOKEN_CACHE_MAX_ENTRIES:
+            _token_cache.clear()
+    _token_cache[token_hash] = (user_id, expires_at)
+    return user_id
+
+
+def _cachedUserId(token_hash):
+    """Return the in-process cached user_id for an unexpired token."""
+    cached = _token_cache.get(token_hash)
+    if cached and cached[1] > time.time():
+        return cached[0]
+    return None
+
+
+def _fetchTokenInfo(token):
+    """Ask tokeninfo about token, returning (user_id, expires_in).
+
+    Failed attempts are retried straight away, without sleeping the
+    serving thread; all of them end within TOKENINFO_TIME_BUDGET seconds.
+    """
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    give_up = time.time() + TOKENINFO_TIME_BUDGET
+    for i in range(TOKENINFO_ATTEMPTS):
+        remaining = give_up - time.time()
+        if remaining < TOKENINFO_MIN_DEADLINE:
+            break
+        url = '%s?%s=%s' % (TOKENINFO_URL, token_type, token)
+        try:
+            resp = urlfetch.fetch(url, deadline=min(TOKENINFO_DEADLINE,
+                                                    remaining))
+        except urlfetch.Error as e:
+            logging.warning('tokeninfo attempt %d failed: %s', i + 1, e)
+        else:
+            if resp.status_code == 200:
+                info = json.loads(resp.content)
+                return (info.get('user_id', ''),
+                        int(info.get('expires_in', 0)))
+            elif resp.status_code == 400 and \
+                    'invalid_token' in resp.content:
+                # not a failure: ask again as the other token type
+                token_type = 'access_token'
+                continue
+            logging.warning('tokeninfo attempt %d returned %d',
+                            i + 1, resp.status_code)
+    return '', 0